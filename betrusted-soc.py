@@ -271,7 +271,7 @@ class Platform(XilinxPlatform):
 # CRG ----------------------------------------------------------------------------------------------
 
 class CRG(Module, AutoCSR):
-    def __init__(self, platform, sys_clk_freq, spinor_edge_delay_ns=2.5):
+    def __init__(self, platform, sys_clk_freq, spinor_edge_delay_ns=2.5, spi_clk_freq=20e6):
         self.warm_reset = Signal()
 
         self.clock_domains.cd_sys   = ClockDomain()
@@ -306,7 +306,7 @@ class CRG(Module, AutoCSR):
         # we count on clocks being assigned to the MMCME2_ADV in order. If we make more MMCME2 or shift ordering, these constraints must change.
         mmcm.create_clkout(self.cd_sys, sys_clk_freq, margin=0) # there should be a precise solution by design
         platform.add_platform_command("create_generated_clock -name sys_clk [get_pins MMCME2_ADV/CLKOUT0]")
-        mmcm.create_clkout(self.cd_spi, 20e6)
+        mmcm.create_clkout(self.cd_spi, spi_clk_freq)  # COM SCLK can be divided down from this at run time, see SPIMaster.config
         platform.add_platform_command("create_generated_clock -name spi_clk [get_pins MMCME2_ADV/CLKOUT1]")
         mmcm.create_clkout(self.cd_spinor, sys_clk_freq, phase=phase)  # delayed version for SPINOR cclk (different from COM SPI above)
         platform.add_platform_command("create_generated_clock -name spinor [get_pins MMCME2_ADV/CLKOUT2]")
@@ -602,10 +602,14 @@ class BetrustedSoC(SoCCore):
         "spiflash": 0x20000000,
         "sram_ext": 0x40000000,
         "memlcd":   0xb0000000,
+        "com":      0xd0000000,
+        "comframe": 0xd1000000,
+        "i2cpoll":  0xd2000000,
+        "trng":     0xd3000000,
         "csr":      0xf0000000,
     }
 
-    def __init__(self, platform, sys_clk_freq=int(100e6), spiflash="spiflash_1x", **kwargs):
+    def __init__(self, platform, sys_clk_freq=int(100e6), spiflash="spiflash_1x", spi_clk_freq=20e6, **kwargs):
         assert sys_clk_freq in [int(12e6), int(100e6)]
 
         # CPU cluster
@@ -642,7 +646,7 @@ class BetrustedSoC(SoCCore):
         self.register_mem("vexriscv_debug", 0xe00f0000, self.cpu.debug_bus, 0x100)
 
         # Clockgen cluster -------------------------------------------------------------------------
-        self.submodules.crg = CRG(platform, sys_clk_freq, spinor_edge_delay_ns=2.2)
+        self.submodules.crg = CRG(platform, sys_clk_freq, spinor_edge_delay_ns=2.2, spi_clk_freq=spi_clk_freq)
         self.add_csr("crg")
         self.comb += self.crg.warm_reset.eq(warm_reset)
 
@@ -691,20 +695,34 @@ class BetrustedSoC(SoCCore):
         self.platform.add_platform_command("set_multicycle_path 1 -hold -through [get_pins betrustedsoc_sram_ext_sync_oe_n_reg/Q]")
 
         # LCD interface ----------------------------------------------------------------------------
-        self.submodules.memlcd = memlcd.MemLCD(platform.request("lcd"))
+        self.submodules.memlcd = memlcd.MemLCD(platform.request("lcd"), text_mode=True, dma=True)
         self.add_csr("memlcd")
-        self.register_mem("memlcd", self.mem_map["memlcd"], self.memlcd.bus, size=self.memlcd.fb_depth*4)
+        self.register_mem("memlcd", self.mem_map["memlcd"], self.memlcd.bus, size=self.memlcd.mem_size)
+        self.add_wb_master(self.memlcd.dma_bus)
 
         # COM SPI interface ------------------------------------------------------------------------
         self.submodules.com = spi.SPIMaster(platform.request("com"))
         self.add_csr("com")
+        self.register_mem("com", self.mem_map["com"], self.com.bus, size=4)
+        self.add_wb_master(self.com.dma_bus)
+        self.add_interrupt("com")
+        self.submodules.comframe = spi.SPIFramer(self.com)
+        self.add_csr("comframe")
+        self.register_mem("comframe", self.mem_map["comframe"], self.comframe.bus, size=4*256)
+        self.add_interrupt("comframe")
         # 20.83ns = 1/2 of 24MHz clock, we are doing falling-to-rising timing
         # up5k tsu = -0.5ns, th = 5.55ns, tpdmax = 10ns
         # in reality, we are measuring a Tpd from the UP5K of 17ns. Routed input delay is ~3.9ns, which means
         # the fastest clock period supported would be 23.9MHz - just shy of 24MHz, with no margin to spare.
         # slow down clock period of SPI to 20MHz, this gives us about a 4ns margin for setup for PVT variation
-        self.platform.add_platform_command("set_input_delay -clock [get_clocks spi_clk] -min -add_delay 0.5 [get_ports {{com_miso}}]") # could be as low as -0.5ns but why not
-        self.platform.add_platform_command("set_input_delay -clock [get_clocks spi_clk] -max -add_delay 17.5 [get_ports {{com_miso}}]")
+        if spi_clk_freq <= 20e6:
+            self.platform.add_platform_command("set_input_delay -clock [get_clocks spi_clk] -min -add_delay 0.5 [get_ports {{com_miso}}]") # could be as low as -0.5ns but why not
+            self.platform.add_platform_command("set_input_delay -clock [get_clocks spi_clk] -max -add_delay 17.5 [get_ports {{com_miso}}]")
+        # with com.config.late set, MISO is captured by the FDRE clocked on the falling edge of spi_clk, which is the
+        # SCLK rising edge following the one that launched it, so it gets a whole period. Above 20MHz only the late
+        # sample point can work, and com.config.late must be set.
+        self.platform.add_platform_command("set_input_delay -clock [get_clocks spi_clk] -clock_fall -min -add_delay 0.5 [get_ports {{com_miso}}]")
+        self.platform.add_platform_command("set_input_delay -clock [get_clocks spi_clk] -clock_fall -max -add_delay 17.5 [get_ports {{com_miso}}]")
         self.platform.add_platform_command("set_output_delay -clock [get_clocks spi_clk] -min -add_delay 6.0 [get_ports {{com_mosi com_csn}}]")
         self.platform.add_platform_command("set_output_delay -clock [get_clocks spi_clk] -max -add_delay 16.0 [get_ports {{com_mosi com_csn}}]")  # could be as large as 21ns but why not
         # cross domain clocking is handled with explicit software barrires, or with multiregs
@@ -712,8 +730,10 @@ class BetrustedSoC(SoCCore):
         self.platform.add_false_path_constraints(self.crg.cd_spi.clk, self.crg.cd_sys.clk)
 
         # I2C interface ----------------------------------------------------------------------------
-        self.submodules.i2c = i2c.RTLI2C(platform, platform.request("i2c", 0))
+        self.submodules.i2c = i2c.RTLI2C(platform, platform.request("i2c", 0), sys_clk_freq=sys_clk_freq)
         self.add_csr("i2c")
+        self.register_mem("i2cpoll", self.mem_map["i2cpoll"], self.i2c.poll_bus, size=4*8)
+        self.add_wb_master(self.i2c.dma_bus)
         self.add_interrupt("i2c")
 
         # Event generation for I2C and COM ---------------------------------------------------------
@@ -784,7 +804,7 @@ class BetrustedSoC(SoCCore):
         self.add_csr("spinor")
 
         # Keyboard module --------------------------------------------------------------------------
-        self.submodules.keyboard = ClockDomainsRenamer(cd_remapping={"kbd":"lpclk"})(keyboard.KeyScan(platform.request("kbd")))
+        self.submodules.keyboard = ClockDomainsRenamer(cd_remapping={"kbd":"lpclk"})(keyboard.KeyScan(platform.request("kbd"), timestamp=self.ticktimer.time.status))
         self.add_csr("keyboard")
         self.add_interrupt("keyboard")
 
@@ -802,12 +822,18 @@ class BetrustedSoC(SoCCore):
         self.add_csr("romtest")
 
         # Ring Oscillator TRNG ---------------------------------------------------------------------
-        self.submodules.trng_osc = TrngRingOsc(platform, target_freq=1e6)
+        trng_pairs = 1  # ring oscillator pairs, each one adding target_freq to the bitrate
+        self.submodules.trng_osc = TrngRingOsc(platform, target_freq=1e6, pairs=trng_pairs)
         self.add_csr("trng_osc")
+        self.register_mem("trng", self.mem_map["trng"], self.trng_osc.bus, size=4*1024)
+        self.add_interrupt("trng_osc")
         # ignore ring osc paths
         self.platform.add_platform_command("set_false_path -through [get_nets betrustedsoc_trng_osc_ena]")
         self.platform.add_platform_command("set_false_path -through [get_nets betrustedsoc_trng_osc_ring_ccw_0]")
         self.platform.add_platform_command("set_false_path -through [get_nets betrustedsoc_trng_osc_ring_cw_1]")
+        for pair in range(1, trng_pairs):
+            self.platform.add_platform_command("set_false_path -through [get_nets betrustedsoc_trng_osc_ring_ccw_pair{}_0]".format(pair))
+            self.platform.add_platform_command("set_false_path -through [get_nets betrustedsoc_trng_osc_ring_cw_pair{}_1]".format(pair))
         # MEMO: diagnostic option, need to turn off GPIO
         # gpio_pads = platform.request("gpio")
         # self.comb += gpio_pads[0].eq(self.trng_osc.trng_fast)
@@ -851,6 +877,9 @@ def main():
     parser.add_argument(
         "-u", "--uart-swap", default=False, action="store_true", help="swap UART pins (GDB debug bridge <-> console)"
     )
+    parser.add_argument(
+        "-s", "--spi-clk-freq", default=20e6, type=float, help="COM SPI clock frequency in Hz; above 20MHz, com.config.late must be set"
+    )
     parser.add_argument(
         "-e", "--encrypt", default=False, action="store_true", help="Format output for encryption using the dummy key. Image is re-encrypted at sealing time with a secure key."
     )
@@ -868,7 +897,7 @@ def main():
         platform.add_extension(_io_uart_debug_swapped)
     else:
         platform.add_extension(_io_uart_debug)
-    soc = BetrustedSoC(platform)
+    soc = BetrustedSoC(platform, spi_clk_freq=args.spi_clk_freq)
     builder = Builder(soc, output_dir="build", csr_csv="test/csr.csv", compile_software=compile_software, compile_gateware=compile_gateware)
     vns = builder.build()
     soc.do_exit(vns)
@@ -2,18 +2,86 @@ import os
 
 from migen import *
 from migen.genlib.cdc import MultiReg
+from migen.genlib.fifo import SyncFIFO
 
 from litex.soc.interconnect.csr import *
 from litex.soc.interconnect.csr_eventmanager import *
 from litex.soc.integration.doc import AutoDoc, ModuleDoc
+from litex.soc.interconnect import wishbone
 
 
 class RTLI2C(Module, AutoCSR, AutoDoc):
     """Verilog RTL-based Portable I2C Core"""
-    def __init__(self, platform, pads):
+    def __init__(self, platform, pads, sys_clk_freq=100e6, seq_depth=16, buf_depth=64, n_polls=8):
         self.intro = ModuleDoc("""RTLI2C: A verilog RTL-based I2C core
         RTLI2C is an RTL-based I2C core derived from the OpenCores I2C master IP.
         """)
+        self.seqdoc = ModuleDoc("""Command sequencer
+
+        Instead of driving the byte controller one byte at a time through ``txr`` and ``command``, a whole
+        transaction can be queued as a list of operations and run without CPU involvement. Operations are
+        queued with ``seq_op``, bytes to send with ``seq_txd``, and received bytes are read back from ``seq_rxd``
+        (reading pops the byte). The operations are:
+
+        * ``START`` (0): generate a (repeated) start condition and send ``arg`` as the address byte, R/W in the LSB
+        * ``WRITE`` (1): send ``arg`` bytes, taken from the bytes queued with ``seq_txd``
+        * ``READ`` (2): receive ``arg`` bytes into the ``seq_rxd`` buffer. The last byte is NACKed, unless ``seq_op.ack`` is set
+          because another ``READ`` follows
+        * ``STOP`` (3): generate a stop condition
+
+        Setting ``seq_control.go`` runs the queued operations, and fires the ``seq_done`` event once the operation
+        queue is empty. ``control.EN`` and ``prescale`` must be set up first. If the target NACKs an address or data byte,
+        the sequencer sends a stop condition; if arbitration is lost, it lets go of the bus. Either way, the remaining
+        operations and their bytes are discarded, ``seq_status`` says why, and ``seq_status.ops`` holds the number of
+        operations that completed, which identifies the operation that failed.
+
+        For example, reading 32 bytes from register 0x10 of the device at address 0x55 takes the operations
+        ``START 0xaa``, ``WRITE 1``, ``START 0xab``, ``READ 32``, ``STOP``, the byte 0x10 queued in ``seq_txd``, and one interrupt.
+
+        If a ``WRITE`` runs out of bytes in ``seq_txd``, or a ``READ`` finds the ``seq_rxd`` buffer full, the sequencer
+        waits, holding SCL low, until a byte is queued or popped, so that long transfers can be fed or drained on the fly.
+
+        The byte-level registers must not be used while ``seq_status.busy`` is set.
+        """)
+        self.polldoc = ModuleDoc("""Poll engine
+
+        The poll engine reads up to ``n_polls`` device registers periodically, in the background, and keeps
+        the latest values in a shadow memory (``poll_bus``), one 32-bit word per entry. Up to four bytes are read
+        per entry, and the first byte received ends up in bits [7:0], so that little-endian registers read back as
+        integers.
+
+        An entry is set up by writing ``poll_entry``, ``poll_period`` and ``poll_threshold``, then writing the entry
+        number to ``poll_index``. Each entry reads ``len + 1`` bytes starting at register ``reg`` of device ``dev``
+        (a 7-bit address), with a repeated start between the register address and the data, once every ``poll_period``
+        milliseconds. The engine runs while ``poll_control.enable`` is set.
+
+        If ``poll_entry.watch`` is set, the ``poll_alert`` event fires whenever the value of the entry moves from below
+        ``poll_threshold`` to at or above it, or back, and the matching bit of ``poll_alerts`` is set; the first value read
+        after the entry is set up only establishes which side of the threshold it is on. ``poll_error`` bits are set
+        for entries whose last read was NACKed or lost arbitration; their shadow value is left unchanged.
+
+        Polls only start while the bus is idle, and hold off the sequencer and the byte-level registers until they are
+        done. A byte-level command issued while a poll is running is carried out once the poll is over.
+        """)
+        self.xferdoc = ModuleDoc("""Register transfers
+
+        For bulk transfers, such as firmware loads or EEPROM dumps, the transfer engine moves data between
+        a register range of a device and a buffer in memory, using the ``dma_bus`` wishbone master. Set up
+        ``xfer_dev`` (a 7-bit address), ``xfer_reg``, ``xfer_len`` (in bytes) and ``xfer_adr``, the byte address of
+        the buffer, which must be word-aligned. Bytes are packed four per 32-bit memory word, the first byte in bits [7:0].
+
+        Setting ``xfer_control.go`` sends the device address and the register address, 16 bits MSB first if
+        ``xfer_control.reg16`` is set, or 8 bits otherwise. Then, if ``xfer_control.read`` is set, it reads ``xfer_len`` bytes
+        after a repeated start and stores them in the buffer, NACKing the last byte; otherwise it writes ``xfer_len``
+        bytes taken from the buffer. A stop condition ends the transfer, and the ``xfer_done`` event fires.
+        ``xfer_status`` tells whether the transfer was cut short by a NACK, lost arbitration or a bus error, and
+        ``xfer_remain`` how many bytes were left to transfer. Targets that stretch the clock are waited for by the bit controller.
+
+        As with the sequencer, the transfer is held off while a poll is running; if both the sequencer and
+        a transfer are waiting to start, the transfer goes first. The byte-level registers
+        must not be used while ``xfer_status.busy`` is set. The CPU must flush its data cache before a write,
+        and invalidate the buffer after a read, as the transfer engine is not coherent with the cache.
+        """)
         self.sda = TSTriple(1)
         self.scl = TSTriple(1)
         self.specials += [
@@ -53,8 +121,65 @@ class RTLI2C(Module, AutoCSR, AutoDoc):
             CSRField("RxACK",   size=1, description="Received acknowledge from slave. 1 = no ack received, 0 = ack received"),
         ])
 
+        self.seq_op = CSRStorage(fields=[
+            CSRField("arg", size=8, description="Address byte for ``START``, byte count for ``WRITE`` and ``READ``"),
+            CSRField("op",  size=2, description="Operation: 0 = ``START``, 1 = ``WRITE``, 2 = ``READ``, 3 = ``STOP``"),
+            CSRField("ack", size=1, description="``READ`` only: ACK the last byte as well"),
+        ], description="Queue an operation for the sequencer; writing the low byte commits the operation")
+        self.seq_txd = CSRStorage(8, name="seq_txd", description="""Queue a byte for ``WRITE`` operations""")
+        self.seq_rxd = CSRStatus(8, name="seq_rxd", description="""Oldest byte received by ``READ`` operations; reading pops the byte""")
+        self.seq_control = CSRStorage(fields=[
+            CSRField("go", description="Run the queued operations", pulse=True),
+        ])
+        self.seq_status = CSRStatus(fields=[
+            CSRField("busy",    description="Set while the sequencer is running"),
+            CSRField("nack",    description="Set when the last sequence was stopped by a NACK"),
+            CSRField("arblost", description="Set when the last sequence was stopped by losing arbitration"),
+            CSRField("rxavail", description="Set when ``seq_rxd`` holds a byte"),
+            CSRField("opfull",  description="Set when the operation queue is full"),
+            CSRField("txfull",  description="Set when the ``seq_txd`` buffer is full"),
+            CSRField("ops",     size=8, offset=8, description="Number of operations completed by the last sequence"),
+        ])
+
+        self.poll_entry = CSRStorage(fields=[
+            CSRField("dev",    size=7, description="7-bit device address"),
+            CSRField("reg",    size=8, offset=8, description="First register to read"),
+            CSRField("len",    size=2, offset=16, description="Number of bytes to read, minus one"),
+            CSRField("watch",  size=1, description="Fire ``poll_alert`` when the value crosses ``poll_threshold``"),
+            CSRField("enable", size=1, description="Poll this entry"),
+        ], description="Entry to store with the next write to ``poll_index``")
+        self.poll_period    = CSRStorage(16, name="poll_period", description="""Polling period of the entry, in milliseconds""")
+        self.poll_threshold = CSRStorage(32, name="poll_threshold", description="""Alert threshold of the entry""")
+        self.poll_index     = CSRStorage(bits_for(n_polls - 1), name="poll_index", description="""Writing stores ``poll_entry``, ``poll_period`` and ``poll_threshold`` as this entry""")
+        self.poll_control = CSRStorage(fields=[
+            CSRField("enable",    description="Run the poll engine"),
+            CSRField("clralerts", description="Clear ``poll_alerts`` and ``poll_errors``", pulse=True),
+        ])
+        self.poll_alerts = CSRStatus(n_polls, name="poll_alerts", description="""Entries whose value crossed their threshold""")
+        self.poll_errors = CSRStatus(n_polls, name="poll_errors", description="""Entries whose last read failed""")
+
+        self.xfer_dev    = CSRStorage(7, name="xfer_dev", description="""7-bit address of the device""")
+        self.xfer_reg    = CSRStorage(16, name="xfer_reg", description="""First register to transfer""")
+        self.xfer_len    = CSRStorage(16, name="xfer_len", description="""Number of bytes to transfer""")
+        self.xfer_adr    = CSRStorage(32, name="xfer_adr", description="""Byte address of the buffer in memory""")
+        self.xfer_control = CSRStorage(fields=[
+            CSRField("go",    description="Start the transfer", pulse=True),
+            CSRField("read",  description="Read from the device into memory, rather than the other way round"),
+            CSRField("reg16", description="Send a 16-bit register address"),
+        ])
+        self.xfer_status = CSRStatus(fields=[
+            CSRField("busy",    description="Set while a transfer is in progress"),
+            CSRField("nack",    description="Set when the last transfer was stopped by a NACK"),
+            CSRField("arblost", description="Set when the last transfer was stopped by losing arbitration"),
+            CSRField("buserr",  description="Set when the last transfer was stopped by a bus error"),
+        ])
+        self.xfer_remain = CSRStatus(16, name="xfer_remain", description="""Number of bytes left to transfer""")
+
         self.submodules.ev = EventManager()
         self.ev.i2c_int    = EventSourcePulse()  # rising edge triggered
+        self.ev.seq_done   = EventSourcePulse()
+        self.ev.poll_alert = EventSourcePulse()
+        self.ev.xfer_done  = EventSourcePulse()
         self.ev.finalize()
 
         # control register
@@ -65,19 +190,65 @@ class RTLI2C(Module, AutoCSR, AutoDoc):
             int_ena.eq(self.control.fields.IEN),
         ]
 
-        # command register
+        # command register, or one of the engines while it runs
         start = Signal()
         stop  = Signal()
         ack   = Signal()
         iack  = Signal()
         read  = Signal()
         write = Signal()
+        din   = Signal(8)
+        seq_busy  = Signal()
+        seq_start = Signal()
+        seq_stop  = Signal()
+        seq_ack   = Signal()
+        seq_read  = Signal()
+        seq_write = Signal()
+        seq_din   = Signal(8)
+        poll_busy  = Signal()
+        poll_start = Signal()
+        poll_stop  = Signal()
+        poll_ack   = Signal()
+        poll_read  = Signal()
+        poll_write = Signal()
+        poll_din   = Signal(8)
+        xfer_busy  = Signal()
+        xfer_start = Signal()
+        xfer_stop  = Signal()
+        xfer_ack   = Signal()
+        xfer_read  = Signal()
+        xfer_write = Signal()
+        xfer_din   = Signal(8)
         self.comb += [
-            start.eq(self.command.fields.STA),
-            stop.eq(self.command.fields.STO),
-            read.eq(self.command.fields.RD),
-            write.eq(self.command.fields.WR),
-            ack.eq(self.command.fields.ACK),
+            If(poll_busy,
+                start.eq(poll_start),
+                stop.eq(poll_stop),
+                read.eq(poll_read),
+                write.eq(poll_write),
+                ack.eq(poll_ack),
+                din.eq(poll_din),
+            ).Elif(xfer_busy,
+                start.eq(xfer_start),
+                stop.eq(xfer_stop),
+                read.eq(xfer_read),
+                write.eq(xfer_write),
+                ack.eq(xfer_ack),
+                din.eq(xfer_din),
+            ).Elif(seq_busy,
+                start.eq(seq_start),
+                stop.eq(seq_stop),
+                read.eq(seq_read),
+                write.eq(seq_write),
+                ack.eq(seq_ack),
+                din.eq(seq_din),
+            ).Else(
+                start.eq(self.command.fields.STA),
+                stop.eq(self.command.fields.STO),
+                read.eq(self.command.fields.RD),
+                write.eq(self.command.fields.WR),
+                ack.eq(self.command.fields.ACK),
+                din.eq(self.txr.storage),
+            ),
             iack.eq(self.command.fields.IACK),
         ],
 
@@ -114,7 +285,7 @@ class RTLI2C(Module, AutoCSR, AutoDoc):
             i_read     = read & ~done,
             i_write    = write & ~done,
             i_ack_in   = ack,
-            i_din      = self.txr.storage,
+            i_din      = din,
             o_cmd_ack  = done,  # this is a one-cycle wide pulse
             o_ack_out  = rxack,
             o_dout     = self.rxr.status,
@@ -140,7 +311,7 @@ class RTLI2C(Module, AutoCSR, AutoDoc):
         ]
 
         self.comb += [
-            If(done | i2c_al,
+            If((done | i2c_al) & ~seq_busy & ~poll_busy & ~xfer_busy,
                self.command.we.eq(1),
                self.command.dat_w.eq(0),
                ).Else(
@@ -149,9 +320,528 @@ class RTLI2C(Module, AutoCSR, AutoDoc):
         ]
         self.sync += [
             tip.eq(read | write),
-            intflag.eq( (done | i2c_al | intflag) & ~iack),
+            intflag.eq( ((done | i2c_al) & ~seq_busy & ~poll_busy & ~xfer_busy | intflag) & ~iack),
             arb_lost.eq(i2c_al | (arb_lost & ~start)),
         ]
 
         self.comb += self.ev.i2c_int.trigger.eq(intflag & int_ena)
 
+
+        # Command sequencer
+        self.submodules.op_fifo = op_fifo = SyncFIFO(11, seq_depth)
+        self.submodules.tx_fifo = tx_fifo = SyncFIFO(8, buf_depth)
+        self.submodules.rx_fifo = rx_fifo = SyncFIFO(8, buf_depth)
+        op      = Signal(2)
+        arg     = Signal(8)
+        op_ack  = Signal()
+        remain  = Signal(8)
+        ops     = Signal(8)
+        nack    = Signal()
+        arblost = Signal()
+        self.comb += [
+            op_fifo.din.eq(self.seq_op.storage),
+            op_fifo.we.eq(self.seq_op.re),
+            tx_fifo.din.eq(self.seq_txd.storage),
+            tx_fifo.we.eq(self.seq_txd.re),
+            rx_fifo.din.eq(self.rxr.status),
+            self.seq_rxd.status.eq(rx_fifo.dout),
+            rx_fifo.re.eq(self.seq_rxd.we),
+            self.seq_status.fields.busy.eq(seq_busy),
+            self.seq_status.fields.nack.eq(nack),
+            self.seq_status.fields.arblost.eq(arblost),
+            self.seq_status.fields.rxavail.eq(rx_fifo.readable),
+            self.seq_status.fields.opfull.eq(~op_fifo.writable),
+            self.seq_status.fields.txfull.eq(~tx_fifo.writable),
+            self.seq_status.fields.ops.eq(ops),
+        ]
+        seqfsm = FSM(reset_state="IDLE")
+        self.submodules += seqfsm
+        seq_go  = Signal()  # go is held off while a poll or a transfer is running
+        xfer_go = Signal()
+        seq_ok  = Signal()  # a transfer that is pending as well goes first
+        self.comb += seq_ok.eq(~poll_busy & ~xfer_busy & ~xfer_go & ~self.xfer_control.fields.go)
+        self.sync += If(self.seq_control.fields.go, seq_go.eq(1)).Elif(seq_ok, seq_go.eq(0))
+        seqfsm.act("IDLE",
+            If((self.seq_control.fields.go | seq_go) & seq_ok & op_fifo.readable,
+                NextValue(seq_busy, 1),
+                NextValue(ops, 0),
+                NextValue(nack, 0),
+                NextValue(arblost, 0),
+                NextState("FETCH")
+            )
+        )
+        seqfsm.act("FETCH",
+            If(op_fifo.readable,
+                op_fifo.re.eq(1),
+                NextValue(op, op_fifo.dout[8:10]),
+                NextValue(arg, op_fifo.dout[:8]),
+                NextValue(remain, op_fifo.dout[:8]),
+                NextValue(op_ack, op_fifo.dout[10]),
+                NextState("DISPATCH")
+            ).Else(
+                NextState("DONE")
+            )
+        )
+        seqfsm.act("DISPATCH",
+            If(op == 0,
+                NextState("START")
+            ).Elif(op == 3,
+                NextState("STOP")
+            ).Elif(remain == 0,
+                NextValue(ops, ops + 1),
+                NextState("FETCH")
+            ).Elif(op == 1,
+                NextState("WRITE")
+            ).Else(
+                NextState("READ")
+            )
+        )
+        seqfsm.act("START",
+            seq_start.eq(1),
+            seq_write.eq(1),
+            seq_din.eq(arg),
+            If(i2c_al,
+                NextValue(arblost, 1),
+                NextState("FLUSH")
+            ).Elif(done,
+                If(rxack,
+                    NextValue(nack, 1),
+                    NextState("ABORT")
+                ).Else(
+                    NextValue(ops, ops + 1),
+                    NextState("FETCH")
+                )
+            )
+        )
+        # WRITE waits for a byte to send, and READ for room to store the byte, holding SCL low meanwhile
+        seqfsm.act("WRITE",
+            seq_write.eq(tx_fifo.readable),
+            seq_din.eq(tx_fifo.dout),
+            If(i2c_al,
+                NextValue(arblost, 1),
+                NextState("FLUSH")
+            ).Elif(done,
+                tx_fifo.re.eq(1),
+                NextValue(remain, remain - 1),
+                If(rxack,
+                    NextValue(nack, 1),
+                    NextState("ABORT")
+                ).Elif(remain == 1,
+                    NextValue(ops, ops + 1),
+                    NextState("FETCH")
+                )
+            )
+        )
+        seqfsm.act("READ",
+            seq_read.eq(rx_fifo.writable),
+            seq_ack.eq((remain == 1) & ~op_ack),  # NACK the last byte
+            If(i2c_al,
+                NextValue(arblost, 1),
+                NextState("FLUSH")
+            ).Elif(done,
+                rx_fifo.we.eq(1),
+                NextValue(remain, remain - 1),
+                If(remain == 1,
+                    NextValue(ops, ops + 1),
+                    NextState("FETCH")
+                )
+            )
+        )
+        seqfsm.act("STOP",
+            seq_stop.eq(1),
+            If(i2c_al,
+                NextValue(arblost, 1),
+                NextState("FLUSH")
+            ).Elif(done,
+                NextValue(ops, ops + 1),
+                NextState("FETCH")
+            )
+        )
+        # On a NACK, release the bus before dropping the rest of the sequence
+        seqfsm.act("ABORT",
+            seq_stop.eq(1),
+            If(done | i2c_al,
+                NextState("FLUSH")
+            )
+        )
+        seqfsm.act("FLUSH",
+            op_fifo.re.eq(1),
+            tx_fifo.re.eq(1),
+            If(~op_fifo.readable & ~tx_fifo.readable,
+                NextState("DONE")
+            )
+        )
+        seqfsm.act("DONE",
+            self.ev.seq_done.trigger.eq(1),
+            NextValue(seq_busy, 0),
+            NextState("IDLE")
+        )
+
+        # Poll engine
+        self.poll_bus = wishbone.Interface()
+        shadow = Memory(32, n_polls)
+        self.submodules.shadow_sram = wishbone.SRAM(shadow, bus=self.poll_bus, read_only=True)
+        shadow_wr = shadow.get_port(write_capable=True)
+        self.specials += shadow_wr
+
+        ms_cycles = int(sys_clk_freq // 1000)
+        ms_count  = Signal(max=ms_cycles)
+        ms_tick   = Signal()
+        self.sync += \
+            If(ms_count == 0,
+                ms_count.eq(ms_cycles - 1)
+            ).Else(
+                ms_count.eq(ms_count - 1)
+            )
+        self.comb += ms_tick.eq(ms_count == 0)
+
+        p_dev     = Array(Signal(7)  for _ in range(n_polls))
+        p_reg     = Array(Signal(8)  for _ in range(n_polls))
+        p_len     = Array(Signal(2)  for _ in range(n_polls))
+        p_watch   = Array(Signal()   for _ in range(n_polls))
+        p_enable  = [Signal() for _ in range(n_polls)]
+        p_period  = [Signal(16) for _ in range(n_polls)]
+        p_thresh  = Array(Signal(32) for _ in range(n_polls))
+        p_timer   = [Signal(16) for _ in range(n_polls)]
+        p_due     = [Signal() for _ in range(n_polls)]
+        p_primed  = Array(Signal() for _ in range(n_polls))  # the entry has a value to compare against
+        p_above   = Array(Signal() for _ in range(n_polls))
+        alerts    = Signal(n_polls)
+        errors    = Signal(n_polls)
+        cur       = Signal(max=max(2, n_polls))
+        next_due  = Signal(max=max(2, n_polls))
+        any_due   = Signal()
+        remain    = Signal(2)
+        value     = Signal(32)
+        store     = Signal()  # value holds a complete reading for entry cur
+        failed    = Signal()  # the reading of entry cur failed
+        poll_done = Signal()  # entry cur has been polled
+        idx       = self.poll_index.storage
+        entry     = self.poll_entry.fields
+        self.comb += [
+            self.poll_alerts.status.eq(alerts),
+            self.poll_errors.status.eq(errors),
+            any_due.eq(Cat(*p_due) != 0),
+        ]
+        for i in reversed(range(n_polls)):
+            self.comb += If(p_due[i], next_due.eq(i))  # the lowest numbered entry wins
+        for i in range(n_polls):
+            self.sync += [
+                If(self.poll_index.re & (idx == i),
+                    p_dev[i].eq(entry.dev),
+                    p_reg[i].eq(entry.reg),
+                    p_len[i].eq(entry.len),
+                    p_watch[i].eq(entry.watch),
+                    p_enable[i].eq(entry.enable),
+                    p_period[i].eq(self.poll_period.storage),
+                    p_thresh[i].eq(self.poll_threshold.storage),
+                    p_timer[i].eq(0),
+                    p_due[i].eq(0),
+                    p_primed[i].eq(0),
+                ).Else(
+                    If(ms_tick & p_enable[i],
+                        If(p_timer[i] == 0,
+                            p_timer[i].eq(p_period[i]),
+                            p_due[i].eq(1)
+                        ).Else(
+                            p_timer[i].eq(p_timer[i] - 1)
+                        )
+                    ),
+                    If(poll_done & (cur == i),
+                        p_due[i].eq(0)
+                    )
+                )
+            ]
+
+        crossed = Signal()
+        self.comb += [
+            shadow_wr.adr.eq(cur),
+            shadow_wr.dat_w.eq(value),
+            shadow_wr.we.eq(store),
+            crossed.eq(p_watch[cur] & p_primed[cur] & ((value >= p_thresh[cur]) != p_above[cur])),
+            self.ev.poll_alert.trigger.eq(store & crossed),
+        ]
+        self.sync += [
+            If(store,
+                p_primed[cur].eq(1),
+                p_above[cur].eq(value >= p_thresh[cur]),
+            ),
+            If(self.poll_control.fields.clralerts,
+                alerts.eq(0),
+                errors.eq(0),
+            ).Else(
+                If(store & crossed,
+                    alerts.eq(alerts | (1 << cur))
+                ),
+                If(failed,
+                    errors.eq(errors | (1 << cur))
+                ).Elif(store,
+                    errors.eq(errors & ~(1 << cur))
+                ),
+            ),
+        ]
+
+        pollfsm = FSM(reset_state="IDLE")
+        self.submodules += pollfsm
+        # Only take the bus when nobody else is using it, or about to
+        pollfsm.act("IDLE",
+            If(self.poll_control.fields.enable & any_due & ~busy & ~seq_busy & ~seq_go & ~self.seq_control.fields.go &
+                ~xfer_busy & ~xfer_go & ~self.xfer_control.fields.go &
+                ~(self.command.fields.STA | self.command.fields.STO | self.command.fields.RD | self.command.fields.WR),
+                NextValue(poll_busy, 1),
+                NextValue(cur, next_due),
+                NextState("ADDR_W")
+            )
+        )
+        pollfsm.act("ADDR_W",
+            poll_start.eq(1),
+            poll_write.eq(1),
+            poll_din.eq(Cat(0, p_dev[cur])),
+            If(i2c_al,
+                NextState("FAIL")
+            ).Elif(done,
+                If(rxack,
+                    NextState("ABORT")
+                ).Else(
+                    NextState("REG")
+                )
+            )
+        )
+        pollfsm.act("REG",
+            poll_write.eq(1),
+            poll_din.eq(p_reg[cur]),
+            If(i2c_al,
+                NextState("FAIL")
+            ).Elif(done,
+                If(rxack,
+                    NextState("ABORT")
+                ).Else(
+                    NextState("ADDR_R")
+                )
+            )
+        )
+        pollfsm.act("ADDR_R",
+            poll_start.eq(1),
+            poll_write.eq(1),
+            poll_din.eq(Cat(1, p_dev[cur])),
+            If(i2c_al,
+                NextState("FAIL")
+            ).Elif(done,
+                NextValue(value, 0),
+                NextValue(remain, p_len[cur]),
+                If(rxack,
+                    NextState("ABORT")
+                ).Else(
+                    NextState("READ")
+                )
+            )
+        )
+        pollfsm.act("READ",
+            poll_read.eq(1),
+            poll_ack.eq(remain == 0),  # NACK the last byte
+            If(i2c_al,
+                NextState("FAIL")
+            ).Elif(done,
+                # bytes arrive least significant first
+                Case(p_len[cur] - remain, {
+                    0: NextValue(value[0:8],   self.rxr.status),
+                    1: NextValue(value[8:16],  self.rxr.status),
+                    2: NextValue(value[16:24], self.rxr.status),
+                    3: NextValue(value[24:32], self.rxr.status),
+                }),
+                NextValue(remain, remain - 1),
+                If(remain == 0,
+                    NextState("STOP")
+                )
+            )
+        )
+        pollfsm.act("STOP",
+            poll_stop.eq(1),
+            If(i2c_al,
+                NextState("FAIL")
+            ).Elif(done,
+                NextState("STORE")
+            )
+        )
+        pollfsm.act("STORE",
+            store.eq(1),
+            poll_done.eq(1),
+            NextValue(poll_busy, 0),
+            NextState("IDLE")
+        )
+        # On a NACK, release the bus
+        pollfsm.act("ABORT",
+            poll_stop.eq(1),
+            If(done | i2c_al,
+                NextState("FAIL")
+            )
+        )
+        pollfsm.act("FAIL",
+            failed.eq(1),
+            poll_done.eq(1),
+            NextValue(poll_busy, 0),
+            NextState("IDLE")
+        )
+
+        # Register transfer engine
+        self.dma_bus = dma_bus = wishbone.Interface()
+        xfer_adr  = Signal(30)
+        xfer_rem  = Signal(16)
+        data      = Signal(32)
+        lane      = Signal(2)
+        sel       = Signal(4)
+        xfer_nack = Signal()
+        xfer_al   = Signal()
+        xfer_err  = Signal()
+        self.comb += [
+            self.xfer_status.fields.busy.eq(xfer_busy),
+            self.xfer_status.fields.nack.eq(xfer_nack),
+            self.xfer_status.fields.arblost.eq(xfer_al),
+            self.xfer_status.fields.buserr.eq(xfer_err),
+            self.xfer_remain.status.eq(xfer_rem),
+        ]
+        self.sync += If(self.xfer_control.fields.go, xfer_go.eq(1)).Elif(~poll_busy & ~seq_busy, xfer_go.eq(0))
+        xferfsm = FSM(reset_state="IDLE")
+        self.submodules += xferfsm
+        xferfsm.act("IDLE",
+            If((self.xfer_control.fields.go | xfer_go) & ~poll_busy & ~seq_busy,
+                NextValue(xfer_busy, 1),
+                NextValue(xfer_adr, self.xfer_adr.storage[2:]),
+                NextValue(xfer_rem, self.xfer_len.storage),
+                NextValue(lane, 0),
+                NextValue(sel, 0),
+                NextValue(xfer_nack, 0),
+                NextValue(xfer_al, 0),
+                NextValue(xfer_err, 0),
+                NextState("ADDR_W")
+            )
+        )
+        # Sends a byte, then carries out next once the target has ACKed it
+        def send(state, byte, next, start=False):
+            xferfsm.act(state,
+                xfer_start.eq(start),
+                xfer_write.eq(1),
+                xfer_din.eq(byte),
+                If(i2c_al,
+                    NextValue(xfer_al, 1),
+                    NextState("DONE")
+                ).Elif(done,
+                    If(rxack,
+                        NextValue(xfer_nack, 1),
+                        NextState("STOP")
+                    ).Else(
+                        *next
+                    )
+                )
+            )
+        send("ADDR_W", Cat(0, self.xfer_dev.storage), [
+            If(self.xfer_control.fields.reg16,
+                NextState("REG_HI")
+            ).Else(
+                NextState("REG_LO")
+            )
+        ], start=True)
+        send("REG_HI", self.xfer_reg.storage[8:], [NextState("REG_LO")])
+        send("REG_LO", self.xfer_reg.storage[:8], [
+            If(xfer_rem == 0,
+                NextState("STOP")
+            ).Elif(self.xfer_control.fields.read,
+                NextState("ADDR_R")
+            ).Else(
+                NextState("FETCH")
+            )
+        ])
+        send("ADDR_R", Cat(1, self.xfer_dev.storage), [NextState("READ")], start=True)
+
+        # Write: fetch a word, then send its bytes, least significant first
+        xferfsm.act("FETCH",
+            dma_bus.cyc.eq(1),
+            dma_bus.stb.eq(1),
+            dma_bus.we.eq(0),
+            dma_bus.sel.eq(0xf),
+            dma_bus.adr.eq(xfer_adr),
+            If(dma_bus.ack,
+                NextValue(data, dma_bus.dat_r),
+                NextValue(xfer_adr, xfer_adr + 1),
+                NextState("WRITE")
+            ).Elif(dma_bus.err,
+                NextValue(xfer_err, 1),
+                NextState("STOP")
+            )
+        )
+        send("WRITE", Array(data[8*i:8*(i + 1)] for i in range(4))[lane], [
+            NextValue(xfer_rem, xfer_rem - 1),
+            NextValue(lane, lane + 1),
+            If(xfer_rem == 1,
+                NextState("STOP")
+            ).Elif(lane == 3,
+                NextState("FETCH")
+            )
+        ])
+
+        # Read: collect bytes into a word, and store it once it is full or the transfer is over
+        xferfsm.act("READ",
+            xfer_read.eq(1),
+            xfer_ack.eq(xfer_rem == 1),  # NACK the last byte
+            If(i2c_al,
+                NextValue(xfer_al, 1),
+                NextState("DONE")
+            ).Elif(done,
+                Case(lane, {i: NextValue(data[8*i:8*(i + 1)], self.rxr.status) for i in range(4)}),
+                NextValue(sel, sel | (1 << lane)),
+                NextValue(xfer_rem, xfer_rem - 1),
+                NextValue(lane, lane + 1),
+                If((xfer_rem == 1) | (lane == 3),
+                    NextState("STORE")
+                )
+            )
+        )
+        xferfsm.act("STORE",
+            dma_bus.cyc.eq(1),
+            dma_bus.stb.eq(1),
+            dma_bus.we.eq(1),
+            dma_bus.sel.eq(sel),
+            dma_bus.adr.eq(xfer_adr),
+            dma_bus.dat_w.eq(data),
+            If(dma_bus.ack,
+                NextValue(xfer_adr, xfer_adr + 1),
+                NextValue(sel, 0),
+                If(xfer_rem == 0,
+                    NextState("STOP")
+                ).Else(
+                    NextState("READ")
+                )
+            ).Elif(dma_bus.err,
+                NextValue(xfer_err, 1),
+                If(xfer_rem == 0,
+                    NextState("STOP")
+                ).Else(
+                    NextState("NACK")
+                )
+            )
+        )
+        # The last byte read was ACKed, so read and NACK one more before the stop condition
+        xferfsm.act("NACK",
+            xfer_read.eq(1),
+            xfer_ack.eq(1),
+            If(i2c_al,
+                NextValue(xfer_al, 1),
+                NextState("DONE")
+            ).Elif(done,
+                NextState("STOP")
+            )
+        )
+        xferfsm.act("STOP",
+            xfer_stop.eq(1),
+            If(i2c_al,
+                NextValue(xfer_al, 1),
+                NextState("DONE")
+            ).Elif(done,
+                NextState("DONE")
+            )
+        )
+        xferfsm.act("DONE",
+            self.ev.xfer_done.trigger.eq(1),
+            NextValue(xfer_busy, 0),
+            NextState("IDLE")
+        )
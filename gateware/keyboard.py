@@ -1,50 +1,126 @@
 from migen.genlib.cdc import MultiReg
-from migen.genlib.coding import Decoder
+from migen.genlib.coding import Decoder, PriorityEncoder
+from migen.genlib.fifo import SyncFIFO
 
 from litex.soc.integration.doc import AutoDoc, ModuleDoc
 from litex.soc.interconnect.csr_eventmanager import *
 
 # Relies on a clock called "kbd" for delay counting
-# Input and output through "i" and "o" signals respectively
+# Input and output through "i" and "o" signals respectively, "o_kbd" is the output in the "kbd" domain
+# n may be a constant or a signal, in which case it must be at least 1
 class Debounce(Module):
     def __init__(self, n):
         self.i = Signal()
         self.o = Signal()
+        self.o_kbd = o_kbd = Signal()
 
         # # #
 
         i_kbd = Signal()
-        o_kbd = Signal()
-        count = Signal(max=(2*n))
+        if isinstance(n, int):
+            count = Signal(max=(2*n))
+        else:
+            count = Signal(len(n) + 1)
 
         self.specials += MultiReg(self.i, i_kbd, odomain="kbd");
-        self.sync.kbd += [
+        count_next = Signal(len(count))
+        count_c    = Signal(len(count))
+        if isinstance(n, int):
+            self.comb += count_c.eq(count)
+        else:
+            # n can change at any time: a count left above 2*n-1 by a larger n (or by n == 0, which parks
+            # a held key at the top of the range) is brought back down, so a release still takes n cycles
+            self.comb += If(count >= 2*n, count_c.eq(2*n - 1)).Else(count_c.eq(count))
+        self.comb += [
             # Basic idea: We want to debounce our input signal for n cycles:
             # If key is pressed, count up to n; if it bounces, reset count to 0. The key is declared
-            # pressed when held for n successive cycles. At this point, count is set to 2*n and the
-            # same process is so repeated for the key release, except counting down to n.
+            # pressed when held for n successive cycles. At this point, count is set to 2*n-1 and the
+            # same process is so repeated for the key release, counting down n cycles to below n.
             If(i_kbd,
-                count.eq(count + 1),
-                 # Once we've reached n, "snap" up to 2x n to prep for key release
-                If(count >= n,
-                    count.eq(2*n),
+                count_next.eq(count_c + 1),
+                 # Once we reach n, "snap" up to 2x n - 1 to prep for key release
+                If(count_c + 1 >= n,
+                    count_next.eq(2*n - 1),
                 )
             ).Else(
-                count.eq(count - 1),
-                # Once we've fell below n, "snap" down to 0 to prepare for next key press
-                If(count < n,
-                    count.eq(0)
+                count_next.eq(count_c - 1),
+                # Once we fall below n, "snap" down to 0 to prepare for next key press
+                If(count_c <= n,
+                    count_next.eq(0)
                 )
             ),
-            o_kbd.eq(count >= n)
+        ]
+        if not isinstance(n, int):
+            self.comb += If(n == 0, count_next.eq(Mux(i_kbd, 2**len(count) - 1, 0)))
+        self.sync.kbd += [
+            count.eq(count_next),
+            # follow the updated count, so the output changes on the cycle that completes the n;
+            # with n at 0 the count just follows the input, and is only non-zero while the key is down
+            o_kbd.eq((count_next >= n) & (count_next != 0))
         ]
         self.specials += MultiReg(o_kbd, self.o)
 
 # A hardware key scanner that can run even when the CPU is powered down or stopped
 class KeyScan(Module, AutoCSR, AutoDoc):
-    def __init__(self, pads):
+    def __init__(self, pads, timestamp=None, fifo_depth=32):
+        self.debouncedoc = ModuleDoc("""Debounce
+
+        Each key can be debounced in hardware over successive scans: a key is only seen as pressed once it
+        has been down for ``debounce`` scans in a row, and as released once it has been up for as many. The
+        row data, the ``keypressed`` interrupt and the key event FIFO all follow the debounced state, so that
+        contact bounce does not wake the CPU. A scan takes about 1.4 ms. ``debounce`` is 0 out of reset,
+        which turns debouncing off and reports each scan as it is. ``debounce`` can be changed with keys held
+        down: a held key stays pressed, and its release takes the new number of scans.
+        """)
+        self.scandoc = ModuleDoc("""Scan rate and idle mode
+
+        Out of reset, the matrix is scanned back to back, one scan about every 1.4 ms. ``interval`` adds that many
+        ``lpclk`` cycles (about 30.5 us each) between scans, during which no column is driven.
+
+        If ``idlescans`` is not 0, the scanner goes idle once that many scans in a row found no key down, debounced
+        or not. It then drives all the columns at once and waits for any row to go high, which starts a scan right
+        away, whatever ``interval``; scanning resumes at the configured rate until the matrix is empty again.
+        ``scanstatus.idle`` tells whether the scanner is idle.
+        """)
+        self.eventdoc = ModuleDoc("""Key event FIFO
+
+        Alongside the row snapshots, every key that changes state between two scans is reported as an entry
+        in a FIFO, which the CPU drains with one ``event`` read per key rather than by diffing the rows. An entry
+        gives the keycode of the key and whether it was pressed (make) or released (break), then its row and column,
+        and the low 16 bits of ``timestamp`` (the ticktimer, in milliseconds) at the end of the scan that saw the change.
+
+        Reading ``event`` pops the entry once its least significant byte has been read, so the upper half, with
+        the position and the time, may be left out; ``event.valid`` is clear if the FIFO was empty. ``evstatus.count``
+        tells how many entries there are, so they can be read in bulk. The ``keyevent`` interrupt fires whenever
+        an entry is queued.
+
+        The FIFO tracks the key state on its own, so that it does not depend on the CPU acknowledging ``keypressed``.
+        Should it fill up, the changes not yet queued are held back until there is room again; ``evstatus.overflow``
+        is then set if a further scan completed in the meantime, as intermediate states may have been missed.
+        """)
+        self.keymapdoc = ModuleDoc("""Keymap and held keys
+
+        Keys are translated to keycodes by a keymap, which the CPU loads one entry at a time through ``keymap``.
+        There is an entry for every key in each of four layers, with and without shift, and each entry gives
+        a 16-bit keycode and the kind of the key:
+
+        * 0: an ordinary key
+        * 1: a shift key; the entries with ``shift`` set are used while any shift key is held
+        * 2: a layer key; while it is held, the entries of the layer in the two low bits of its keycode are used
+        * 3: a key that is not reported, such as an unpopulated position of the matrix
+
+        Shift and layer keys are reported as well. The keymap is empty out of reset, so that every key reads
+        as keycode 0; the row and column are always given.
+
+        When a key is pressed, the keycode and kind it is reported with are kept in a table of held keys, so
+        that its release is reported with the same keycode even if the layer or shift state changed in the meantime.
+        The CPU can look up any key in the table through ``heldindex`` and ``held``, and the current layer and
+        number of shift keys held in ``modifiers``. Keys that change in the same scan are processed by row, then
+        by column, so a modifier only applies to the keys of that scan that come after it in the matrix.
+        """)
         rows_unsync = pads.row
         cols        = Signal(pads.col.nbits)
+        assert rows_unsync.nbits <= 16 and cols.nbits <= 16
 
         for c in range(0, cols.nbits):
             cols_ts = TSTriple(1)
@@ -57,26 +133,60 @@ class KeyScan(Module, AutoCSR, AutoDoc):
         rows = Signal(rows_unsync.nbits)
         self.specials += MultiReg(rows_unsync, rows, "kbd")
 
+        self.debounce = CSRStorage(4, name="debounce", description="""Number of successive scans a key must be seen
+            in its new state for the change to be taken into account. `0` turns debouncing off.""")
+        window = Signal(4)
+        self.specials += MultiReg(self.debounce.storage, window, "kbd")
+
+        self.interval  = CSRStorage(16, name="interval", description="""Number of ``lpclk`` cycles to wait between scans""")
+        self.idlescans = CSRStorage(8, name="idlescans", description="""Number of successive empty scans after which the
+            scanner goes idle, until a key is pressed. `0` keeps it scanning.""")
+        self.scanstatus = CSRStatus(fields=[
+            CSRField("idle", description="Set while the scanner waits for a key to be pressed"),
+        ])
+        interval   = Signal(16)
+        idle_scans = Signal(8)
+        self.specials += [
+            MultiReg(self.interval.storage, interval, "kbd"),
+            MultiReg(self.idlescans.storage, idle_scans, "kbd"),
+        ]
+
         # setattr(self, name, object) is the same as self.name = object, except in this case "name" can be dynamically generated
         # this is necessary here because we CSRStatus is not iterable, so we have to manage the attributes manually
         for r in range(0, rows.nbits):
             setattr(self, "row" + str(r) + "dat", CSRStatus(cols.nbits, name="row" + str(r) + "dat", description="""Column data for the given row"""))
 
         settling = 4  # 4 cycles to settle: 2 cycles for MultiReg stabilization + slop. Must be > 2, and a power of 2
-        colcount = Signal(max=(settling*cols.nbits+2))
+        scan_end = settling*cols.nbits  # columns are driven up to here, then the scan results are processed
+        colcount = Signal(max=(scan_end+6))
 
         update_shadow = Signal()
         reset_scan    = Signal()
+        update_state  = Signal()
         scan_done     = Signal()
         col_r         = Signal(cols.nbits)
         scan_done_sys = Signal()
         self.specials += MultiReg(scan_done, scan_done_sys)
+        scan_empty    = Signal()  # no key down in the scan, debounced or not
+        row_any       = []
         for r in range(0, rows.nbits):
             row_scan = Signal(cols.nbits)
-            # below is in sysclock domain; row_scan is guaranteed stable by state machine sequencing when scan_done gating is enabled
+            # debounced state of the row, updated at the end of the scan
+            row_raw   = Signal(cols.nbits)
+            row_state = Signal(cols.nbits)
+            self.sync.kbd += If(update_state, row_raw.eq(row_scan))
+            for c in range(cols.nbits):
+                debounce = CEInserter()(Debounce(window))
+                self.submodules += debounce
+                self.comb += [
+                    debounce.ce.eq(update_state),  # once row_scan has made it through its input MultiReg
+                    debounce.i.eq(row_scan[c]),
+                    row_state[c].eq(Mux(window == 0, row_raw[c], debounce.o_kbd)),
+                ]
+            # below is in sysclock domain; row_state is guaranteed stable by state machine sequencing when scan_done gating is enabled
             self.sync += [
                 If(scan_done_sys,
-                    getattr(self, "row" + str(r) + "dat").status.eq(row_scan)
+                    getattr(self, "row" + str(r) + "dat").status.eq(row_state)
                 ).Else(
                     getattr(self, "row" + str(r) + "dat").status.eq(getattr(self, "row" + str(r) + "dat").status)
                 )
@@ -94,43 +204,85 @@ class KeyScan(Module, AutoCSR, AutoDoc):
             ]
 
             rowshadow = Signal(cols.nbits)
-            self.sync.kbd += If(update_shadow, rowshadow.eq(row_scan)).Else(rowshadow.eq(rowshadow))
+            self.sync.kbd += If(update_shadow, rowshadow.eq(row_state)).Else(rowshadow.eq(rowshadow))
 
             setattr(self, "row_scan" + str(r), row_scan)
+            setattr(self, "row_state" + str(r), row_state)
+            row_any += [row_scan != 0, row_state != 0]
             setattr(self, "rowshadow" + str(r), rowshadow)
 
+        self.comb += scan_empty.eq(Cat(*row_any) == 0)
+
         pending_key = Signal()
+        waiting     = Signal()  # between scans, or idle
+        idle        = Signal()  # waiting for a key to be pressed
+        wait_count  = Signal(16)
+        empty_scans = Signal(8)
         self.sync.kbd += [
-            colcount.eq(colcount + 1),
             scan_done.eq(0),
             update_shadow.eq(0),
             reset_scan.eq(0),
-            If(colcount == (settling*cols.nbits+2), colcount.eq(0)),
-            If(colcount == (settling*cols.nbits), scan_done.eq(1)),
-            # Only update the shadow if the pending bit has been cleared (e.g., CPU has acknowledged
-            # it has fetched the current key state)
-            If(colcount == (settling*cols.nbits+1), update_shadow.eq(~pending_key)),
-            If(colcount == (settling*cols.nbits+2), reset_scan.eq(1)),
+            update_state.eq(0),
+            If(waiting,
+                If(wait_count != 0,
+                    wait_count.eq(wait_count - 1)
+                ).Elif(~idle | (rows != 0),  # the interval is over, or a key was pressed
+                    waiting.eq(0),
+                    idle.eq(0)
+                )
+            ).Else(
+                colcount.eq(colcount + 1),
+                If(colcount == (scan_end+5), colcount.eq(0)),
+                If(colcount == (scan_end+1), update_state.eq(1)),
+                If(colcount == (scan_end+3), scan_done.eq(1)),
+                # Only update the shadow if the pending bit has been cleared (e.g., CPU has acknowledged
+                # it has fetched the current key state)
+                If(colcount == (scan_end+4), update_shadow.eq(~pending_key)),
+                If(colcount == (scan_end+5),
+                    reset_scan.eq(1),
+                    If(scan_empty,
+                        empty_scans.eq(empty_scans + 1)
+                    ).Else(
+                        empty_scans.eq(0)
+                    ),
+                    If(scan_empty & (idle_scans != 0) & (empty_scans >= (idle_scans - 1)),
+                        # go idle, once the rows have settled with all the columns driven
+                        waiting.eq(1),
+                        idle.eq(1),
+                        wait_count.eq(settling),
+                        empty_scans.eq(0)
+                    ).Elif(interval != 0,
+                        waiting.eq(1),
+                        wait_count.eq(interval - 1)
+                    )
+                )
+            )
         ]
+        self.specials += MultiReg(idle, self.scanstatus.fields.idle)
 
-        # Drive the columns based on the colcount counter
+        # Drive the columns based on the colcount counter, or all of them while idle
         self.submodules.coldecoder = Decoder(cols.nbits)
         self.comb += [
             self.coldecoder.i.eq(colcount[log2_int(settling):]),
-            self.coldecoder.n.eq(~(colcount < settling*cols.nbits)),
-            cols.eq(self.coldecoder.o)
+            self.coldecoder.n.eq(~(colcount < scan_end)),
+            If(waiting,
+                cols.eq(Replicate(idle, cols.nbits))
+            ).Else(
+                cols.eq(self.coldecoder.o)
+            )
         ]
         self.sync.kbd += col_r.eq(self.coldecoder.o)
 
         self.submodules.ev = EventManager()
         self.ev.keypressed = EventSourcePulse() # Rising edge triggered
+        self.ev.keyevent   = EventSourcePulse()
         self.ev.finalize()
         # Extract any changes just before the shadow takes its new values
         rowdiff = Signal(rows.nbits)
         for r in range(0, rows.nbits):
             self.sync.kbd += [
                 If(scan_done,
-                   rowdiff[r].eq( ~((getattr(self, "row_scan" + str(r)) ^ getattr(self, "rowshadow" + str(r))) == 0) )
+                   rowdiff[r].eq( ~((getattr(self, "row_state" + str(r)) ^ getattr(self, "rowshadow" + str(r))) == 0) )
                 ).Else(
                     rowdiff[r].eq(rowdiff[r])
                 )
@@ -160,3 +312,183 @@ class KeyScan(Module, AutoCSR, AutoDoc):
             )
         ]
         self.specials += MultiReg(self.ev.keypressed.pending, pending_key, "kbd")
+
+        # Key event FIFO, in the sys domain: the rows are snapshotted at the end of each scan, and compared
+        # one row per cycle against the state of the keys as last reported. Each change then goes through
+        # the keymap and the table of held keys before it is queued.
+        self.event = CSRStatus(fields=[
+            CSRField("code",  size=16, description="Keycode of the key"),
+            CSRField("press", size=1, description="`1` if the key was pressed (make), `0` if it was released (break)"),
+            CSRField("valid", size=1, description="`1` if this is an event, `0` if the FIFO was empty"),
+            CSRField("kind",  size=2, description="Kind of the key, from the keymap"),
+            CSRField("col",   size=4, offset=32, description="Column of the key"),
+            CSRField("row",   size=4, description="Row of the key"),
+            CSRField("time",  size=16, offset=48, description="Low 16 bits of the timestamp of the scan that saw the change"),
+        ], description="Oldest key event; reading the least significant byte pops it")
+        self.evstatus = CSRStatus(fields=[
+            CSRField("count",    size=bits_for(fifo_depth), description="Number of events in the FIFO"),
+            CSRField("overflow", size=1, offset=8, description="Set when key changes may have been missed because the FIFO was full"),
+        ])
+        self.evcontrol = CSRStorage(fields=[
+            CSRField("clear", description="Write a `1` to clear ``evstatus.overflow``", pulse=True),
+        ])
+        self.keymap = CSRStorage(fields=[
+            CSRField("code",  size=16, description="Keycode"),
+            CSRField("kind",  size=2, description="0 = key, 1 = shift, 2 = layer, 3 = ignored"),
+            CSRField("col",   size=4, offset=20, description="Column of the key"),
+            CSRField("row",   size=4, description="Row of the key"),
+            CSRField("shift", size=1, description="Entry used while a shift key is held"),
+            CSRField("layer", size=2, description="Entry used in this layer"),
+        ], description="Keymap entry; writing the least significant byte stores it")
+        self.heldindex = CSRStorage(fields=[
+            CSRField("col", size=4, description="Column of the key"),
+            CSRField("row", size=4, description="Row of the key"),
+        ], description="Key to look up in the table of held keys")
+        self.held = CSRStatus(fields=[
+            CSRField("code", size=16, description="Keycode the key was reported with when it was pressed"),
+            CSRField("kind", size=2, description="Kind of the key"),
+            CSRField("down", size=1, description="`1` if the key is held"),
+        ], description="Entry of the table of held keys selected by ``heldindex``")
+        self.modifiers = CSRStatus(fields=[
+            CSRField("layer",  size=2, description="Current layer"),
+            CSRField("shifts", size=4, offset=4, description="Number of shift keys held"),
+        ])
+        if timestamp is None:
+            timestamp = Signal(16)
+
+        KIND_SHIFT  = 1
+        KIND_LAYER  = 2
+        KIND_IGNORE = 3
+
+        self.submodules.event_fifo = event_fifo = SyncFIFO(43, fifo_depth)
+        scan_time = Signal(16)
+        scan_done_r = Signal()
+        snapshot = [Signal(cols.nbits) for r in range(rows.nbits)]
+        keystate = [Signal(cols.nbits) for r in range(rows.nbits)]
+        row_sel  = Signal(max=rows.nbits)
+        rowdelta = Signal(cols.nbits)
+        lowest   = Signal(cols.nbits)  # lowest changed key of the row
+        unsent   = Signal()  # changes of the previous snapshot not reported yet
+        overflow = Signal()
+        self.submodules.colenc = colenc = PriorityEncoder(cols.nbits)
+        new_scan = Signal()
+        pick     = Signal()
+        self.comb += [
+            new_scan.eq(scan_done_sys & ~scan_done_r),
+            rowdelta.eq(Array(snapshot)[row_sel] ^ Array(keystate)[row_sel]),
+            lowest.eq(rowdelta & (~rowdelta + 1)),
+            unsent.eq(Cat([snapshot[r] != keystate[r] for r in range(rows.nbits)]) != 0),
+            colenc.i.eq(rowdelta),
+        ]
+        self.sync += [
+            scan_done_r.eq(scan_done_sys),
+            If(new_scan,
+                [snapshot[r].eq(getattr(self, "row_state" + str(r))) for r in range(rows.nbits)],
+                row_sel.eq(0),  # go through the changes by row, from the top
+                scan_time.eq(timestamp),
+                If(unsent, overflow.eq(1)),
+            ).Elif(~colenc.n,
+                # take the lowest changed key of the row, once the previous one is through
+                If(pick,
+                    [If(row_sel == r, keystate[r].eq(keystate[r] ^ lowest)) for r in range(rows.nbits)]
+                )
+            ).Else(
+                If(row_sel == (rows.nbits - 1),
+                    row_sel.eq(0)
+                ).Else(
+                    row_sel.eq(row_sel + 1)
+                )
+            ),
+            If(self.evcontrol.fields.clear, overflow.eq(0)),
+        ]
+
+        # Keymap: keycode and kind of each key, by layer and shift state
+        keymap = Memory(18, 4*2*16*16)
+        keymap_wr = keymap.get_port(write_capable=True)
+        keymap_rd = keymap.get_port()
+        # Held keys: keycode and kind each key was pressed with, so that its release is reported alike
+        heldmap = Memory(18, 16*16)
+        held_wr  = heldmap.get_port(write_capable=True)
+        held_rd  = heldmap.get_port()
+        held_cpu = heldmap.get_port()
+        self.specials += keymap, keymap_wr, keymap_rd, heldmap, held_wr, held_rd, held_cpu
+
+        ev_col   = Signal(4)
+        ev_row   = Signal(4)
+        ev_press = Signal()
+        ev_time  = Signal(16)
+        ev_code  = Signal(16)
+        ev_kind  = Signal(2)
+        layer    = Signal(2)
+        shifts   = Signal(4)
+        self.comb += [
+            keymap_wr.adr.eq(Cat(self.keymap.fields.col, self.keymap.fields.row, self.keymap.fields.shift, self.keymap.fields.layer)),
+            keymap_wr.dat_w.eq(Cat(self.keymap.fields.code, self.keymap.fields.kind)),
+            keymap_wr.we.eq(self.keymap.re),
+            keymap_rd.adr.eq(Cat(ev_col, ev_row, shifts != 0, layer)),
+            held_rd.adr.eq(Cat(ev_col, ev_row)),
+            held_wr.adr.eq(Cat(ev_col, ev_row)),
+            held_wr.dat_w.eq(keymap_rd.dat_r),
+            If(ev_press,
+                ev_code.eq(keymap_rd.dat_r[0:16]),
+                ev_kind.eq(keymap_rd.dat_r[16:18]),
+            ).Else(
+                ev_code.eq(held_rd.dat_r[0:16]),
+                ev_kind.eq(held_rd.dat_r[16:18]),
+            ),
+            event_fifo.din.eq(Cat(ev_code, ev_press, ev_kind, ev_col, ev_row, ev_time)),
+            self.ev.keyevent.trigger.eq(event_fifo.we),
+        ]
+        evfsm = FSM(reset_state="PICK")
+        self.submodules += evfsm
+        evfsm.act("PICK",
+            pick.eq(~new_scan & ~colenc.n & event_fifo.writable),
+            If(pick,
+                NextValue(ev_col, colenc.o),
+                NextValue(ev_row, row_sel),
+                NextValue(ev_press, (Array(snapshot)[row_sel] >> colenc.o)[0]),
+                NextValue(ev_time, scan_time),
+                NextState("LOOKUP")
+            )
+        )
+        evfsm.act("LOOKUP",
+            NextState("QUEUE")
+        )
+        evfsm.act("QUEUE",
+            held_wr.we.eq(ev_press),
+            event_fifo.we.eq(ev_kind != KIND_IGNORE),
+            If(ev_kind == KIND_SHIFT,
+                If(ev_press,
+                    NextValue(shifts, shifts + 1)
+                ).Elif(shifts != 0,
+                    NextValue(shifts, shifts - 1)
+                )
+            ),
+            If(ev_kind == KIND_LAYER,
+                If(ev_press,
+                    NextValue(layer, ev_code[0:2])
+                ).Elif(layer == ev_code[0:2],
+                    NextValue(layer, 0)
+                )
+            ),
+            NextState("PICK")
+        )
+
+        self.comb += [
+            self.event.fields.code.eq(event_fifo.dout[0:16]),
+            self.event.fields.press.eq(event_fifo.dout[16]),
+            self.event.fields.valid.eq(event_fifo.readable),
+            self.event.fields.kind.eq(event_fifo.dout[17:19]),
+            self.event.fields.col.eq(event_fifo.dout[19:23]),
+            self.event.fields.row.eq(event_fifo.dout[23:27]),
+            self.event.fields.time.eq(event_fifo.dout[27:43]),
+            event_fifo.re.eq(self.event.we),
+            self.evstatus.fields.count.eq(event_fifo.level),
+            self.evstatus.fields.overflow.eq(overflow),
+            held_cpu.adr.eq(Cat(self.heldindex.fields.col, self.heldindex.fields.row)),
+            self.held.fields.code.eq(held_cpu.dat_r[0:16]),
+            self.held.fields.kind.eq(held_cpu.dat_r[16:18]),
+            self.held.fields.down.eq((Array(keystate)[self.heldindex.fields.row] >> self.heldindex.fields.col)[0]),
+            self.modifiers.fields.layer.eq(layer),
+            self.modifiers.fields.shifts.eq(shifts),
+        ]
@@ -1,5 +1,6 @@
 from migen import *
 from migen.genlib.fsm import FSM, NextState
+from migen.genlib.fifo import SyncFIFO
 
 from litex.soc.interconnect import wishbone
 from litex.soc.interconnect.csr import *
@@ -8,7 +9,8 @@ from litex.soc.integration.doc import AutoDoc, ModuleDoc
 
 
 class MemLCD(Module, AutoCSR):
-    def __init__(self, pads):
+    def __init__(self, pads, text_mode=False, dma=False, fb_bram=True):
+        assert fb_bram or dma, "MemLCD needs either a local frame buffer or a DMA frame buffer"
         self.background = ModuleDoc("""MemLCD: Driver for the SHARP Memory LCD model LS032B7DD02
 
         The LS032B7DD02 is a 336x536 pixel black and white memory LCD, with a 200ppi dot pitch.
@@ -142,50 +144,212 @@ class MemLCD(Module, AutoCSR):
         buffer and it will render directly to the screen with no further transformations
         required.
 
+        For small, localized updates (such as a clock or a status bar), the "UpdateRange" command
+        sends exactly the lines from ``update_range.start`` to ``update_range.end``, inclusive, regardless
+        of the state of the dirty bits, and without scanning the rest of the frame buffer. Lines are
+        numbered from 1 to 536, in the same order as they are stored in the frame buffer. Because the
+        memory LCD can only be updated a full line at a time, a rectangle is updated by sending the
+        range of lines that it spans.
+
+        Ranges are queued in a small FIFO, so several of them can be committed back-to-back; the
+        block stays busy (and fires a single "done" interrupt) until the FIFO is drained. If the FIFO
+        is full, ``range_status.full`` is set and further "UpdateRange" commands are dropped.
+
         The CPU is responsible for not writing data to the LCD while it is updating. Concurrent
         writes to the LCD during updates can lead to unpredictable behavior.
         """)
+        if text_mode:
+            self.textlayer = ModuleDoc("""Text layer for MemLCD
+
+            When built with ``text_mode=True``, MemLCD adds a character cell buffer and a font memory
+            that are composed with the frame buffer on the fly as each line is serialized to the LCD.
+            This allows a console to update a line of text by writing a handful of cell bytes, instead
+            of rasterizing every glyph into the frame buffer.
+
+            Glyphs are 8 pixels wide by 16 lines tall, giving 42 columns by 33 rows of text. The
+            text rows cover LCD lines 1 through 528; the bottom 8 lines always come from the frame buffer.
+
+            The cell buffer mirrors the frame buffer organization: each text row is 44 bytes (11 words)
+            long, and each cell is one byte. Cells are packed with the left-most cell in the LSB of
+            each 32-bit word, with the left-most cells occupying the lowest address in the row. A cell
+            is encoded as follows:
+
+            * bits 0-6: glyph number (0-127)
+            * bit 7: invert the glyph (white on black)
+
+            A cell value of ``0x00`` is transparent: the frame buffer pixels show through. This allows
+            text and graphics to be mixed on the same line.
+
+            The last two cells of each row (the upper 16 bits of the row's last word) are not displayed,
+            and serve as a dirty "hint" for the text row, just like the unused bits of a frame buffer
+            line. If they are non-zero, all 16 LCD lines of the text row are sent on an "UpdateDirty"
+            command. As with the frame buffer, it is up to the CPU to set and clear these bits.
+
+            The font memory holds 128 glyphs of 16 bytes each, one byte per glyph line, starting with
+            the top line of the glyph at the lowest address. The LSB of each byte is the left-most pixel,
+            and a ``1`` is drawn as black. The font is all blank at reset and must be loaded by the CPU,
+            typically by copying it out of the SPI flash at boot.
+
+            The text layer is only displayed when the ``textmode`` CSR is set to ``1``. The cell buffer
+            starts at byte offset ``text_base`` of the MemLCD memory region, and the font memory
+            at byte offset ``font_base``.
+            """)
+
+        if dma:
+            self.dmadoc = ModuleDoc("""DMA frame buffer for MemLCD
+
+            When built with ``dma=True``, MemLCD can fetch its pixel data from a frame buffer in
+            main memory (typically ``sram_ext``) instead of its local block RAM frame buffer. Setting
+            ``dmamode`` to ``1`` selects the DMA frame buffer; when MemLCD is built with ``fb_bram=False``
+            there is no local frame buffer at all and DMA mode is always on, which frees up the block
+            RAM for other uses.
+
+            The DMA frame buffer has the same layout as the local frame buffer, except that the
+            distance between lines is programmable with ``dma_stride`` (in bytes, 44 by default),
+            and it starts at the byte address in ``dma_base``. Line N (counting from 1) thus starts at
+            ``dma_base + (N - 1) * dma_stride``. Several frame buffers can coexist in memory, and
+            switching between them is just a matter of changing ``dma_base`` between updates.
+
+            Lines are fetched with a wishbone burst into a line buffer, which has room for two lines:
+            while a line is being sent to the LCD, the next line is fetched in full into the other half,
+            so the fetches are hidden behind the LCD transfers. During an "UpdateDirty", lines that
+            turn out to be clean are skipped by fetching only the last word of each line (which holds
+            the dirty bits), and the rest of the line is fetched only if the line is dirty.
+
+            The CPU must make sure the frame buffer contents have actually been written to memory
+            (e.g. by flushing its data cache) before starting an update, and must not change
+            ``dma_base`` or ``dma_stride`` while the block is busy. ``dma_base`` must point to memory
+            that is mapped on the bus, otherwise the update stalls until the bus times out. A fetch
+            that ends with a bus error does not stop the update; the line is sent with whatever data
+            the bus returned, and ``dma_status.err`` is set until the next update starts.
+            """)
+
         data_width     = 32
         width          = 336
         height         = 536
         bytes_per_line = 44
 
         self.fb_depth = fb_depth = height * bytes_per_line // (data_width//8)
+        words_per_line = bytes_per_line // (data_width//8)
         pixdata   = Signal(32)
         pixadr_rd = Signal(max=fb_depth)
-
-        # 1 is white, which is the "off" state
-        fb_init = [0xffffffff] * int(fb_depth)
-        for i in range(fb_depth // 11):
-            fb_init[i * 11 + 10] = 0xffff
-        mem = Memory(32, fb_depth, init=fb_init)  # may need to round up to 8192 if a power of 2 is required by migen
-        # read port for pixel data out
-        self.specials.rdport = mem.get_port(write_capable=False, mode=READ_FIRST) # READ_FIRST allows BRAM to be used
-        self.comb += self.rdport.adr.eq(pixadr_rd)
-        self.comb += pixdata.eq(self.rdport.dat_r)
-        # implementation note: vivado will complain about being unable to merge an output register, leading to
-        # non-optimal timing, but a check of the timing path shows that at 100MHz there is about 4-5ns of setup margin,
-        # so the merge is unnecessary in this case. Ergo, prefer comb over sync to reduce latency.
+        dma_on    = Signal()  # pixel data comes from the DMA line buffer instead of the local frame buffer
 
         # memory-mapped write port to wishbone bus
         self.bus = wishbone.Interface()
-        self.submodules.wb_sram_if = wishbone.SRAM(mem, read_only=False)
         decoder_offset = log2_int(fb_depth, need_pow2=False)
-        def slave_filter(a):
-                return a[decoder_offset:32-decoder_offset] == 0  # no aliasing in the block
-        self.submodules.wb_con = wishbone.Decoder(self.bus, [(slave_filter, self.wb_sram_if.bus)], register=True)
-
-        self.command = CSRStorage(2, fields=[
+        slaves = []  # the memories are packed into consecutive decoder_offset-sized slots of the window
+        if fb_bram:
+            # 1 is white, which is the "off" state
+            fb_init = [0xffffffff] * int(fb_depth)
+            for i in range(fb_depth // 11):
+                fb_init[i * 11 + 10] = 0xffff
+            mem = Memory(32, fb_depth, init=fb_init)  # may need to round up to 8192 if a power of 2 is required by migen
+            # read port for pixel data out
+            self.specials.rdport = mem.get_port(write_capable=False, mode=READ_FIRST) # READ_FIRST allows BRAM to be used
+            self.comb += self.rdport.adr.eq(pixadr_rd)
+            # implementation note: vivado will complain about being unable to merge an output register, leading to
+            # non-optimal timing, but a check of the timing path shows that at 100MHz there is about 4-5ns of setup margin,
+            # so the merge is unnecessary in this case. Ergo, prefer comb over sync to reduce latency.
+
+            self.submodules.wb_sram_if = wishbone.SRAM(mem, read_only=False)
+            def slave_filter(a):
+                    return a[decoder_offset:32-decoder_offset] == 0  # no aliasing in the block
+            slaves += [(slave_filter, self.wb_sram_if.bus)]
+        slot_size = (1 << decoder_offset) * (data_width//8)  # size of a slot, in bytes
+
+        if text_mode:
+            glyph_height = 16
+            text_rows    = height // glyph_height
+            text_depth   = text_rows * bytes_per_line // (data_width//8)
+            font_depth   = 128 * glyph_height // (data_width//8)
+
+            # cell buffer and font share the wishbone window with the frame buffer, in the next two slots
+            text_slot = len(slaves)
+            textmem = Memory(32, text_depth, init=[0] * text_depth)
+            fontmem = Memory(32, font_depth, init=[0] * font_depth)
+            self.specials.text_rdport = textmem.get_port(write_capable=False, mode=READ_FIRST)
+            self.specials.font_rdport = fontmem.get_port(write_capable=False, mode=READ_FIRST)
+            self.submodules.wb_text_if = wishbone.SRAM(textmem, read_only=False)
+            self.submodules.wb_font_if = wishbone.SRAM(fontmem, read_only=False)
+            def text_filter(a):
+                return a[decoder_offset:32-decoder_offset] == text_slot
+            def font_filter(a):
+                return a[decoder_offset:32-decoder_offset] == text_slot + 1
+            slaves += [(text_filter, self.wb_text_if.bus), (font_filter, self.wb_font_if.bus)]
+            self.text_base = slot_size * text_slot
+            self.font_base = slot_size * (text_slot + 1)
+        self.mem_size = slot_size * len(slaves)  # size of the memory window, in bytes
+
+        if slaves:
+            self.submodules.wb_con = wishbone.Decoder(self.bus, slaves, register=True)
+
+        if dma:
+            # line buffer for the DMA engine, in two halves so the next line can be fetched while one is sent;
+            # each half is deeper than a line so that pixcount can't run off the end
+            linebuf = Memory(32, 32)
+            self.specials += linebuf
+            self.specials.linebuf_wrport = linebuf.get_port(write_capable=True)
+            self.specials.linebuf_rdport = linebuf.get_port(write_capable=False)
+            if fb_bram:
+                self.comb += pixdata.eq(Mux(dma_on, self.linebuf_rdport.dat_r, self.rdport.dat_r))
+            else:
+                self.comb += pixdata.eq(self.linebuf_rdport.dat_r)
+        else:
+            self.comb += pixdata.eq(self.rdport.dat_r)
+
+        self.command = CSRStorage(3, fields=[
             CSRField("UpdateDirty", description="Write a ``1`` to flush dirty lines to the LCD", pulse=True),
             CSRField("UpdateAll",   description="Update full screen regardless of tag state",    pulse=True),
+            CSRField("UpdateRange", description="Queue the lines in ``update_range`` for update", pulse=True),
+        ])
+
+        self.update_range = CSRStorage(fields=[
+            CSRField("start", size=10, description="First line of the range to update, from 1 to 536"),
+            CSRField("end",   size=10, description="Last line of the range to update, inclusive"),
+        ])
+        self.range_status = CSRStatus(fields=[
+            CSRField("full", description="Set when the range queue is full; further ``UpdateRange`` commands are dropped"),
         ])
 
         self.busy = CSRStatus(1, name="Busy", description="""A ``1`` indicates that the block is currently updating the LCD""")
 
+        # Update statistics, latched when busy drops; the counters saturate instead of wrapping around
+        self.stat_cycles = CSRStatus(32, name="stat_cycles", description="""
+        Number of sysclk cycles the last update was busy for""")
+        self.stat_lines = CSRStatus(16, name="stat_lines", description="""
+        Number of lines sent to the LCD during the last update. Queued ranges can keep an update going
+        for more than a screenful of lines""")
+        self.stat_scan = CSRStatus(32, name="stat_scan", description="""
+        Number of sysclk cycles the last update spent fetching and checking line dirty bits, and
+        working out the DMA address of the first line to send""")
+        self.stat_scs = CSRStatus(32, name="stat_scs", description="""
+        Number of sysclk cycles the last update spent in SCS setup, hold and low time, i.e. not clocking bits out""")
+        if dma:
+            self.stat_stall = CSRStatus(32, name="stat_stall", description="""
+            Number of sysclk cycles the last update spent waiting on DMA line fetches""")
+            self.dma_status = CSRStatus(fields=[
+                CSRField("err", description="Set when a DMA line fetch of the current or last update got a bus error"),
+            ])
+
         self.prescaler = CSRStorage(8, reset=99, name="prescaler", description="""
         Prescaler value. LCD clock is module (clock / (prescaler+1)). Reset value: 99, so
         for a default sysclk of 100MHz this yields an LCD SCLK of 1MHz""")
 
+        if dma:
+            self.dmamode = CSRStorage(1, reset=0 if fb_bram else 1, name="dmamode", description="""
+            Write ``1`` to take pixel data from the DMA frame buffer at ``dma_base``. Ignored (always on)
+            when there is no local frame buffer""")
+            self.dma_base = CSRStorage(32, name="dma_base", description="""
+            Byte address of the first line of the DMA frame buffer; must be word-aligned""")
+            self.dma_stride = CSRStorage(16, reset=bytes_per_line, name="dma_stride", description="""
+            Distance between lines of the DMA frame buffer in bytes; must be a multiple of 4,
+            and at least 44""")
+
+        if text_mode:
+            self.textmode = CSRStorage(1, name="textmode", description="""
+            Write ``1`` to compose the text layer over the frame buffer when lines are sent to the LCD""")
+
         self.submodules.ev = EventManager()
         self.ev.done       = EventSourceProcess()
         self.ev.finalize()
@@ -200,6 +364,75 @@ class MemLCD(Module, AutoCSR):
         fetch_dirty = Signal()
         update_line = Signal(max=height) # Keep track of both line and address to avoid instantiating a multiplier
         update_addr = Signal(max=height*bytes_per_line)
+        line_dirty  = Signal()
+        first_line  = Signal(max=height+1) # Update stops once update_line drops below this line
+
+        # Queue of line ranges to update
+        self.submodules.range_fifo = range_fifo = SyncFIFO(20, 8)
+        range_start = Signal(10)
+        range_end   = Signal(10)
+        self.comb += [
+            range_fifo.din.eq(Cat(self.update_range.fields.start, self.update_range.fields.end)),
+            range_fifo.we.eq(self.command.fields.UpdateRange),
+            self.range_status.fields.full.eq(~range_fifo.writable),
+            # clip the range to the screen; an inverted range is simply empty
+            If(range_fifo.dout[:10] == 0,
+                range_start.eq(1)
+            ).Else(
+                range_start.eq(range_fifo.dout[:10])
+            ),
+            If(range_fifo.dout[10:] > height,
+                range_end.eq(height)
+            ).Else(
+                range_end.eq(range_fifo.dout[10:])
+            ),
+        ]
+
+        dma_start = Signal()
+        dma_done  = Signal()
+        dma_first = Signal(max=words_per_line) # First word of the line to fetch, qualified by dma_start
+        dma_next  = Signal() # Fetch update_line - 1 into the other half of the line buffer, qualified by dma_start
+        dma_line  = Signal(32) # Byte address of update_line in the DMA frame buffer, stepped alongside update_addr
+        bank      = Signal() # Half of the line buffer holding update_line
+        line_full = Signal() # The whole of update_line is in the line buffer, not just its dirty bits
+        pre_busy  = Signal() # update_line - 1 is being fetched into the other half of the line buffer
+        pre_ready = Signal() # ...and has arrived
+        pre_take  = Signal()
+        if dma:
+            goto_fetch = [
+                If(dma_on & (pre_busy | pre_ready),
+                    NextState("NEXTLINE")
+                ).Elif(dma_on,
+                    NextState("FETCHLINE")
+                ).Else(
+                    NextState("FETCHDIRTY")
+                )
+            ]
+            goto_send  = [If(dma_on & ~line_full, NextState("FETCHREST")).Else(NextState("DIRTYLINE"))]
+            line_step  = [NextValue(dma_line, dma_line - self.dma_stride.storage)]
+            # dma_line = dma_base + (last_line - 1) * dma_stride, worked out by shift-and-add in SEEK
+            seek_mult  = Signal(10)
+            seek_add   = Signal(32)
+            def goto_seek(last_line):
+                return [
+                    NextValue(dma_line, self.dma_base.storage),
+                    NextValue(seek_mult, last_line - 1),
+                    NextValue(seek_add, self.dma_stride.storage),
+                    NextState("SEEK")
+                ]
+            # ...except for the last line of the screen, whose address only takes constant shifts
+            # and is kept up to date here
+            dma_last   = Signal(32)
+            self.sync += dma_last.eq(self.dma_base.storage +
+                sum(self.dma_stride.storage << i for i in range(10) if (height - 1) & (1 << i)))
+            dma_top    = [NextValue(dma_line, dma_last)]
+        else:
+            goto_fetch = [NextState("FETCHDIRTY")]
+            goto_send  = [NextState("DIRTYLINE")]
+            line_step  = []
+            def goto_seek(last_line):
+                return goto_fetch
+            dma_top    = []
 
         fsm_up = FSM(reset_state="IDLE")
         self.submodules += fsm_up
@@ -214,34 +447,51 @@ class MemLCD(Module, AutoCSR):
                     NextValue(updateall, 0)
                 ),
                 NextState("START")
+            ).Elif(range_fifo.readable,
+                range_fifo.re.eq(1),
+                NextValue(self.busy.status, 1),
+                NextValue(fetch_dirty, 1),
+                NextValue(updateall, 1),
+                NextValue(first_line, range_start),
+                NextValue(update_line, range_end),
+                NextValue(update_addr, (range_end - 1) * bytes_per_line),
+                *goto_seek(range_end)
             ).Else(
                 NextValue(self.busy.status, 0)
             )
         )
         fsm_up.act("START",
+            NextValue(first_line, 1),
             NextValue(update_line, height),
             NextValue(update_addr, (height -1) * bytes_per_line), # Represents the byte address of the beginning of the last line
-            NextState("FETCHDIRTY")
+            *dma_top,
+            *goto_fetch
         )
         fsm_up.act("FETCHDIRTY", # Wait one cycle delay for the pixel data to be retrieved before evaluating it
             NextState("CHECKDIRTY")
         )
         fsm_up.act("CHECKDIRTY",
-            If(update_line == 0,
+            If(update_line < first_line,
                 NextState("IDLE")
             ).Else(
-                If( (pixdata[16:] != 0) | updateall,
-                    NextState("DIRTYLINE"),
+                If(line_dirty | updateall,
+                    *goto_send
                 ).Else(
                     NextValue(update_line, update_line - 1),
                     NextValue(update_addr, update_addr - bytes_per_line),
-                    NextState("FETCHDIRTY")
+                    *line_step,
+                    *goto_fetch
                 )
             )
         )
         fsm_up.act("DIRTYLINE",
             NextValue(fetch_dirty, 0),
             sendline.eq(1),
+            # Fetch the next line while this one is being sent
+            If(dma_on & (update_line > first_line),
+                dma_start.eq(1),
+                dma_next.eq(1),
+            ),
             NextState("WAITDONE")
         )
         fsm_up.act("WAITDONE",
@@ -249,9 +499,123 @@ class MemLCD(Module, AutoCSR):
                 NextValue(fetch_dirty, 1),
                 NextValue(update_line, update_line - 1),
                 NextValue(update_addr, update_addr - bytes_per_line),
-                NextState("FETCHDIRTY")
+                *line_step,
+                *goto_fetch
             )
         )
+        if dma:
+            fsm_up.act("FETCHLINE",
+                If(update_line < first_line,
+                    NextState("FETCHDIRTY") # Done; don't fetch past the first line
+                ).Else(
+                    dma_start.eq(1),
+                    # In dirty mode only fetch the dirty bits at first; the rest of the line follows if needed
+                    If(~updateall,
+                        dma_first.eq(words_per_line - 1)
+                    ),
+                    NextValue(line_full, updateall),
+                    NextState("FETCHWAIT")
+                )
+            )
+            fsm_up.act("SEEK", # dma_stride is a variable, so multiply one bit per cycle rather than with a DSP
+                If(seek_mult != 0,
+                    If(seek_mult[0],
+                        NextValue(dma_line, dma_line + seek_add)
+                    ),
+                    NextValue(seek_mult, seek_mult[1:]),
+                    NextValue(seek_add, seek_add << 1)
+                ).Else(
+                    *goto_fetch
+                )
+            )
+            fsm_up.act("NEXTLINE", # Switch to the line fetched by the last DIRTYLINE, once it has arrived
+                If(pre_ready,
+                    pre_take.eq(1),
+                    NextValue(bank, ~bank),
+                    NextValue(line_full, 1),
+                    NextState("FETCHDIRTY")
+                )
+            )
+            fsm_up.act("FETCHWAIT",
+                If(dma_done,
+                    NextState("FETCHDIRTY")
+                )
+            )
+            fsm_up.act("FETCHREST",
+                dma_start.eq(1),
+                NextState("FETCHRESTWAIT")
+            )
+            fsm_up.act("FETCHRESTWAIT",
+                If(dma_done,
+                    NextState("DIRTYLINE")
+                )
+            )
+
+            # Line fetch engine: bursts words [dma_first, words_per_line) of update_line, or all of update_line - 1
+            # if dma_next, into the line buffer
+            self.dma_bus = dma_bus = wishbone.Interface()
+            dma_word = Signal(max=16)
+            dma_adr  = Signal(30)
+            dma_bank = Signal()
+            self.comb += dma_on.eq(self.dmamode.storage if fb_bram else 1)
+            self.sync += [
+                If(dma_start & dma_next,
+                    pre_busy.eq(1)
+                ).Elif(pre_busy & dma_done,
+                    pre_busy.eq(0),
+                    pre_ready.eq(1)
+                ),
+                If(pre_take,
+                    pre_ready.eq(0)
+                )
+            ]
+            fsm_dma = FSM(reset_state="IDLE")
+            self.submodules += fsm_dma
+            fsm_dma.act("IDLE",
+                If(dma_start,
+                    NextValue(dma_word, dma_first),
+                    NextValue(dma_bank, bank ^ dma_next),
+                    If(dma_next,
+                        NextValue(dma_adr, (dma_line - self.dma_stride.storage)[2:])
+                    ).Else(
+                        NextValue(dma_adr, dma_line[2:])
+                    ),
+                    NextState("SETUP")
+                )
+            )
+            fsm_dma.act("SETUP",
+                NextValue(dma_adr, dma_adr + dma_word),
+                NextState("READ")
+            )
+            fsm_dma.act("READ",
+                dma_bus.cyc.eq(1),
+                dma_bus.stb.eq(1),
+                dma_bus.we.eq(0),
+                dma_bus.sel.eq(0xf),
+                dma_bus.adr.eq(dma_adr),
+                dma_bus.bte.eq(0),
+                If(dma_word == words_per_line - 1,
+                    dma_bus.cti.eq(7)  # end of burst
+                ).Else(
+                    dma_bus.cti.eq(2)  # incrementing burst
+                ),
+                If(dma_bus.ack | dma_bus.err,
+                    self.linebuf_wrport.we.eq(1),
+                    NextValue(dma_adr, dma_adr + 1),
+                    NextValue(dma_word, dma_word + 1),
+                    If(dma_word == words_per_line - 1,
+                        NextState("DONE")
+                    )
+                )
+            )
+            fsm_dma.act("DONE",
+                dma_done.eq(1),
+                NextState("IDLE")
+            )
+            self.comb += [
+                self.linebuf_wrport.adr.eq(Cat(dma_word, dma_bank)),
+                self.linebuf_wrport.dat_w.eq(dma_bus.dat_r),
+            ]
 
         modeshift = Signal(16)
         mode      = Signal(6)
@@ -271,13 +635,72 @@ class MemLCD(Module, AutoCSR):
                 pixadr_rd.eq((update_addr + pixcount[3:])[2:])
             )
          ]
-        scs_cnt = Signal(max=200)
+        if dma:
+            self.comb += [
+                If(fetch_dirty,
+                    self.linebuf_rdport.adr.eq(Cat(C(words_per_line - 1, 4), bank))
+                ).Else(
+                    self.linebuf_rdport.adr.eq(Cat(pixcount[5:], bank))
+                )
+            ]
+        pixel      = Signal()  # next pixel to be shifted out
+        glyph_step = []
+        if text_mode:
+            line_idx    = Signal(max=height)
+            text_line   = Signal()
+            text_row    = Signal(max=text_rows)
+            glyph_y     = Signal(log2_int(glyph_height))
+            cell        = Signal(8)
+            font_byte   = Signal(8)
+            glyph_shift = Signal(8)
+            glyph_ena   = Signal()
+            glyph_inv   = Signal()
+            text_bytes  = Array([self.text_rdport.dat_r[i*8:(i+1)*8] for i in range(data_width//8)])
+            font_bytes  = Array([self.font_rdport.dat_r[i*8:(i+1)*8] for i in range(data_width//8)])
+            # The cell and font lookups are chained off of pixcount, mirroring how pixdata is fetched;
+            # the resulting glyph byte is stable a couple of cycles later, well before the next bit is sent
+            self.comb += [
+                line_idx.eq(update_line - 1),
+                text_line.eq(self.textmode.storage & (line_idx < text_rows * glyph_height)),
+                text_row.eq(line_idx[log2_int(glyph_height):]),
+                glyph_y.eq(line_idx[:log2_int(glyph_height)]),
+                If(fetch_dirty,
+                    self.text_rdport.adr.eq(text_row * words_per_line + words_per_line - 1)
+                ).Else(
+                    self.text_rdport.adr.eq(text_row * words_per_line + pixcount[5:])
+                ),
+                cell.eq(text_bytes[pixcount[3:5]]),
+                self.font_rdport.adr.eq(Cat(glyph_y[2:], cell[:7])),
+                font_byte.eq(font_bytes[glyph_y[:2]]),
+                line_dirty.eq((pixdata[16:] != 0) | (text_line & (self.text_rdport.dat_r[16:] != 0))),
+                # a "1" in the font is black; cells of 0 are transparent and let the frame buffer through
+                If(glyph_ena,
+                    pixel.eq(~(glyph_shift[0] ^ glyph_inv))
+                ).Else(
+                    pixel.eq(pixshift[0])
+                ),
+            ]
+            glyph_step = [
+                If(pixcount[0:3] == 0,
+                    NextValue(glyph_shift, font_byte),
+                    NextValue(glyph_ena, text_line & (cell != 0) & (pixcount[3:] < width // 8)),
+                    NextValue(glyph_inv, cell[7]),
+                ).Else(
+                    NextValue(glyph_shift, glyph_shift[1:]),
+                )
+            ]
+        else:
+            self.comb += [
+                line_dirty.eq(pixdata[16:] != 0),
+                pixel.eq(pixshift[0]),
+            ]
+        scs_cnt = Signal(max=301)
         fsm_phy.act("IDLE",
             NextValue(si, 0),
             NextValue(linedone, 0),
             If(sendline,
                 NextValue(scs, 1),
-                NextValue(scs_cnt, 200), # 2 us setup
+                NextValue(scs_cnt, 300), # 3 us setup
                 NextValue(pixcount, 16),
                 NextValue(modeshift, Cat(mode, update_line)),
                 NextState("SCS_SETUP")
@@ -302,6 +725,7 @@ class MemLCD(Module, AutoCSR):
             ).Else(
                 NextValue(pixcount, 1),
                 NextValue(pixshift, pixdata),
+                *glyph_step,
                 NextState("DATA")
             )
         )
@@ -317,8 +741,9 @@ class MemLCD(Module, AutoCSR):
                 ).Else(
                     NextValue(pixshift, pixshift[1:]),
                 ),
+                *glyph_step,
                 NextValue(scs, 1),
-                NextValue(si, pixshift[0]),
+                NextValue(si, pixel),
                 NextValue(pixcount, pixcount + 1),
                 bitreq.eq(1),
                 NextState("DATAWAIT")
@@ -377,3 +802,41 @@ class MemLCD(Module, AutoCSR):
                 bitack.eq(1)
             )
         )
+
+        # Statistics counters run while busy, get latched into the status registers when busy drops,
+        # and clear while idle. They saturate rather than wrap around.
+        busy_r   = Signal()
+        scanning = fsm_up.ongoing("FETCHDIRTY") | fsm_up.ongoing("CHECKDIRTY")
+        if dma:
+            scanning = scanning | fsm_up.ongoing("SEEK")
+        cnt_stat = [
+            (self.stat_cycles, 1),
+            (self.stat_lines,  sendline),
+            (self.stat_scan,   scanning),
+            (self.stat_scs,    fsm_phy.ongoing("SCS_SETUP") | fsm_phy.ongoing("SCS_HOLD") | fsm_phy.ongoing("SCS_LOW")),
+        ]
+        if dma:
+            cnt_stat += [(self.stat_stall, fsm_up.ongoing("FETCHWAIT") | fsm_up.ongoing("FETCHRESTWAIT") | fsm_up.ongoing("NEXTLINE"))]
+        self.sync += busy_r.eq(self.busy.status)
+        if dma:
+            self.sync += [
+                If(self.busy.status & ~busy_r,
+                    self.dma_status.fields.err.eq(0)
+                ).Elif(fsm_dma.ongoing("READ") & dma_bus.err,
+                    self.dma_status.fields.err.eq(1)
+                )
+            ]
+        for (stat, inc) in cnt_stat:
+            cnt = Signal(len(stat.status))
+            self.sync += [
+                If(self.busy.status,
+                    If(inc & (cnt != 2**len(cnt) - 1),
+                        cnt.eq(cnt + 1)
+                    )
+                ).Else(
+                    cnt.eq(0)
+                ),
+                If(busy_r & ~self.busy.status,
+                    stat.status.eq(cnt)
+                )
+            ]
@@ -1 +1 @@
-from trng.ring_osc import TrngRingOsc
+from .ring_osc import TrngRingOsc
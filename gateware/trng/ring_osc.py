@@ -1,11 +1,16 @@
+from operator import xor
+
 from migen import *
 from migen.genlib.cdc import MultiReg
+from migen.genlib.fifo import SyncFIFOBuffered
 
+from litex.soc.interconnect import wishbone
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect.csr_eventmanager import *
 from litex.soc.integration.doc import AutoDoc, ModuleDoc
 
 class TrngRingOsc(Module, AutoCSR, AutoDoc):
-    def __init__(self, platform, target_freq=1e6, rng_shift_width=32):
+    def __init__(self, platform, target_freq=1e6, rng_shift_width=32, fifo_depth=512, apt_window=1024, pairs=1):
         self.intro = ModuleDoc("""
 TrngRingOsc builds a pair of ring oscillators. One is the "slow" oscillator, which circumscribes
 the die, and attempts to hit the target_freq supplied as a parameter. The other is a "fast" oscillator,
@@ -14,54 +19,112 @@ is to have the "fast" oscillator sample at a period that is faster than the aver
 up by the slow oscillator as it circumscribes the die. Thus, if the quality of entropy is not good
 enough, the fix is to slow down the target_freq parameter.
 
-* self.trng_raw is the unsynchronized output TRNG stream
+* self.trng_raw is the unsynchronized output TRNG stream, one bit per pair
 * self.trng_out_sync is the TRNG stream, but jammed through a sysclk synchronizer
-* self.trng_slow and self.trng_fast are debug hooks for checking the ring oscillators  
+* self.trng_slow and self.trng_fast are debug hooks for checking the ring oscillators, one bit per pair
+        """)
+        self.pairsdoc = ModuleDoc("""Parallel pairs
+
+        As the bitrate of a pair is set by the slow oscillator, it can only be raised by giving up on jitter.
+        Instead, the ``pairs`` parameter builds several independent pairs, each one spiralling within its own band
+        of columns of the die, so that the bitrate scales with the number of pairs while every slow oscillator
+        keeps its period. Each pair can be turned off through ``pair_ena``, for instance to check them one by one.
+
+        The bits of the enabled pairs are merged into one stream, which is what the ``rand`` register and the FIFO
+        see; the health tests check each pair on its own. By default the pairs are taken in turn, each bit being passed on as it comes, for
+        a bitrate of about ``pairs`` times ``target_freq``. Setting ``ctl.xor`` rather XORs the latest bits
+        of the enabled pairs together, on each bit of the lowest enabled pair, for a better quality stream
+        at the bitrate of a single pair.
+        """)
+        self.fifodoc = ModuleDoc("""Entropy FIFO
+
+        Besides the ``rand`` register, the bitstream is continuously collected into 32-bit words, which are queued
+        in a FIFO of ``fifo_depth`` words while the TRNG is enabled, so that entropy builds up while nobody reads it.
+        The bits go through a von Neumann corrector first: bits are taken in pairs, a `01` pair gives a `0`,
+        a `10` pair a `1`, and `00` and `11` pairs are dropped, which removes any bias from the stream at the cost
+        of at least three quarters of the bitrate. Setting ``ctl.raw`` queues the bits as they are.
+
+        The FIFO is read through the ``bus`` wishbone window: every 32-bit read, at any address of the window,
+        pops a word, so that a block of entropy can be copied out with a burst of reads. Writes are ignored.
+        A read of an empty FIFO ends with a bus error rather than stall the bus until the next word, so check
+        ``level``, which tells how many words are ready, before reading. Words made while the FIFO is full are
+        dropped. While the TRNG is enabled, the ``lowwater`` interrupt fires when the number of words in the FIFO
+        falls below ``watermark``, so that consumers can hold off until it has refilled.
+        """)
+        self.healthdoc = ModuleDoc("""Health tests
+
+        The raw bits of each pair, before they are merged and go through the von Neumann corrector, are
+        continuously checked by the two health tests of NIST SP 800-90B, section 4.4, so that a failing noise
+        source is caught without the CPU having to look at the bitstream, and can't be masked by the other pairs:
+
+        * The Repetition Count Test fails when a bit is repeated ``rct_cutoff`` times in a row.
+        * The Adaptive Proportion Test takes windows of ``apt_window`` (1024) bits, and fails when the first bit
+          of a window shows up ``apt_cutoff`` times in it.
+
+        The cutoffs default to the values for a min-entropy of 0.5 bit per raw bit and a false positive
+        rate of 2^-20, that is 41 and, for the default window, 793; they can be tuned once the source
+        has been characterized.
+
+        Each failure bumps ``rct_failures`` or ``apt_failures``, marks the pair in ``health_pairs``, and sets the
+        matching flag of ``health``, which stays set until ``health_ctl.clear`` is written, and the ``healthfail``
+        interrupt fires. On a failure the FIFO is flushed, and no words are queued in it while a flag is set; reads
+        of the ``bus`` window end with a bus error. Writing ``health_ctl.clear`` also drops the word being collected,
+        and the tests have to go through a whole window again before words are queued. Setting ``health_ctl.nogate``
+        keeps the FIFO going anyway, for characterizing the source. After the TRNG is enabled, no words are queued
+        until every enabled pair has had a full window go through the tests, as ``health.ready`` tells. The ``rand``
+        register is not gated: check ``health`` before using it.
         """)
         devstr = platform.device.split('-')
         device_root = devstr[0]
         if devstr[1] == 'up5k':
             device_root = device_root + devstr[1]
 
-        self.trng_raw = Signal()  # raw TRNG output bitstream
+        self.trng_raw = Signal(pairs)  # raw TRNG output bitstreams, one per pair
         self.trng_out_sync = Signal()  # single-bit output, synchronized to sysclk
         self.ctl = CSRStorage(fields=[
-            CSRField("ena", size=1, description="Enable the TRNG; 0 puts the TRNG into full powerdown", reset=0)
+            CSRField("ena", size=1, description="Enable the TRNG; 0 puts the TRNG into full powerdown", reset=0),
+            CSRField("raw", size=1, description="Queue raw bits into the FIFO, without the von Neumann corrector", reset=0),
+            CSRField("xor", size=1, description="XOR the bits of the enabled pairs together, rather than take them in turn", reset=0),
         ])
+        self.pair_ena = CSRStorage(pairs, reset=2**pairs - 1, name="pair_ena",
+            description="""Enable each ring oscillator pair; a pair that is off is powered down""")
         self.rand = CSRStatus(fields=[
             CSRField("rand", size=rng_shift_width, description="Random data shifted into a register for easier collection. Width set by rng_shift_width parameter.")
         ])
         self.status = CSRStatus(fields=[
             CSRField("fresh", size=1, description="When set, the rand register contains a fresh set of bits to be read; cleaned by reading the `rand` register")
         ])
+        self.level = CSRStatus(bits_for(fifo_depth), name="level", description="""Number of words in the FIFO""")
+        self.watermark = CSRStorage(bits_for(fifo_depth), reset=fifo_depth//4, name="watermark",
+            description="""The ``lowwater`` interrupt fires when the number of words in the FIFO falls below this""")
 
-        rand_strobe = Signal()
-        rand_strobe_r = Signal()
-        rand_cnt = Signal(max=self.rand.size)
-        self.sync += [
-            rand_strobe_r.eq(rand_strobe),
+        self.rct_cutoff = CSRStorage(8, reset=41, name="rct_cutoff",
+            description="""The Repetition Count Test fails when a bit is repeated this many times in a row""")
+        self.apt_cutoff = CSRStorage(bits_for(apt_window), reset=793 if apt_window == 1024 else apt_window, name="apt_cutoff",
+            description="""The Adaptive Proportion Test fails when the first bit of a window shows up this many times in it""")
+        self.health_ctl = CSRStorage(fields=[
+            CSRField("clear",  size=1, description="Clear the failure flags of ``health``", pulse=True),
+            CSRField("nogate", size=1, description="Keep queueing words into the FIFO when a health test fails", reset=0),
+        ])
+        self.health = CSRStatus(fields=[
+            CSRField("rct",   size=1, description="Set when the Repetition Count Test has failed"),
+            CSRField("apt",   size=1, description="Set when the Adaptive Proportion Test has failed"),
+            CSRField("ready", size=1, description="Set once a first full window has been tested since the TRNG was enabled"),
+        ])
+        self.health_pairs = CSRStatus(pairs, name="health_pairs", description="""Pairs that have failed a health test since ``health_ctl.clear`` was last written""")
+        self.rct_failures = CSRStatus(16, name="rct_failures", description="""Number of Repetition Count Test failures, all pairs together, saturating""")
+        self.apt_failures = CSRStatus(16, name="apt_failures", description="""Number of Adaptive Proportion Test failures, all pairs together, saturating""")
 
-            If(self.rand.we,
-               rand_cnt.eq(0),
-               self.status.fields.fresh.eq(0)
-            ).Else(
-                If(rand_strobe & ~rand_strobe_r,
-                    self.rand.fields.rand.eq(Cat(self.trng_out_sync,self.rand.fields.rand[:-1])),
-                    If(rand_cnt < self.rand.size - 1,
-                       rand_cnt.eq(rand_cnt + 1),
-                       self.status.fields.fresh.eq(0)
-                    ).Else(
-                       self.status.fields.fresh.eq(1)
-                    )
-                )
-            )
-        ]
+        self.submodules.ev = EventManager()
+        self.ev.lowwater   = EventSourcePulse()
+        self.ev.healthfail = EventSourcePulse()
+        self.ev.finalize()
 
         target_period = (1/target_freq)*1e9  # period is in ns
 
-        # make osc available for debug
-        self.trng_fast = Signal()
-        self.trng_slow = Signal()
+        # make osc available for debug, one bit per pair
+        self.trng_fast = Signal(pairs)
+        self.trng_slow = Signal(pairs)
 
         if device_root == 'xc7s50':
             stage_delay = 1.7  # rough delay of each ring oscillator stage (incl routing) in ns
@@ -83,21 +146,240 @@ enough, the fix is to slow down the target_freq parameter.
             print("TrngRingOsc: unsupported device " + device_root)
             return
 
-        x_mid = (x_max - x_min) // 2
+        stages = int((target_period / stage_delay) + 1)
+        if stages % 2 == 0:
+            stages = stages + 1
+
+        # each pair spirals within its own band of columns
+        band = (x_max - x_min + 1) // pairs
+        assert band*(y_max - y_min + 1) >= stages, "TrngRingOsc: too many pairs for the device and target_freq"
+        strobe = Signal(pairs)  # slow oscillators, synchronized to sysclk
+        sample = Signal(pairs)  # raw bits, synchronized to sysclk
+        for pair in range(pairs):
+            self.add_pair(platform, device_root, pair, stages, fast_stages,
+                x_min + pair*band, x_max if pair == pairs - 1 else x_min + (pair + 1)*band - 1, y_min, y_max,
+                strobe[pair], sample[pair])
+
+        # merge the bits of the pairs into one stream: take them in turn, or XOR them together
+        strobe_r = Signal(pairs)
+        rise     = Signal(pairs)
+        pending  = Signal(pairs)
+        held     = Signal(pairs)
+        pick     = Signal(pairs)
+        lead     = Signal(pairs)
+        new_bit  = Signal()  # trng_out_sync holds a new bit
+        enabled  = Signal(pairs)
+        self.comb += [
+            enabled.eq(self.pair_ena.storage & Replicate(self.ctl.fields.ena, pairs)),
+            rise.eq(strobe & ~strobe_r & enabled),
+            pick.eq(pending & (~pending + 1)),  # lowest pending pair
+            lead.eq(enabled & (~enabled + 1)),  # lowest enabled pair paces the XOR
+            If(self.ctl.fields.xor,
+                new_bit.eq((rise & lead) != 0),
+                self.trng_out_sync.eq(reduce(xor, [sample[i] & enabled[i] for i in range(pairs)])),
+            ).Else(
+                new_bit.eq(pending != 0),
+                self.trng_out_sync.eq((held & pick) != 0),
+            )
+        ]
+        self.sync += [
+            strobe_r.eq(strobe),
+            If(self.ctl.fields.xor,
+                pending.eq(0)
+            ).Else(
+                pending.eq(pending & ~pick | rise)
+            ),
+            held.eq(held & ~rise | sample & rise),
+        ]
+
+        rand_cnt = Signal(max=self.rand.size)
+        self.sync += [
+            If(self.rand.we,
+               rand_cnt.eq(0),
+               self.status.fields.fresh.eq(0)
+            ).Else(
+                If(new_bit,
+                    self.rand.fields.rand.eq(Cat(self.trng_out_sync,self.rand.fields.rand[:-1])),
+                    If(rand_cnt < self.rand.size - 1,
+                       rand_cnt.eq(rand_cnt + 1),
+                       self.status.fields.fresh.eq(0)
+                    ).Else(
+                       self.status.fields.fresh.eq(1)
+                    )
+                )
+            )
+        ]
+
+        # collect words for the FIFO, through the von Neumann corrector unless raw bits were asked for
+        self.bus = bus = wishbone.Interface()
+        self.submodules.fifo = fifo = ResetInserter()(SyncFIFOBuffered(32, fifo_depth))
+        pair_half  = Signal()
+        pair_first = Signal()
+        word       = Signal(32)
+        word_cnt   = Signal(5)
+        shift      = Signal()
+        shift_bit  = Signal()
+        push       = Signal()
+        healthy    = Signal()
+        failed     = Signal()  # a health test has failed, and the FIFO is gated
+        self.comb += [
+            If(self.ctl.fields.raw,
+                shift.eq(new_bit),
+                shift_bit.eq(self.trng_out_sync),
+            ).Else(
+                shift.eq(new_bit & pair_half & (self.trng_out_sync != pair_first)),
+                shift_bit.eq(pair_first),
+            ),
+            fifo.din.eq(word),
+            fifo.we.eq(push & healthy),
+        ]
+        self.sync += [
+            push.eq(0),
+            If(new_bit,
+                pair_half.eq(~pair_half),
+                pair_first.eq(self.trng_out_sync),
+            ),
+            If(shift,
+                word.eq(Cat(shift_bit, word[:-1])),
+                word_cnt.eq(word_cnt + 1),
+                If(word_cnt == 31,
+                    push.eq(1)  # push the word as it will be once this bit is in
+                )
+            ),
+        ]
+
+        # wishbone window: each read pops a word, writes are ignored
+        self.sync += [
+            bus.ack.eq(0),
+            bus.err.eq(0),
+            fifo.re.eq(0),
+            If(bus.cyc & bus.stb & ~bus.ack & ~bus.err & ~fifo.re,
+                If(bus.we,
+                    bus.ack.eq(1)
+                ).Elif(fifo.readable & ~failed,
+                    fifo.re.eq(1),
+                    bus.dat_r.eq(fifo.dout),
+                    bus.ack.eq(1)
+                ).Else(
+                    bus.err.eq(1)  # don't hold the bus until the next word, nor make up one
+                )
+            )
+        ]
+
+        low   = Signal()
+        low_r = Signal(reset=1)  # only fire once the level has been up to the watermark
+        self.comb += [
+            self.level.status.eq(fifo.level),
+            low.eq(fifo.level < self.watermark.storage),
+            self.ev.lowwater.trigger.eq(low & ~low_r & self.ctl.fields.ena & self.health.fields.ready),
+        ]
+        self.sync += low_r.eq(low)
+
+        # SP 800-90B health tests, on the raw bits of each pair
+        assert apt_window & (apt_window - 1) == 0, "TrngRingOsc: apt_window must be a power of 2"
+        rct_fail = Signal(pairs)
+        apt_fail = Signal(pairs)
+        ready    = Signal(pairs)
+        restart  = Signal()
+        self.comb += restart.eq(~self.ctl.fields.ena | self.health_ctl.fields.clear)
+        for pair in range(pairs):
+            rct_last  = Signal()
+            rct_count = Signal(8)
+            rct_next  = Signal(9)
+            apt_index = Signal(log2_int(apt_window))
+            apt_first = Signal()
+            apt_count = Signal(bits_for(apt_window))
+            bit       = sample[pair]
+            self.comb += [
+                rct_next.eq(Mux(bit == rct_last, rct_count + 1, 1)),
+                rct_fail[pair].eq(rise[pair] & (rct_next == self.rct_cutoff.storage)),
+                apt_fail[pair].eq(rise[pair] & (apt_index != 0) & (bit == apt_first) &
+                    (apt_count + 1 == self.apt_cutoff.storage)),
+            ]
+            self.sync += [
+                If(rise[pair],
+                    rct_last.eq(bit),
+                    If(rct_next[8],
+                        rct_count.eq(255)
+                    ).Else(
+                        rct_count.eq(rct_next)
+                    ),
+                    apt_index.eq(apt_index + 1),
+                    If(apt_index == 0,
+                        apt_first.eq(bit),
+                        apt_count.eq(1),
+                    ).Elif(bit == apt_first,
+                        apt_count.eq(apt_count + 1),
+                    ),
+                    If(apt_index == apt_window - 1,
+                        ready[pair].eq(1)
+                    ),
+                ),
+                If(restart | ~self.pair_ena.storage[pair],
+                    rct_count.eq(0),
+                    apt_index.eq(0),
+                    ready[pair].eq(0),
+                ),
+            ]
+
+        any_fail = Signal()
+        rct_sum  = Signal(17)
+        apt_sum  = Signal(17)
+        self.comb += [
+            any_fail.eq((rct_fail | apt_fail) != 0),
+            # ready once every enabled pair has been through a window
+            self.health.fields.ready.eq(self.ctl.fields.ena & ((~ready & self.pair_ena.storage) == 0)),
+            failed.eq((self.health.fields.rct | self.health.fields.apt) & ~self.health_ctl.fields.nogate),
+            healthy.eq(self.health.fields.ready & ~failed),
+            fifo.reset.eq(any_fail & ~self.health_ctl.fields.nogate),
+            self.ev.healthfail.trigger.eq(any_fail),
+            rct_sum.eq(self.rct_failures.status + sum(rct_fail[i] for i in range(pairs))),
+            apt_sum.eq(self.apt_failures.status + sum(apt_fail[i] for i in range(pairs))),
+        ]
+        self.sync += [
+            # start afresh: drop the bits of the failed period, and test a whole window again
+            If(self.health_ctl.fields.clear,
+                self.health.fields.rct.eq(0),
+                self.health.fields.apt.eq(0),
+                self.health_pairs.status.eq(0),
+                word_cnt.eq(0),
+                pair_half.eq(0),
+            ),
+            If(rct_fail != 0,
+                self.health.fields.rct.eq(1),
+            ),
+            If(apt_fail != 0,
+                self.health.fields.apt.eq(1),
+            ),
+            If(any_fail,
+                self.health_pairs.status.eq(self.health_pairs.status | rct_fail | apt_fail),
+            ),
+            self.rct_failures.status.eq(Mux(rct_sum[16], 0xffff, rct_sum)),
+            self.apt_failures.status.eq(Mux(apt_sum[16], 0xffff, apt_sum)),
+        ]
+
+    def add_pair(self, platform, device_root, pair, stages, fast_stages, x_min, x_max, y_min, y_max, strobe, sample):
+        """Builds ring oscillator pair number ``pair``, spiralling within the given columns"""
+        x_mid = (x_max + x_min) // 2
         y_mid = (y_max - y_min) // 2
         y_span = y_max - y_min
         x_span = x_max - x_min
 
-        stages = int((target_period / stage_delay) + 1)
-        if stages % 2 == 0:
-            stages = stages + 1
-        ring_cw = Signal(stages+1) # ring oscillator clockwise
-        ring_ccw = Signal(fast_stages+1) # ring oscillator counter-clockwise (fast)
+        # the first pair keeps the names it had when there was only one
+        suffix = "" if pair == 0 else "_pair" + str(pair)
+        ring_cw = Signal(stages+1, name="ring_cw" + suffix) # ring oscillator clockwise
+        ring_ccw = Signal(fast_stages+1, name="ring_ccw" + suffix) # ring oscillator counter-clockwise (fast)
+        trng_raw = self.trng_raw[pair]
+        prefix = 'RINGOSC' + ("" if pair == 0 else str(pair))
 
         x = x_min
         y = y_min
+        placed = set()
         for stage in range(stages):
-            stagename = 'RINGOSC_CW' + str(stage)
+            stagename = prefix + '_CW' + str(stage)
+            assert x_min <= x <= x_max and y_min <= y <= y_max and (x, y) not in placed, \
+                "TrngRingOsc: pair {} does not fit in its band of columns".format(pair)
+            placed.add((x, y))
 
             if device_root == 'xc7s50':
                 platform.toolchain.attr_translate[stagename + 'LOCK'] = ("LOC", "SLICE_X" + str(x) + 'Y' + str(y))
@@ -109,7 +391,7 @@ enough, the fix is to slow down the target_freq parameter.
                                  attr=("KEEP", "DONT_TOUCH", stagename + 'LOCK')
                              )
                 if stage < fast_stages:
-                    stagename = 'RINGOSC_CCW' + str(stage)
+                    stagename = prefix + '_CCW' + str(stage)
                     # initially, share the CLB -- but see if performance is better if the LUTs are spread farther apart
                     platform.toolchain.attr_translate[stagename + 'LOCK'] = ("LOC", "SLICE_X" + str(x) + 'Y' + str(y))
                     self.specials += Instance("LUT1",
@@ -133,7 +415,7 @@ enough, the fix is to slow down the target_freq parameter.
                                           attr=("KEEP", "DONT_TOUCH", stagename + 'LOCK')
                                           )
                 if stage < fast_stages:
-                    stagename = 'RINGOSC_CCW' + str(stage)
+                    stagename = prefix + '_CCW' + str(stage)
                     # initially, share the CLB -- but see if performance is better if the LUTs are spread farther apart
                     platform.toolchain.attr_translate[stagename + 'LOCK'] = ("BEL", "X" + str(x) + '/Y' + str(y) + '/lc1')
                     self.specials += Instance("SB_LUT4",
@@ -176,33 +458,34 @@ enough, the fix is to slow down the target_freq parameter.
 
 
         # close the rings with a power gate
-        self.comb += ring_cw[stages].eq(ring_cw[0] & self.ctl.fields.ena)
-        self.comb += ring_ccw[0].eq(ring_ccw[fast_stages] & self.ctl.fields.ena)
+        ena = Signal(name="ring_ena" + suffix)
+        self.comb += ena.eq(self.ctl.fields.ena & self.pair_ena.storage[pair])
+        self.comb += ring_cw[stages].eq(ring_cw[0] & ena)
+        self.comb += ring_ccw[0].eq(ring_ccw[fast_stages] & ena)
 
         # instantiate the noise slicing flip flop explicitly, don't leave it up to synthesizer to pick a part
         if device_root == 'xc7s50':
             self.specials += Instance("FDCE",
                          i_C=ring_cw[int(stages//2)],
                          i_D=ring_ccw[0],
-                         i_CE=self.ctl.fields.ena,
+                         i_CE=ena,
                          i_CLR=0,
-                         o_Q=self.trng_raw,
+                         o_Q=trng_raw,
                          )
         elif device_root == 'ice40up5k':
             self.specials += Instance("SB_DFFE",
                          i_C=ring_cw[int(stages//2)],
                          i_D=ring_ccw[0], # ccw is fast, ideally, [period of fast osc] < [jitter of slow osc]
-                         i_E=self.ctl.fields.ena,
-                         o_Q=self.trng_raw,
+                         i_E=ena,
+                         o_Q=trng_raw,
                          )
 
         # add multi-regs to synchronize the noise to sysclk
-        self.specials += MultiReg(ring_cw[int(stages // 2)], rand_strobe)
-        self.specials += MultiReg(self.trng_raw, self.trng_out_sync)
+        self.specials += MultiReg(ring_cw[int(stages // 2)], strobe)
+        self.specials += MultiReg(trng_raw, sample)
 
         # wire up debug
         self.comb += [
-            self.trng_slow.eq(ring_cw[0]),
-            self.trng_fast.eq(ring_ccw[0])
+            self.trng_slow[pair].eq(ring_cw[0]),
+            self.trng_fast[pair].eq(ring_ccw[0])
         ]
-
@@ -0,0 +1,265 @@
+# Python models of I2C targets, for the migen simulation of RTLI2C (see sim_i2c.py).
+#
+# I2CBus is a sys-domain generator that decodes the open-drain bus from its scl and sda lines, as seen
+# once per cycle, and hands the bytes to the target whose address matches; the targets only deal in bytes.
+# Lines are pulled low by setting scl_pull and sda_pull. The bus also keeps the counts the tests use
+# to work out the bus utilization. Times are in sys cycles.
+
+from migen.sim import passive
+
+START = "start"
+STOP  = "stop"
+
+
+class I2CTarget:
+    """Base class of the targets: ACKs its address and every byte, reads back 0xff
+
+    A target with ``stretch`` set holds SCL low for that many cycles before each ACK it sends
+    and before each byte it sends, as a slow device would while it gets the data ready.
+    """
+    def __init__(self, address, stretch=0):
+        self.address = address
+        self.stretch = stretch
+        self.bus     = None  # set when attached
+
+    def start(self, read):
+        """Addressed after a (repeated) start condition; returns whether to ACK"""
+        return True
+
+    def write(self, byte):
+        """Byte written by the controller; returns whether to ACK"""
+        return True
+
+    def read(self):
+        """Next byte for the controller to read"""
+        return 0xff
+
+    def stop(self):
+        """Stop condition, or repeated start addressing another target"""
+        pass
+
+
+class RegisterFile(I2CTarget):
+    """Register-file device: the first byte written sets the register pointer, which then
+    auto-increments, wrapping around at the end of the register file, on every byte read or written"""
+    def __init__(self, address, size=256, stretch=0):
+        I2CTarget.__init__(self, address, stretch)
+        self.regs    = bytearray(size)
+        self.pointer = 0
+        self.pointer_next = False
+        self.writes  = 0  # number of register writes, for the tests
+
+    def start(self, read):
+        self.pointer_next = not read
+        return True
+
+    def write(self, byte):
+        if self.pointer_next:
+            self.pointer = byte % len(self.regs)
+            self.pointer_next = False
+        else:
+            self.regs[self.pointer] = byte
+            self.pointer = (self.pointer + 1) % len(self.regs)
+            self.writes += 1
+        return True
+
+    def read(self):
+        byte = self.regs[self.pointer]
+        self.pointer = (self.pointer + 1) % len(self.regs)
+        return byte
+
+
+class EEPROM(I2CTarget):
+    """24xx-style EEPROM with a 16-bit address
+
+    Bytes written are latched into a page buffer, wrapping around within the page, and committed
+    on the stop condition. The write cycle then takes ``write_time`` cycles, during which the device
+    NACKs its address, so that the controller has to poll for it. Sequential reads wrap around at
+    the end of the array.
+    """
+    def __init__(self, address=0x50, size=32768, page=64, write_time=50000, stretch=0):
+        I2CTarget.__init__(self, address, stretch)
+        self.mem        = bytearray([0xff]*size)
+        self.page       = page
+        self.write_time = write_time
+        self.pointer    = 0
+        self.adr_bytes  = 0  # address bytes still expected
+        self.pending    = {}
+        self.busy_until = 0
+        self.cycles     = 0  # number of write cycles, for the tests
+
+    def start(self, read):
+        if self.bus.cycle < self.busy_until:
+            return False
+        self.adr_bytes = 0 if read else 2
+        return True
+
+    def write(self, byte):
+        if self.adr_bytes == 2:
+            self.pointer = (byte << 8) % len(self.mem)
+        elif self.adr_bytes == 1:
+            self.pointer = (self.pointer | byte) % len(self.mem)
+        else:
+            self.pending[self.pointer] = byte
+            base = self.pointer - self.pointer % self.page
+            self.pointer = base + (self.pointer + 1) % self.page
+        self.adr_bytes = max(self.adr_bytes - 1, 0)
+        return True
+
+    def read(self):
+        byte = self.mem[self.pointer]
+        self.pointer = (self.pointer + 1) % len(self.mem)
+        return byte
+
+    def stop(self):
+        if self.pending:
+            for (adr, byte) in self.pending.items():
+                self.mem[adr] = byte
+            self.pending = {}
+            self.busy_until = self.bus.cycle + self.write_time
+            self.cycles += 1
+
+
+class I2CBus:
+    """Open-drain bus shared by the controller and the target models"""
+    def __init__(self, scl, sda, scl_pull, sda_pull):
+        self.scl      = scl
+        self.sda      = sda
+        self.scl_pull = scl_pull
+        self.sda_pull = sda_pull
+        self.targets  = {}
+        self.cycle    = 0
+        self.lines    = (1, 1)  # scl and sda, as of the current cycle
+        self.reset_stats()
+
+    def attach(self, target):
+        target.bus = self
+        self.targets[target.address] = target
+
+    def reset_stats(self):
+        self.clocks  = 0  # SCL pulses
+        self.bytes   = 0  # bytes transferred, address bytes included
+        self.nacks   = 0  # address or data bytes NACKed by a target
+        self.busy    = 0  # cycles between start and stop conditions
+        self.stretch = 0  # cycles SCL was held low by the targets
+
+    def _sample(self):
+        """Moves on by a cycle; returns the lines as they were and as they are now"""
+        yield
+        self.cycle += 1
+        last = self.lines
+        self.lines = ((yield self.scl), (yield self.sda))
+        return (last, self.lines)
+
+    def _stretch(self, target):
+        if target.stretch:
+            yield self.scl_pull.eq(1)
+            for i in range(target.stretch):
+                yield from self._sample()
+            yield self.scl_pull.eq(0)
+            self.stretch += target.stretch
+
+    def _rise(self):
+        while True:
+            ((scl_last, _), (scl, sda)) = yield from self._sample()
+            if scl and not scl_last:
+                return sda
+
+    def _clock(self):
+        """Waits for the controller to pulse SCL; returns SDA as seen on the rising edge"""
+        bit = yield from self._rise()
+        self.clocks += 1
+        while (yield from self._sample())[1][0]:
+            pass
+        return bit
+
+    def _bit(self):
+        """Receives a bit, or a start or stop condition"""
+        bit = yield from self._rise()
+        self.clocks += 1
+        while True:
+            ((_, sda_last), (scl, sda)) = yield from self._sample()
+            if not scl:
+                return bit
+            if sda != sda_last:
+                return START if sda == 0 else STOP
+
+    def _byte(self):
+        """Receives a byte, MSB first, or a start or stop condition"""
+        byte = 0
+        for i in range(8):
+            bit = yield from self._bit()
+            if bit in (START, STOP):
+                return bit
+            byte = (byte << 1) | bit
+        self.bytes += 1
+        return byte
+
+    def _ack(self, target, ack):
+        yield self.sda_pull.eq(ack)
+        yield from self._stretch(target)
+        if not ack:
+            self.nacks += 1
+        yield from self._clock()
+        yield self.sda_pull.eq(0)
+
+    def _send(self, target, byte):
+        """Sends a byte, MSB first; returns whether the controller ACKed it"""
+        for i in reversed(range(8)):
+            yield self.sda_pull.eq(not (byte >> i) & 1)
+            if i == 7:
+                yield from self._stretch(target)
+            yield from self._clock()
+        yield self.sda_pull.eq(0)
+        self.bytes += 1
+        return (yield from self._clock()) == 0
+
+    def _condition(self):
+        """Waits for the next start or stop condition"""
+        while True:
+            ((scl_last, sda_last), (scl, sda)) = yield from self._sample()
+            if scl and scl_last and sda != sda_last:
+                return START if sda == 0 else STOP
+
+    def _transaction(self):
+        """Runs a transaction up to the next start or stop condition, and returns it"""
+        adr = yield from self._byte()
+        if adr in (START, STOP):
+            return adr
+        target = self.targets.get(adr >> 1)
+        if target is None:
+            self.nacks += 1
+            yield from self._clock()
+            return (yield from self._condition())
+        ack = target.start(adr & 1)
+        yield from self._ack(target, ack)
+        if not ack:
+            return (yield from self._condition())
+        if adr & 1:
+            while (yield from self._send(target, target.read())):
+                pass
+            condition = yield from self._condition()
+        else:
+            while True:
+                byte = yield from self._byte()
+                if byte in (START, STOP):
+                    condition = byte
+                    break
+                ack = target.write(byte)
+                yield from self._ack(target, ack)
+                if not ack:
+                    condition = yield from self._condition()
+                    break
+        target.stop()
+        return condition
+
+    @passive
+    def run(self):
+        while True:
+            condition = yield from self._condition()
+            if condition != START:
+                continue
+            start = self.cycle
+            while condition == START:
+                condition = yield from self._transaction()
+            self.busy += self.cycle - start
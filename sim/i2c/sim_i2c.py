@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+
+# Migen simulation of RTLI2C against Python models of I2C targets. No CPU, BIOS or Vivado required.
+#
+# The simulator can't run the Verilog byte and bit controllers, so the i2c_master_byte_ctrl instance is
+# replaced by ByteCtrl, a behavioral stand-in with the same ports and handshake, which drives SCL and SDA
+# bit by bit. The bus is modelled as open-drain with pull-ups: the core drives its own scl/sda tristates,
+# and the target models of i2c_models.py pull the lines low through scl_pull and sda_pull.
+#
+# The scenarios go through the byte-level registers, the sequencer (including a NACKed address), EEPROM
+# page write, ACK polling and sequential read through the transfer engine and its DMA bus, a target that
+# stretches the clock, and poll alerts. Each one reports the time from the CSR write that starts it to
+# the interrupt that ends it, and the bus utilization over that time.
+
+import sys
+sys.path.append("../")    # FIXME
+sys.path.append("../../") # FIXME
+
+import lxbuildenv
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import argparse
+
+from migen import *
+from migen.fhdl.specials import Tristate
+
+from litex.soc.interconnect import wishbone
+
+from gateware import i2c
+from i2c_models import I2CBus, RegisterFile, EEPROM
+
+SYS_CLK_FREQ = 4e6   # slow enough that a poll period of a millisecond stays affordable in simulation
+MEM_WORDS    = 256   # DMA buffer, in 32-bit words
+
+# command register bits
+IACK = 0x01
+ACK  = 0x08  # set to NACK
+WR   = 0x10
+RD   = 0x20
+STO  = 0x40
+STA  = 0x80
+
+# sequencer operations
+OP_START = 0
+OP_WRITE = 1
+OP_READ  = 2
+OP_STOP  = 3
+
+# events
+EV_I2C  = 0x1
+EV_SEQ  = 0x2
+EV_POLL = 0x4
+EV_XFER = 0x8
+
+
+class ByteCtrl(Module):
+    """Behavioral stand-in for i2c_master_byte_ctrl, bit controller included
+
+    A command (``start``, ``stop``, ``read``, ``write``) is held until ``cmd_ack``, a one-cycle pulse, as with
+    the Verilog. Each bit takes four phases of ``clk_cnt + 1`` cycles, a start condition five; SCL released by
+    the controller is waited for while a target holds it low. Sending a 1 while SDA reads back low loses
+    arbitration, which releases the bus and pulses ``i2c_al`` instead of ``cmd_ack``.
+    """
+    def __init__(self, ena, clk_cnt, start, stop, read, write, ack_in, din,
+                 cmd_ack, ack_out, dout, i2c_busy, i2c_al,
+                 scl_i, scl_o, scl_oen, sda_i, sda_o, sda_oen, **clocks):
+        scl_rel = Signal(reset=1)  # the lines are released, or pulled low
+        sda_rel = Signal(reset=1)
+        sscl    = Signal(reset=1)  # the lines as sampled
+        ssda    = Signal(reset=1)
+        dscl    = Signal(reset=1)
+        dsda    = Signal(reset=1)
+        busy    = Signal()
+        cnt     = Signal(16)
+        tick    = Signal()  # the phase ends
+        phase   = Signal(3)
+        bits    = Signal(3)
+        tx      = Signal(8)
+        rx      = Signal(8)
+        ack     = Signal()
+        self.comb += [
+            scl_o.eq(0),
+            sda_o.eq(0),
+            scl_oen.eq(scl_rel),
+            sda_oen.eq(sda_rel),
+            dout.eq(rx),
+            ack_out.eq(ack),
+            i2c_busy.eq(busy),
+            tick.eq(cnt == 0),
+        ]
+        # the bus is busy from a start condition to a stop condition, whoever makes them
+        self.sync += [
+            sscl.eq(scl_i),
+            ssda.eq(sda_i),
+            dscl.eq(sscl),
+            dsda.eq(ssda),
+            If(sscl & dscl & dsda & ~ssda,
+                busy.eq(1)
+            ).Elif(sscl & dscl & ~dsda & ssda,
+                busy.eq(0)
+            ),
+        ]
+
+        fsm = FSM(reset_state="IDLE")
+        self.submodules += fsm
+        # the phase counter holds while SCL is released but held low by a target
+        self.sync += \
+            If(fsm.ongoing("IDLE") | tick,
+                cnt.eq(clk_cnt)
+            ).Elif(~(scl_rel & ~sscl),
+                cnt.eq(cnt - 1)
+            )
+
+        def lines(scl, sda):
+            return [NextValue(scl_rel, scl), NextValue(sda_rel, sda)]
+
+        def phases(state, levels, end, sample=[], check=0):
+            # levels gives SCL and SDA for each phase; where check is set, SDA released must read back high
+            fsm.act(state,
+                Case(phase, {i: lines(*level) for (i, level) in enumerate(levels)}),
+                If(check & sda_rel & sscl & ~ssda,
+                    i2c_al.eq(1),
+                    *lines(1, 1),
+                    NextState("IDLE")
+                ).Elif(tick,
+                    If(phase == 2, *sample),
+                    If(phase == len(levels) - 1,
+                        NextValue(phase, 0),
+                        *end
+                    ).Else(
+                        NextValue(phase, phase + 1)
+                    )
+                )
+            )
+
+        fsm.act("IDLE",
+            If(~ena,
+                *lines(1, 1)
+            ).Elif(read | write | stop,
+                NextValue(tx, din),
+                NextValue(bits, 7),
+                NextValue(phase, 0),
+                If(start,
+                    NextState("START")
+                ).Elif(read | write,
+                    NextState("BIT")
+                ).Else(
+                    NextState("STOP")
+                )
+            )
+        )
+        phases("START", [(scl_rel, 1), (1, 1), (1, 0), (1, 0), (0, 0)], [
+            If(read | write,
+                NextState("BIT")
+            ).Else(
+                NextState("STOP")
+            )
+        ], check=phase == 1)
+        bit = Mux(write, tx[7], 1)
+        phases("BIT", [(0, bit), (1, bit), (1, bit), (0, bit)], [
+            NextValue(tx, tx << 1),
+            NextValue(bits, bits - 1),
+            If(bits == 0,
+                NextState("ACK")
+            )
+        ], sample=[NextValue(rx, Cat(ssda, rx[:7]))], check=write)
+        ackbit = Mux(write, 1, ack_in)
+        phases("ACK", [(0, ackbit), (1, ackbit), (1, ackbit), (0, ackbit)], [
+            If(stop,
+                NextState("STOP")
+            ).Else(
+                NextState("DONE")
+            )
+        ], sample=[NextValue(ack, ssda)])
+        phases("STOP", [(0, 0), (1, 0), (1, 0), (1, 1)], [NextState("DONE")])
+        fsm.act("DONE",
+            cmd_ack.eq(1),
+            NextState("IDLE")
+        )
+
+
+class SimPlatform:
+    def add_source(self, filename):
+        pass
+
+
+class Pads:
+    def __init__(self):
+        self.scl = Signal()
+        self.sda = Signal()
+
+
+class Top(Module):
+    def __init__(self):
+        self.pads = Pads()
+        self.submodules.i2c = i2c.RTLI2C(SimPlatform(), self.pads, sys_clk_freq=SYS_CLK_FREQ)
+        self.submodules.mem = wishbone.SRAM(4*MEM_WORDS, bus=self.i2c.dma_bus)
+        # there is no CSR bank, which would bring in the logic of the CSRs themselves (fields, writes from
+        # the device); take it without the bus side, so that the CSRs are still worked through their signals
+        for csr in self.i2c.get_csrs():
+            csr.finalized = True
+            self.submodules += csr
+
+        # open-drain bus: low when the core or a target pulls it low
+        self.scl      = Signal()
+        self.sda      = Signal()
+        self.scl_pull = Signal()
+        self.sda_pull = Signal()
+        core = self.i2c
+        self.comb += [
+            self.scl.eq(~(core.scl.oe & ~core.scl.o) & ~self.scl_pull),
+            self.sda.eq(~(core.sda.oe & ~core.sda.o) & ~self.sda_pull),
+            core.scl.i.eq(self.scl),
+            core.sda.i.eq(self.sda),
+        ]
+
+
+def fragment(top):
+    """Swaps the Verilog byte controller for ByteCtrl, and leaves the bus to Top"""
+    f = top.get_fragment()
+    for special in list(f.specials):
+        if isinstance(special, Tristate):
+            f.specials.remove(special)
+        elif isinstance(special, Instance) and special.of == "i2c_master_byte_ctrl":
+            f.specials.remove(special)
+            ports = {item.name: item.expr for item in special.items if isinstance(item, (Instance.Input, Instance.Output))}
+            f += ByteCtrl(**ports).get_fragment()
+    return f
+
+
+class TB:
+    def __init__(self, top, scl_freq):
+        self.top = top
+        self.i2c = top.i2c
+        self.bus = I2CBus(top.scl, top.sda, top.scl_pull, top.sda_pull)
+        self.prescale = int(SYS_CLK_FREQ/(5*scl_freq)) - 1
+        self.scl_cycles = 4*(self.prescale + 1)  # SCL period, as ByteCtrl makes it
+        self.errors = []
+
+    def check(self, cond, msg):
+        if not cond:
+            self.errors.append(msg)
+            print("FAIL: " + msg)
+
+    def setup(self):
+        yield from self.i2c.prescale.write(self.prescale)
+        yield from self.i2c.control.write(0xc0)  # EN, IEN
+
+    def wait_irq(self, timeout=200000):
+        """Waits for the interrupt, returns the events that are pending and clears them"""
+        ev = self.i2c.ev
+        while not (yield ev.irq) and timeout:
+            yield
+            timeout -= 1
+        self.check(timeout, "timed out waiting for the interrupt")
+        pending = yield ev.pending.status
+        yield from self.clear(pending)
+        return pending
+
+    def clear(self, events):
+        ev = self.i2c.ev
+        yield ev.pending.r.eq(events)
+        yield ev.pending.re.eq(1)
+        yield
+        yield ev.pending.re.eq(0)
+        yield
+
+    def measure(self):
+        self.bus.reset_stats()
+        self.t0 = self.bus.cycle
+
+    def report(self, name, payload):
+        elapsed = self.bus.cycle - self.t0
+        bus = self.bus
+        print("{}: {} bytes in {:.1f} us, {:.1f} kB/s; bus busy {:.1f}%, clocking bits {:.1f}%, stretched {:.1f} us".format(
+            name, payload, elapsed*1e6/SYS_CLK_FREQ, payload*SYS_CLK_FREQ/(1e3*elapsed), 100*bus.busy/elapsed,
+            100*bus.clocks*self.scl_cycles/elapsed, bus.stretch*1e6/SYS_CLK_FREQ))
+        return elapsed
+
+    def pop(self, csr):
+        """Reads a CSR whose reads pop a FIFO, leaving a cycle for the pop"""
+        value = yield from csr.read()
+        yield
+        return value
+
+    def command(self, cmd, txr=None):
+        """Byte-level path: one command, one interrupt"""
+        if txr is not None:
+            yield from self.i2c.txr.write(txr)
+        yield from self.i2c.command.write(cmd)
+        self.check((yield from self.wait_irq()) & EV_I2C, "no i2c_int after command {:#x}".format(cmd))
+        yield from self.i2c.command.write(IACK)
+        yield from self.clear(EV_I2C)  # set again until IACK
+        return (yield from self.i2c.status.read())
+
+    def seq_op(self, op, arg=0, ack=0):
+        yield from self.i2c.seq_op.write(arg | (op << 8) | (ack << 10))
+
+    def seq_run(self):
+        yield from self.i2c.ev.enable.write(EV_SEQ)
+        t_go = self.bus.cycle
+        yield from self.i2c.seq_control.write(1)
+        self.check((yield from self.wait_irq()) & EV_SEQ, "no seq_done")
+        self.latency = self.bus.cycle - t_go
+        return (yield from self.i2c.seq_status.read())
+
+    def xfer(self, dev, reg, length, adr, read, reg16=False):
+        core = self.i2c
+        yield from core.ev.enable.write(EV_XFER)
+        yield from core.xfer_dev.write(dev)
+        yield from core.xfer_reg.write(reg)
+        yield from core.xfer_len.write(length)
+        yield from core.xfer_adr.write(adr)
+        t_go = self.bus.cycle
+        yield from core.xfer_control.write(1 | (read << 1) | (reg16 << 2))
+        self.check((yield from self.wait_irq()) & EV_XFER, "no xfer_done")
+        self.latency = self.bus.cycle - t_go
+        return (yield from core.xfer_status.read())
+
+
+def test_byte_level(tb):
+    """32-byte register read through the byte-level registers, one interrupt per byte"""
+    regs = RegisterFile(0x55)
+    regs.regs[0x10:0x30] = bytes(range(0xa0, 0xc0))
+    tb.bus.attach(regs)
+    yield from tb.i2c.ev.enable.write(EV_I2C)
+
+    tb.measure()
+    tb.check(not (yield from tb.command(STA | WR, 0xaa)) & 0x80, "address NACKed")
+    tb.check(not (yield from tb.command(WR, 0x10)) & 0x80, "register NACKed")
+    tb.check(not (yield from tb.command(STA | WR, 0xab)) & 0x80, "read address NACKed")
+    data = []
+    for i in range(32):
+        last = i == 31
+        yield from tb.command(RD | (ACK | STO if last else 0))
+        data.append((yield from tb.i2c.rxr.read()))
+    tb.report("byte-level read", 32)
+    tb.check(data == list(range(0xa0, 0xc0)), "byte-level read got {}".format(data))
+
+
+def test_sequencer(tb):
+    """The same 32-byte register read through the sequencer, one interrupt in all"""
+    regs = RegisterFile(0x55)
+    regs.regs[0x10:0x30] = bytes(range(0xa0, 0xc0))
+    tb.bus.attach(regs)
+
+    tb.measure()
+    for (op, arg) in [(OP_START, 0xaa), (OP_WRITE, 1), (OP_START, 0xab), (OP_READ, 32), (OP_STOP, 0)]:
+        yield from tb.seq_op(op, arg)
+    yield from tb.i2c.seq_txd.write(0x10)
+    status = yield from tb.seq_run()
+    data = []
+    for i in range(32):
+        data.append((yield from tb.pop(tb.i2c.seq_rxd)))
+    tb.report("sequencer read", 32)
+    print("  {:.1f} us from go to seq_done".format(tb.latency*1e6/SYS_CLK_FREQ))
+    tb.check(status & 0x7 == 0, "sequencer status {:#x}".format(status))  # not busy, no NACK, no lost arbitration
+    tb.check(status >> 8 == 5, "{} operations completed, expected 5".format(status >> 8))
+    tb.check(data == list(range(0xa0, 0xc0)), "sequencer read got {}".format(data))
+
+    # the sequence stops at a target that does not answer
+    for (op, arg) in [(OP_START, 0x20), (OP_WRITE, 1), (OP_STOP, 0)]:
+        yield from tb.seq_op(op, arg)
+    yield from tb.i2c.seq_txd.write(0x00)
+    status = yield from tb.seq_run()
+    tb.check(status & 0x2, "the missing target should have been NACKed")
+    tb.check(status >> 8 == 0, "the sequence should have stopped at the address")
+    tb.check(not (yield from tb.i2c.status.read()) & 0x40, "the bus should be free after the NACK")
+
+
+def test_eeprom(tb):
+    """Page write and sequential read of an EEPROM through the transfer engine, with ACK polling"""
+    eeprom = EEPROM(0x50, write_time=20000)
+    tb.bus.attach(eeprom)
+    mem = tb.top.mem.mem
+
+    page = [(0x5a + 7*i) & 0xff for i in range(64)]
+    for i in range(16):
+        yield mem[i].eq(page[4*i] | (page[4*i + 1] << 8) | (page[4*i + 2] << 16) | (page[4*i + 3] << 24))
+
+    tb.measure()
+    status = yield from tb.xfer(0x50, 0x0140, 64, 0, read=False, reg16=True)
+    tb.report("EEPROM page write", 64)
+    print("  {:.1f} us from go to xfer_done".format(tb.latency*1e6/SYS_CLK_FREQ))
+    tb.check(status == 0, "page write status {:#x}".format(status))
+    tb.check(eeprom.cycles == 1, "{} EEPROM write cycles, expected 1".format(eeprom.cycles))
+    tb.check(list(eeprom.mem[0x140:0x180]) == page, "the page was not written")
+
+    # the EEPROM NACKs its address until the write cycle is over
+    polls = 0
+    while polls < 1000:
+        status = yield from tb.xfer(0x50, 0x0140, 4, 0x100, read=True, reg16=True)
+        if not status & 0x2:
+            break
+        tb.check((yield from tb.i2c.xfer_remain.read()) == 4, "a NACKed poll should leave xfer_remain alone")
+        polls += 1
+    print("  write cycle over after {} polls".format(polls))
+    tb.check(0 < polls < 1000, "ACK polling took {} polls".format(polls))
+
+    tb.measure()
+    status = yield from tb.xfer(0x50, 0x0130, 128, 0x200, read=True, reg16=True)
+    tb.report("EEPROM sequential read", 128)
+    print("  {:.1f} us from go to xfer_done".format(tb.latency*1e6/SYS_CLK_FREQ))
+    tb.check(status == 0, "sequential read status {:#x}".format(status))
+    tb.check((yield from tb.i2c.xfer_remain.read()) == 0, "xfer_remain should be 0")
+    data = []
+    for i in range(32):
+        word = yield mem[0x80 + i]
+        data += [(word >> 8*j) & 0xff for j in range(4)]
+    tb.check(data == list(eeprom.mem[0x130:0x1b0]), "sequential read got {}".format(data))
+
+
+def test_clock_stretching(tb):
+    """Writes to and reads from a target that stretches the clock on every byte"""
+    slow = RegisterFile(0x3c, stretch=200)
+    tb.bus.attach(slow)
+
+    tb.measure()
+    for (op, arg) in [(OP_START, 0x78), (OP_WRITE, 5), (OP_STOP, 0)]:
+        yield from tb.seq_op(op, arg)
+    for byte in [0x20, 0x11, 0x22, 0x33, 0x44]:
+        yield from tb.i2c.seq_txd.write(byte)
+    tb.check((yield from tb.seq_run()) & 0x7 == 0, "stretched write failed")
+    for (op, arg) in [(OP_START, 0x78), (OP_WRITE, 1), (OP_START, 0x79), (OP_READ, 4), (OP_STOP, 0)]:
+        yield from tb.seq_op(op, arg)
+    yield from tb.i2c.seq_txd.write(0x20)
+    tb.check((yield from tb.seq_run()) & 0x7 == 0, "stretched read failed")
+    data = []
+    for i in range(4):
+        data.append((yield from tb.pop(tb.i2c.seq_rxd)))
+    elapsed = tb.report("stretched write and read", 8)
+    tb.check(data == [0x11, 0x22, 0x33, 0x44], "stretched read got {}".format(data))
+    tb.check(0 < tb.bus.stretch < elapsed, "the target should have stretched the clock")
+
+
+def test_poll(tb):
+    """Background polling of a temperature register, with an alert on crossing the threshold"""
+    sensor = RegisterFile(0x48)
+    sensor.regs[0:2] = bytes([0x80, 0x00])  # little-endian 0x0080
+    tb.bus.attach(sensor)
+    core = tb.i2c
+    shadow = core.shadow_sram.mem
+
+    yield from core.ev.enable.write(EV_POLL)
+    yield from core.poll_entry.write(0x48 | (0x00 << 8) | (1 << 16) | (1 << 18) | (1 << 19))  # 2 bytes, watch, enable
+    yield from core.poll_period.write(1)
+    yield from core.poll_threshold.write(0x0100)
+    yield from core.poll_index.write(0)
+    tb.measure()
+    yield from core.poll_control.write(1)
+    for i in range(int(2.5e-3*SYS_CLK_FREQ)):
+        yield
+    tb.check((yield shadow[0]) == 0x0080, "shadow value {:#x}, expected 0x80".format((yield shadow[0])))
+    tb.check((yield from core.poll_alerts.read()) == 0, "no alert expected yet")
+    tb.check(not (yield core.ev.irq), "no interrupt expected yet")
+
+    sensor.regs[0:2] = bytes([0x20, 0x01])
+    t = tb.bus.cycle
+    tb.check((yield from tb.wait_irq()) & EV_POLL, "no poll_alert")
+    print("  alert {:.1f} us after the value crossed the threshold".format((tb.bus.cycle - t)*1e6/SYS_CLK_FREQ))
+    tb.check((yield from core.poll_alerts.read()) == 0x1, "poll_alerts should be 0x1")
+    tb.check((yield from core.poll_errors.read()) == 0, "poll_errors should be 0")
+    tb.check((yield shadow[0]) == 0x0120, "shadow value {:#x}, expected 0x120".format((yield shadow[0])))
+    tb.report("background polling", tb.bus.bytes)
+    yield from core.poll_control.write(0)
+
+
+TESTS = [test_byte_level, test_sequencer, test_eeprom, test_clock_stretching, test_poll]
+
+
+def run(args):
+    errors = []
+    for test in TESTS:
+        if args.test and test.__name__ not in args.test:
+            continue
+        top = Top()
+        tb = TB(top, args.scl_freq)
+
+        def main():
+            yield from tb.setup()
+            yield from test(tb)
+
+        print(test.__name__ + ": " + test.__doc__)
+        run_simulation(fragment(top), [main(), tb.bus.run()], vcd_name=args.vcd)
+        errors += tb.errors
+
+    print("PASS" if not errors else "FAIL: {} errors".format(len(errors)))
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate RTLI2C against I2C target models")
+    parser.add_argument("--scl-freq", type=float, default=400e3, help="SCL frequency, in Hz")
+    parser.add_argument("--test", action="append", help="run only this test (repeatable)")
+    parser.add_argument("--vcd", default=None, help="dump a VCD trace to this file")
+    args = parser.parse_args()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+# Standalone migen simulation of KeyScan against a model of the key matrix. No CPU, BIOS or Vivado required.
+#
+# The matrix model closes the row lines onto the driven columns for the keys held down, and the test then
+# goes through the key event FIFO: make and break events with their keycodes from the keymap, shift and
+# layer keys and the table of held keys, several keys changing in one scan, reported by row and column
+# whatever row the event logic was on when the scan came in, ignored keys, the timestamps, and the FIFO
+# filling up. It goes on with debouncing, changing the debounce window as a scan is stored and with a key
+# held, the scan interval, and the idle mode with wake on any key.
+#
+# The kbd domain runs much faster than the real 32kHz lpclk, to keep the run short; only the ratios matter.
+
+import sys
+sys.path.append("../")    # FIXME
+sys.path.append("../../") # FIXME
+
+import lxbuildenv
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import argparse
+
+from migen import *
+from migen.fhdl.specials import Tristate
+
+from gateware import keyboard
+
+
+ROWS = 3
+COLS = 4
+
+KIND_KEY    = 0
+KIND_SHIFT  = 1
+KIND_LAYER  = 2
+KIND_IGNORE = 3
+
+
+class Pads:
+    def __init__(self):
+        self.row = Signal(ROWS)
+        self.col = Signal(COLS)
+
+
+class SimTristate:
+    """Stands in for the column tristates, which the simulator cannot lower: the pad just follows oe"""
+    @staticmethod
+    def lower(tristate):
+        m = Module()
+        m.comb += tristate.target.eq(tristate.oe & tristate.o)
+        return m
+
+
+class Matrix(Module):
+    def __init__(self, fifo_depth):
+        self.pads = pads = Pads()
+        self.keys = Signal(ROWS*COLS)  # key r, c is down when bit r*COLS + c is set
+        self.time = Signal(16)
+        self.sync += self.time.eq(self.time + 1)
+        for r in range(ROWS):
+            self.comb += pads.row[r].eq(Cat([self.keys[r*COLS + c] & pads.col[c] for c in range(COLS)]) != 0)
+        self.submodules.kbd = keyboard.KeyScan(pads, timestamp=self.time, fifo_depth=fifo_depth)
+
+
+def run(args):
+    dut = Matrix(args.fifo_depth)
+    kbd = dut.kbd
+    scan_len = 4*COLS + 6  # kbd cycles per scan, back to back
+    ratio = args.kbd_period // args.sys_period
+    errors = []
+    state = {"interval": 0}
+
+    def check(cond, msg):
+        if not cond:
+            errors.append(msg)
+            print("FAIL: " + msg)
+
+    def wait_scans(n):
+        for i in range(n * (scan_len + state["interval"]) * ratio):
+            yield
+
+    def set_keys(*keys, between_scans=True):
+        # change the keys while no column is driven, so that a scan sees all of the change or none of it
+        while between_scans and (yield dut.pads.col) != 0:
+            yield
+        yield dut.keys.eq(sum(1 << (r*COLS + c) for (r, c) in keys))
+
+    def scan_end():
+        # the end of a scan, as the last column is let go: what is written now lands while the scan is stored
+        while (yield dut.pads.col) == 0:
+            yield
+        while (yield dut.pads.col) != 0:
+            yield
+
+    def keymap(row, col, code, kind, shift=0, layer=0):
+        yield from kbd.keymap.write(code | (kind << 16) | (col << 20) | (row << 24) | (shift << 28) | (layer << 29))
+
+    def events():
+        # drain the FIFO, one pop per entry
+        result = []
+        while (yield kbd.event.fields.valid):
+            entry = {}
+            for f in ["code", "press", "kind", "row", "col", "time"]:
+                entry[f] = yield getattr(kbd.event.fields, f)
+            result.append(entry)
+            yield kbd.event.we.eq(1)
+            yield
+            yield kbd.event.we.eq(0)
+            yield
+        return result
+
+    def expect(what, got, want):
+        brief = [(e["code"], e["press"], e["kind"], e["row"], e["col"]) for e in got]
+        check(brief == want, "{}: got {}, expected {}".format(what, brief, want))
+
+    def cpu():
+        # keymap: an ordinary key, with shifted and layer 1 entries; a shift key; a layer key; an ignored key
+        for shift in range(2):
+            yield from keymap(1, 2, 0xe1, KIND_SHIFT, shift=shift)
+            for layer in range(2):
+                yield from keymap(2, 3, 0x01, KIND_LAYER, shift=shift, layer=layer)
+            yield from keymap(2, 0, 0x99, KIND_IGNORE, shift=shift)
+        yield from keymap(0, 1, 0x61, KIND_KEY)
+        yield from keymap(0, 1, 0x41, KIND_KEY, shift=1)
+        yield from keymap(0, 1, 0x31, KIND_KEY, layer=1)
+        yield from wait_scans(2)
+
+        # make and break, and the timestamp of the scan that saw them
+        t_press = yield dut.time
+        yield from set_keys((0, 1))
+        yield from wait_scans(2)
+        t_read = yield dut.time
+        ev = yield from events()
+        expect("press", ev, [(0x61, 1, KIND_KEY, 0, 1)])
+        if ev:
+            check(t_press < ev[0]["time"] < t_read, "timestamp {} not within {}-{}".format(ev[0]["time"], t_press, t_read))
+        yield from set_keys()
+        yield from wait_scans(2)
+        expect("release", (yield from events()), [(0x61, 0, KIND_KEY, 0, 1)])
+
+        # shift: the key is released with the keycode it was pressed with, whatever the shift state by then
+        yield from set_keys((1, 2))
+        yield from wait_scans(2)
+        yield from set_keys((1, 2), (0, 1))
+        yield from wait_scans(2)
+        check((yield kbd.modifiers.fields.shifts) == 1, "one shift key should be held")
+        expect("shifted press", (yield from events()), [(0xe1, 1, KIND_SHIFT, 1, 2), (0x41, 1, KIND_KEY, 0, 1)])
+        yield from set_keys((0, 1))
+        yield from wait_scans(2)
+        yield from set_keys()
+        yield from wait_scans(2)
+        check((yield kbd.modifiers.fields.shifts) == 0, "no shift key should be held")
+        expect("shifted release", (yield from events()), [(0xe1, 0, KIND_SHIFT, 1, 2), (0x41, 0, KIND_KEY, 0, 1)])
+
+        # layer, and several keys released in one scan: reported by row, then by column
+        yield from set_keys((2, 3))
+        yield from wait_scans(2)
+        check((yield kbd.modifiers.fields.layer) == 1, "layer 1 should be selected")
+        yield from set_keys((2, 3), (0, 1))
+        yield from wait_scans(2)
+        yield from kbd.heldindex.write((0 << 4) | 1)
+        yield
+        check((yield kbd.held.fields.down) == 1 and (yield kbd.held.fields.code) == 0x31, "key 0, 1 should be held as 0x31")
+        yield from set_keys()
+        yield from wait_scans(2)
+        check((yield kbd.modifiers.fields.layer) == 0, "layer 0 should be selected")
+        expect("layer", (yield from events()),
+            [(0x01, 1, KIND_LAYER, 2, 3), (0x31, 1, KIND_KEY, 0, 1), (0x31, 0, KIND_KEY, 0, 1), (0x01, 0, KIND_LAYER, 2, 3)])
+
+        # keys on two rows, from scans that start the event logic on each of the rows in turn
+        for skip in range(3):
+            yield from wait_scans(skip)
+            yield from set_keys((2, 1), (0, 0))
+            yield from wait_scans(2)
+            yield from set_keys()
+            yield from wait_scans(2)
+            expect("two rows, {} scans on".format(skip), (yield from events()),
+                [(0, 1, KIND_KEY, 0, 0), (0, 1, KIND_KEY, 2, 1), (0, 0, KIND_KEY, 0, 0), (0, 0, KIND_KEY, 2, 1)])
+
+        # ignored keys are not reported
+        yield from set_keys((2, 0))
+        yield from wait_scans(2)
+        yield from set_keys()
+        yield from wait_scans(2)
+        expect("ignored", (yield from events()), [])
+
+        # more keys than the FIFO holds, in one scan: the rest is held back, and overflow is flagged
+        keys = [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0), (1, 1)]
+        yield from set_keys(*keys)
+        yield from wait_scans(3)
+        check((yield kbd.evstatus.fields.count) == args.fifo_depth, "the FIFO should be full")
+        check((yield kbd.evstatus.fields.overflow) == 1, "overflow should be set")
+        ev = yield from events()
+        # the held back keys get in as the FIFO is drained, with the time of a later scan
+        check(len(set(e["time"] for e in ev[:args.fifo_depth])) == 1, "events of one scan should share a timestamp")
+        yield from wait_scans(2)
+        ev += yield from events()
+        expect("rollover", ev, [(0x61 if k == (0, 1) else 0, 1, KIND_KEY) + k for k in keys])
+        yield from kbd.evcontrol.write(1)
+        yield
+        check((yield kbd.evstatus.fields.overflow) == 0, "overflow should be cleared")
+        yield from set_keys()
+        for i in range(3):
+            yield from wait_scans(1)
+            yield from events()
+        yield from kbd.evcontrol.write(1)
+
+        # debounce: a bouncing key is not reported, a steady one after the window
+        yield from kbd.debounce.write(3)
+        for i in range(3):
+            yield from set_keys((0, 1))
+            yield from wait_scans(1)
+            yield from set_keys()
+            yield from wait_scans(1)
+        expect("bounce", (yield from events()), [])
+        yield from set_keys((0, 1))
+        yield from wait_scans(2)
+        expect("debounce, 2 scans", (yield from events()), [])
+        yield from wait_scans(2)
+        expect("debounce, 4 scans", (yield from events()), [(0x61, 1, KIND_KEY, 0, 1)])
+        yield from set_keys()
+        yield from wait_scans(2)
+        expect("debounced release, 2 scans", (yield from events()), [])
+        yield from wait_scans(2)
+        expect("debounced release, 4 scans", (yield from events()), [(0x61, 0, KIND_KEY, 0, 1)])
+
+        # the window raised from 0 as a scan is stored, with no key down: no key comes up as pressed
+        yield from kbd.debounce.write(0)
+        yield from wait_scans(2)
+        yield from scan_end()
+        yield from kbd.debounce.write(3)
+        yield from wait_scans(4)
+        expect("window raised at the end of a scan", (yield from events()), [])
+
+        # the window raised from 0 with a key held: the release takes the new window, not more
+        yield from kbd.debounce.write(0)
+        yield from set_keys((0, 1))
+        yield from wait_scans(3)
+        expect("press, no debounce", (yield from events()), [(0x61, 1, KIND_KEY, 0, 1)])
+        yield from kbd.debounce.write(3)
+        yield from set_keys()
+        yield from wait_scans(2)
+        expect("release after raising the window, 2 scans", (yield from events()), [])
+        yield from wait_scans(2)
+        expect("release after raising the window, 4 scans", (yield from events()), [(0x61, 0, KIND_KEY, 0, 1)])
+        yield from kbd.debounce.write(0)
+
+        # scan interval
+        yield from kbd.interval.write(args.interval)
+        state["interval"] = args.interval
+        yield from wait_scans(1)
+        state["scans"] = []
+        yield from wait_scans(3)
+        periods = [b - a for (a, b) in zip(state["scans"], state["scans"][1:])]
+        check(len(periods) >= 2 and all(abs(p - (scan_len + args.interval)) <= 2 for p in periods),
+            "scan period {} kbd cycles, expected about {}".format(periods, scan_len + args.interval))
+
+        # idle: all the columns are driven, and a key press starts a scan right away, whatever the interval
+        yield from kbd.interval.write(1000)
+        yield from kbd.idlescans.write(2)
+        state["interval"] = 1000
+        yield from wait_scans(3)
+        check((yield kbd.scanstatus.fields.idle) == 1, "the scanner should be idle")
+        check((yield dut.pads.col) == 2**COLS - 1, "all columns should be driven while idle")
+        t_press = yield dut.time
+        yield from set_keys((0, 1), between_scans=False)
+        while not (yield kbd.event.fields.valid) and (yield dut.time) - t_press < 1000 * ratio:
+            yield
+        wake = ((yield dut.time) - t_press) // ratio
+        check(wake < 3 * scan_len, "the key was reported {} kbd cycles after being pressed".format(wake))
+        check((yield kbd.scanstatus.fields.idle) == 0, "the scanner should be awake")
+        expect("wake", (yield from events()), [(0x61, 1, KIND_KEY, 0, 1)])
+        state["done"] = True
+
+    def scans():
+        # kbd domain: the start of each scan, when column 0 gets driven
+        cycle = 0
+        col0 = 0
+        while not state.get("done"):
+            col0, last = (yield dut.pads.col[0]), col0
+            if col0 and not last and "scans" in state:
+                state["scans"].append(cycle)
+            cycle += 1
+            yield
+
+    run_simulation(dut, {"sys": [cpu()], "kbd": [scans()]},
+        clocks={"sys": args.sys_period, "kbd": args.kbd_period},
+        special_overrides={Tristate: SimTristate},
+        vcd_name=args.vcd)
+
+    print("PASS" if not errors else "FAIL: {} errors".format(len(errors)))
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate KeyScan against a model of the key matrix")
+    parser.add_argument("--fifo-depth", type=int, default=4, help="depth of the key event FIFO")
+    parser.add_argument("--interval", type=int, default=40, help="scan interval to check, in kbd cycles")
+    parser.add_argument("--sys-period", type=int, default=10, help="sysclk period, in ns")
+    parser.add_argument("--kbd-period", type=int, default=40, help="kbd clock period, in ns")
+    parser.add_argument("--vcd", default=None, help="dump a VCD trace to this file")
+    args = parser.parse_args()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
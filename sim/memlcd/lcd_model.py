@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Bit-accurate model of the SHARP LS032B7DD02 memory LCD, as seen from its serial interface.
+#
+# The model is fed one sample of the SCS/SCLK/SI pins at a time, along with the sample time
+# in seconds. It decodes mode, row address and pixel data into an image of the panel contents
+# (a list of rows, each a list of pixels), and checks the interface timing against the datasheet limits.
+
+
+class LS032B7DD02:
+    width  = 336
+    height = 536
+
+    # Datasheet timing limits, in seconds (see the MemLCD module documentation)
+    timing = {
+        "sclk_period":    1 / 2e6,   # SCLK is 2MHz max
+        "scs_setup":      3e-6,      # SCS rise to first SCLK rise
+        "scs_hold":       1e-6,      # last SCLK fall to SCS fall
+        "scs_low":        1e-6,      # minimum SCS low time between transfers
+        "scs_high_data":  188e-6,    # minimum SCS high time for a data update
+        "scs_high_hold":  12e-6,     # minimum SCS high time for a hold mode or all clear operation
+        "si_setup":       120e-9,    # SI stable before SCLK rise
+        "si_hold":        190e-9,    # SI stable after SCLK rise
+    }
+
+    def __init__(self, check_timing=True, **timing):
+        self.check_timing = check_timing
+        self.timing = dict(self.timing, **timing)
+        self.image = [[1] * self.width for _ in range(self.height)]  # 1 is white
+        self.lines      = []  # (time, row) of every line written, in order
+        self.violations = []  # (time, description) of timing violations
+        self.errors     = []  # (time, description) of protocol errors
+        self.first_scs  = None
+        self.last_scs   = None
+
+        self._scs  = 0
+        self._sclk = 0
+        self._si   = 0
+        self._t_scs_rise  = None
+        self._t_scs_fall  = None
+        self._t_sclk_rise = None
+        self._t_sclk_fall = None
+        self._t_si_change = None
+        self._bits = []
+
+    def _violation(self, t, name, actual):
+        if self.check_timing:
+            self.violations.append((t, "{}: {:.1f}ns, limit {:.1f}ns".format(name, actual * 1e9, self.timing[name] * 1e9)))
+
+    def _check_min(self, t, name, actual):
+        if actual < self.timing[name] - 1e-12:  # sample times are floats; don't trip on rounding
+            self._violation(t, name, actual)
+
+    def sample(self, t, scs, sclk, si):
+        """Process the pin state at time ``t`` (in seconds); call this on every clock of the driver"""
+        if si != self._si:
+            if self._scs and self._t_sclk_rise is not None:
+                self._check_min(t, "si_hold", t - self._t_sclk_rise)
+            self._t_si_change = t
+        if scs and not self._scs:
+            if self._t_scs_fall is not None:
+                self._check_min(t, "scs_low", t - self._t_scs_fall)
+            if self.first_scs is None:
+                self.first_scs = t
+            self._t_scs_rise  = t
+            self._t_sclk_rise = None
+            self._t_sclk_fall = None
+            self._bits = []
+        if scs and sclk and not self._sclk:
+            if self._t_sclk_rise is None:
+                self._check_min(t, "scs_setup", t - self._t_scs_rise)
+            else:
+                self._check_min(t, "sclk_period", t - self._t_sclk_rise)
+            if self._t_si_change is not None:
+                self._check_min(t, "si_setup", t - self._t_si_change)
+            self._t_sclk_rise = t
+            self._bits.append(si)
+        if not sclk and self._sclk:
+            self._t_sclk_fall = t
+        if not scs and self._scs:
+            if self._t_sclk_fall is not None:
+                self._check_min(t, "scs_hold", t - self._t_sclk_fall)
+            self._t_scs_fall = t
+            self.last_scs = t
+            self._decode(t, self._t_scs_rise)
+        self._scs, self._sclk, self._si = scs, sclk, si
+
+    def _decode(self, t, t_start):
+        bits = self._bits
+        if len(bits) < 16:
+            self.errors.append((t, "transfer too short: {} bits".format(len(bits))))
+            return
+        data_mode, all_clear = bits[0], bits[2]
+        if not data_mode or all_clear:
+            self._check_min(t, "scs_high_hold", t - t_start)
+            if all_clear:
+                self.image = [[1] * self.width for _ in range(self.height)]
+            return
+        self._check_min(t, "scs_high_data", t - t_start)
+        pos = 6
+        while True:
+            if len(bits) < pos + 10 + self.width:
+                self.errors.append((t, "line truncated after {} bits".format(len(bits))))
+                return
+            row  = sum(b << i for i, b in enumerate(bits[pos:pos + 10]))
+            data = bits[pos + 10:pos + 10 + self.width]
+            pos += 10 + self.width
+            if 1 <= row <= self.height:
+                self.image[row - 1] = list(data)
+                self.lines.append((t, row))
+            else:
+                self.errors.append((t, "row address {} out of range".format(row)))
+            # Another line follows after a 6-bit preamble; otherwise 16 dummy bits end the transfer
+            if len(bits) >= pos + 6 + 10 + self.width:
+                pos += 6
+            else:
+                if len(bits) - pos != 16:
+                    self.errors.append((t, "expected 16 dummy bits, got {}".format(len(bits) - pos)))
+                return
+
+    @property
+    def refresh_time(self):
+        """Time from the first SCS rise to the last SCS fall, in seconds"""
+        if self.first_scs is None or self.last_scs is None:
+            return 0
+        return self.last_scs - self.first_scs
+
+    def save_pgm(self, filename):
+        """Save the panel contents as a binary PGM image"""
+        with open(filename, "wb") as f:
+            f.write("P5\n{} {}\n255\n".format(self.width, self.height).encode())
+            f.write(bytes(255 * pixel for row in self.image for pixel in row))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# Cycle-accurate migen simulation of MemLCD against a model of the LS032B7DD02 panel.
+#
+# Unlike sim_memlcd.py this needs neither a CPU nor Vivado: the frame buffer is loaded over
+# wishbone, an update is kicked off through the CSRs, and everything clocked out on SCS/SCLK/SI
+# is decoded by the panel model in lcd_model.py. The panel image is then checked against the
+# frame buffer contents, and the interface timing against the datasheet.
+#
+# --text composes a random text layer over the lines, --dma (or --no-fb) fetches them from a
+# frame buffer in simulated main memory, and --ranges queues several update ranges back to back.
+# The lines sent to the panel must be exactly the expected ones, in order.
+#
+# Simulation runs at a few thousand sysclk cycles per second, and a line takes ~370 SCLK cycles,
+# so keep the line range small at the default prescaler. Lowering the prescaler speeds things up
+# considerably, but violates the SCLK and SI timing; use --no-timing in that case. The prescaler
+# must be at least 4 for SCLK to toggle at the expected rate.
+#
+# For example:
+#   ./sim_panel.py --prescaler 4 --no-timing --dma --ranges 3-5,9-8,0-1,535-600 --first 3 --last 5
+#   ./sim_panel.py --prescaler 4 --no-timing --no-fb --text --mode dirty --first 20 --last 23 --dma-err-line 21
+
+import sys
+sys.path.append("../")    # FIXME
+sys.path.append("../../") # FIXME
+
+import lxbuildenv
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import argparse
+import random
+
+from migen import *
+from migen.sim import passive
+
+from gateware import memlcd
+
+from lcd_model import LS032B7DD02
+
+
+class Pads:
+    def __init__(self):
+        self.sclk = Signal()
+        self.scs  = Signal()
+        self.si   = Signal()
+
+
+words_per_line = 11
+glyph_height   = 16
+text_rows      = 33
+text_cols      = 42
+
+
+def line_pattern(line):
+    random.seed(line)
+    return [random.getrandbits(32) for _ in range(10)] + [0xffff]  # last word: 16 pixels, clean
+
+
+def blank_line():
+    return [0xffffffff] * 10 + [0xffff]
+
+
+def parse_ranges(spec):
+    ranges = []
+    for r in spec.split(","):
+        (start, end) = r.split("-")
+        ranges.append((int(start), int(end)))
+    return ranges
+
+
+def text_layer(seed):
+    """Random cell buffer and font; the cells are bytes, indexed [row][column]"""
+    random.seed(seed)
+    font  = [random.getrandbits(8) for _ in range(128 * glyph_height)]
+    cells = [[random.choice([0, random.randrange(1, 256)]) for _ in range(words_per_line * 4)] for _ in range(text_rows)]
+    for row in cells:
+        row[text_cols:] = [0, 0]  # no text row dirty hints; only the frame buffer lines are dirty
+    return (font, cells)
+
+
+def pack(data):
+    """Pack bytes into 32-bit words, lowest address in the LSB"""
+    return [sum(data[i + j] << (8 * j) for j in range(4)) for i in range(0, len(data), 4)]
+
+
+def render(words, line, text):
+    """Pixels of a frame buffer line as the LCD should show them, with the text layer composed over it"""
+    pixels = [(words[i // 32] >> (i % 32)) & 1 for i in range(LS032B7DD02.width)]
+    if text is not None and line <= text_rows * glyph_height:
+        (font, cells) = text
+        (row, glyph_y) = divmod(line - 1, glyph_height)
+        for x in range(LS032B7DD02.width):
+            cell = cells[row][x // 8]
+            if cell != 0:
+                bit = (font[(cell & 0x7f) * glyph_height + glyph_y] >> (x % 8)) & 1
+                pixels[x] = 1 - (bit ^ (cell >> 7))  # a 1 in the font is black, unless inverted
+    return pixels
+
+
+def run(args):
+    pads  = Pads()
+    dut   = memlcd.MemLCD(pads, text_mode=args.text, dma=args.dma, fb_bram=not args.no_fb)
+    panel = LS032B7DD02(check_timing=not args.no_timing)
+    period = 1 / args.sys_clk_freq
+    text   = text_layer(args.first) if args.text else None
+    ranges = parse_ranges(args.ranges) if args.ranges else [(args.first, args.last)]
+
+    # Frame buffer contents: the drawn lines, white everywhere else
+    fb = {line: blank_line() for line in range(1, panel.height + 1)}
+    for line in range(args.first, args.last + 1):
+        fb[line] = line_pattern(line)
+        if args.mode == "dirty":
+            fb[line][-1] |= 0x10000
+
+    # Lines that should be sent, in order
+    if args.mode == "range":
+        sent = []
+        for (start, end) in ranges:
+            sent += range(min(end, panel.height), max(start, 1) - 1, -1)
+    elif args.mode == "dirty":
+        sent = list(range(args.last, args.first - 1, -1))
+    else:
+        sent = list(range(panel.height, 0, -1))
+    expected = [[1] * panel.width for _ in range(panel.height)]
+    for line in sent:
+        expected[line - 1] = render(fb[line], line, text)
+
+    # DMA frame buffer in main memory, as word address -> word
+    dma_mem = {}
+    dma_err = set()
+    if args.dma:
+        for (line, words) in fb.items():
+            for (i, word) in enumerate(words):
+                adr = (args.dma_base + (line - 1) * args.dma_stride) // 4 + i
+                dma_mem[adr] = word
+                if line == args.dma_err_line:
+                    dma_err.add(adr)
+
+    result = {}
+
+    def driver():
+        yield dut.prescaler.storage.eq(args.prescaler)
+        if args.dma:
+            yield dut.dmamode.storage.eq(1)
+            yield dut.dma_base.storage.eq(args.dma_base)
+            yield dut.dma_stride.storage.eq(args.dma_stride)
+        else:
+            for line in range(args.first, args.last + 1):
+                for (i, word) in enumerate(fb[line]):
+                    yield from dut.bus.write((line - 1) * words_per_line + i, word)
+        if args.text:
+            (font, cells) = text
+            for (i, word) in enumerate(pack(font)):
+                yield from dut.bus.write(dut.font_base // 4 + i, word)
+            for (i, word) in enumerate(pack([cell for row in cells for cell in row])):
+                yield from dut.bus.write(dut.text_base // 4 + i, word)
+            yield dut.textmode.storage.eq(1)
+        if args.mode == "range":
+            for (start, end) in ranges:
+                yield from dut.update_range.write(start | (end << 10))
+                yield from dut.command.write(4)
+        elif args.mode == "dirty":
+            yield from dut.command.write(1)
+        else:
+            yield from dut.command.write(2)
+
+    @passive
+    def dma_slave():
+        bus = dut.dma_bus
+        while True:
+            cyc = yield bus.cyc
+            stb = yield bus.stb
+            ack = (yield bus.ack) | (yield bus.err)
+            if cyc and stb and not ack:
+                adr = yield bus.adr
+                yield bus.dat_r.eq(dma_mem.get(adr, 0))
+                if adr in dma_err or adr not in dma_mem:
+                    yield bus.err.eq(1)
+                else:
+                    yield bus.ack.eq(1)
+            else:
+                yield bus.ack.eq(0)
+                yield bus.err.eq(0)
+            yield
+
+    def monitor():
+        cycle = 0
+        seen_busy = False
+        while True:
+            scs  = yield pads.scs
+            sclk = yield pads.sclk
+            si   = yield pads.si
+            panel.sample(cycle * period, scs, sclk, si)
+            busy = yield dut.busy.status
+            if busy:
+                seen_busy = True
+            elif seen_busy:
+                break
+            cycle += 1
+            yield
+        for i in range(2):
+            yield
+        stats = ["cycles", "lines", "scan", "scs"] + (["stall"] if args.dma else [])
+        for stat in stats:
+            result[stat] = yield getattr(dut, "stat_" + stat).status
+        if args.dma:
+            result["dma_err"] = yield dut.dma_status.fields.err
+
+    generators = [driver(), monitor()]
+    if args.dma:
+        generators.append(dma_slave())
+    run_simulation(dut, generators, vcd_name=args.vcd)
+
+    rows = [row for (t, row) in panel.lines]
+    print("lines sent:    {} ({})".format(len(rows), " ".join(str(row) for row in rows)))
+    print("refresh time:  {:.1f}us ({:.1f}us/line)".format(panel.refresh_time * 1e6,
+        panel.refresh_time * 1e6 / max(len(rows), 1)))
+    print("busy cycles:   {} (scan {}, scs {}{}), {} lines".format(result["cycles"], result["scan"], result["scs"],
+        ", stall {}".format(result["stall"]) if args.dma else "", result["lines"]))
+    for (t, msg) in panel.errors:
+        print("protocol error at {:.3f}us: {}".format(t * 1e6, msg))
+    for (t, msg) in panel.violations:
+        print("timing violation at {:.3f}us: {}".format(t * 1e6, msg))
+    ok = not (panel.errors or panel.violations)
+    if args.dma and result["dma_err"] != (args.dma_err_line is not None):
+        print("dma_status.err is {}".format(result["dma_err"]))
+        ok = False
+    if rows != sent:
+        print("expected lines {}".format(" ".join(str(row) for row in sent)))
+        ok = False
+    for line in range(1, panel.height + 1):
+        if panel.image[line - 1] != expected[line - 1]:
+            print("line {} does not match the frame buffer".format(line))
+            ok = False
+    if args.pgm:
+        panel.save_pgm(args.pgm)
+
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate MemLCD against a model of the LS032B7DD02 panel")
+    parser.add_argument("--mode", choices=["range", "dirty", "all"], default="range", help="type of update to run")
+    parser.add_argument("--first", type=int, default=1, help="first line to draw")
+    parser.add_argument("--last", type=int, default=2, help="last line to draw")
+    parser.add_argument("--ranges", default=None, help="comma-separated start-end line ranges to queue in range mode, "
+                        "instead of just the drawn lines")
+    parser.add_argument("--text", action="store_true", help="build with the text layer, and compose random text over the lines")
+    parser.add_argument("--dma", action="store_true", help="build with DMA and fetch the lines from a frame buffer in memory")
+    parser.add_argument("--no-fb", action="store_true", help="build without the local frame buffer (implies --dma)")
+    parser.add_argument("--dma-base", type=lambda x: int(x, 0), default=0x40000000, help="byte address of the DMA frame buffer")
+    parser.add_argument("--dma-stride", type=int, default=44, help="distance between lines of the DMA frame buffer, in bytes")
+    parser.add_argument("--dma-err-line", type=int, default=None, help="return a bus error for the DMA fetches of this line")
+    parser.add_argument("--prescaler", type=int, default=99, help="SCLK prescaler")
+    parser.add_argument("--sys-clk-freq", type=float, default=100e6, help="sysclk frequency, used for timing checks")
+    parser.add_argument("--no-timing", action="store_true", help="skip the datasheet timing checks")
+    parser.add_argument("--pgm", default=None, help="save the resulting panel image to this PGM file")
+    parser.add_argument("--vcd", default=None, help="dump a VCD trace to this file")
+    args = parser.parse_args()
+    if args.no_fb:
+        args.dma = True
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+# Standalone migen benchmark of the COM SPI link: SPIMaster wired straight to SPISlaveBurst,
+# with separate sys, spi and spislave clock domains. No CPU, BIOS or Vivado required.
+#
+# Measures the per-transaction overhead of a single-word exchange through the original
+# tx/go/done interface: the latency from "go" to csn falling, how long csn stays low, and when
+# status.done becomes visible in the sys domain. done is raised before the last bit time is over,
+# so a transaction is only counted as finished once csn is back up as well.
+#
+# Then streams randomized blocks of words through the FIFOs, checks that every word made it
+# across intact in both directions, and reports the throughput, the start-up latency from the
+# first word being queued to csn falling, and the time spent on top of the bits on the wire,
+# up to csn rising after the last word.
+#
+# SPISlaveBurst only handles 16-bit words, so with --width 8 the bytes are streamed in bursts of
+# an even length, and each pair of bytes makes up one slave word. With --div, SCLK runs freely
+# at the divided rate, and the simulated spislave clock is lined up with it by a short calibration
+# run first.
+#
+# Runs that should all pass:
+#   ./bench_spi.py --burst --late
+#   ./bench_spi.py --width 32 --late
+#   ./bench_spi.py --div 2 --late --count 5 --blocks 8
+#   ./bench_spi.py --div 3 --late --burst --count 5 --blocks 8
+#   ./bench_spi.py --width 8 --div 3 --late --count 5 --blocks 8
+
+import sys
+sys.path.append("../")    # FIXME
+sys.path.append("../../") # FIXME
+
+import lxbuildenv
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import argparse
+import random
+
+from migen import *
+
+from gateware import spi
+
+
+class Pads:
+    def __init__(self):
+        self.miso = Signal()
+        self.mosi = Signal()
+        self.sclk = Signal()
+        self.csn  = Signal(reset=1)
+
+
+class Loopback(Module):
+    def __init__(self):
+        self.pads = Pads()
+        self.submodules.master = spi.SPIMaster(self.pads, sim=True)
+        self.submodules.slave  = spi.SPISlaveBurst(self.pads, sim=True)
+
+
+def stats(values, unit):
+    return "min {:.1f}{u} avg {:.1f}{u} max {:.1f}{u}".format(min(values), sum(values) / len(values), max(values), u=unit)
+
+
+def sclk_phase(args, sys_period, spi_period):
+    """Time of an SCLK rising edge, modulo the SCLK period, once config.div is set at the start of the run"""
+    dut = Loopback()
+    edges = []
+    state = {"set": False}
+
+    def set_div():
+        yield from dut.master.config.write(args.div)
+        state["set"] = True
+
+    def find_edge():
+        # SCLK only changes on rising edges of the spi clock, the first one being at spi_period/2.
+        # Count those edges from the start, and skip the full rate clock seen before the divider
+        # reaches the spi domain. A generator sees the value SCLK took on the previous edge.
+        cycle = 0
+        settle = None
+        sclk = 0
+        while not edges:
+            sclk, last = (yield dut.pads.sclk), sclk
+            if state["set"] and settle is None:
+                settle = cycle + 4 * 2 * args.div
+            if settle is not None and cycle >= settle and sclk and not last:
+                edges.append(spi_period // 2 + (cycle - 1) * spi_period)
+            cycle += 1
+            yield
+
+    run_simulation(dut, {"sys": [set_div()], "spi": [find_edge()]},
+        clocks={"sys": sys_period, "spi": spi_period, "spislave": spi_period})
+    return edges[0] % (2 * args.div * spi_period)
+
+
+def run(args):
+    dut = Loopback()
+    master, slave = dut.master, dut.slave
+    sys_period = 10  # ns
+    spi_period = int(round(1e9 / args.spi_clk_freq))
+    if args.div:
+        sclk_period = 2 * args.div * spi_period
+        # the simulator starts a (period, phase) clock low, and first raises it at period/2 - phase
+        spislave_clock = (sclk_period, (sclk_period // 2 - sclk_phase(args, sys_period, spi_period)) % sclk_period)
+    else:
+        sclk_period = spi_period
+        spislave_clock = (spi_period, spi_period // 2)
+    words = [random.getrandbits(16) for _ in range(args.count)]
+    replies = [random.getrandbits(16) for _ in range(args.count)]
+    results = {"start": [], "end": [], "done": [], "total": [], "rx": [], "slave": []}
+
+    def slave_settle():
+        # the slave only picks up its next word from the TX FIFO on SCLK edges, through the CDC
+        for i in range(4 * sclk_period // sys_period):
+            yield
+
+    def cpu():
+        if args.div:
+            yield from master.config.write(args.div)
+        for (word, reply) in zip(words, replies):
+            yield from slave.txfifo.write(reply)
+            yield from slave_settle()
+            yield from master.control.write(1) # clrdone
+            yield from master.tx.write(word)
+            for i in range(random.randrange(sclk_period // sys_period + 1)): # vary the phase between the clocks
+                yield
+            yield from master.control.write(2) # go
+            while not (yield master.status.fields.done):
+                yield
+            results["rx"].append((yield master.rx.status))
+            while not (yield slave.status.fields.rxavail):
+                yield
+            results["slave"].append((yield slave.rxfifo.status))
+            yield slave.rxfifo.we.eq(1)
+            yield
+            yield slave.rxfifo.we.eq(0)
+            yield
+
+    @passive
+    def monitor():
+        # done is raised while the last bit time is still on the wire, so a transaction only
+        # counts as over once both done is set and csn is back up
+        cycle = 0
+        t_go = t_csn = t_rise = t_done = None
+        while True:
+            go   = yield master.control.fields.go
+            csn  = yield dut.pads.csn
+            done = yield master.status.fields.done
+            if go:
+                t_go, t_csn, t_rise, t_done = cycle, None, None, None
+            if t_go is not None:
+                if not csn and t_csn is None:
+                    t_csn = cycle
+                if csn and t_csn is not None and t_rise is None:
+                    t_rise = cycle
+                if done and t_done is None:
+                    t_done = cycle
+                if t_rise is not None and t_done is not None:
+                    results["start"].append((t_csn - t_go) * sys_period)
+                    results["end"].append((t_rise - t_csn) * sys_period)
+                    results["done"].append((t_done - t_go) * sys_period)
+                    results["total"].append((max(t_rise, t_done) - t_go) * sys_period)
+                    t_go = None
+            cycle += 1
+            yield
+
+    bits = args.width
+    if bits == 8:
+        # the master sends the low byte of each word; pairs of bytes make up the slave words, MSB first
+        blocks = [[random.getrandbits(8) for _ in range(random.randrange(2, 17, 2))] for _ in range(args.blocks)]
+        slave_rx = [[(block[i] << 8) | block[i + 1] for i in range(0, len(block), 2)] for block in blocks]
+        slave_tx = [[random.getrandbits(16) for _ in range(len(block) // 2)] for block in blocks]
+        echoes = [sum([[word >> 8, word & 0xff] for word in tx], []) for tx in slave_tx]
+    else:
+        blocks = [[random.getrandbits(16) for _ in range(random.randrange(2, 17, 2) if bits == 32 else random.randint(1, 16))]
+            for _ in range(args.blocks)]
+        slave_rx = blocks
+        slave_tx = echoes = [[random.getrandbits(16) for _ in block] for block in blocks]
+    stream = {"now": 0, "mark": None, "rise": None, "start": [], "link": [], "total": [], "rx": [], "slave": []}
+
+    @passive
+    def clock():
+        csn = 1
+        while True:
+            stream["now"] += 1
+            csn, last = (yield dut.pads.csn), csn
+            if stream["mark"] is not None and not csn:
+                stream["start"].append((stream["now"] - stream["mark"]) * sys_period)
+                stream["mark"] = None
+            if csn and not last:
+                stream["rise"] = stream["now"]
+            yield
+
+    def streamer():
+        # wait for the single-word transactions to be over
+        while len(results["slave"]) < args.count:
+            yield
+        yield from master.config.write((args.late << 10) | ({16: 0, 8: 1, 32: 2}[bits] << 8) | args.div)
+        for (block, tx, rx) in zip(blocks, slave_tx, slave_rx):
+            for word in tx:
+                yield from slave.txfifo.write(word)
+            yield from slave_settle()
+            yield from master.control.write((args.burst << 3) | 1) # clrdone
+            t_start = stream["now"]
+            stream["mark"] = t_start
+            for word in block:
+                yield from master.txfifo.write(word)
+            while not (yield master.status.fields.done):
+                yield
+            # the block is over on the wire once csn has come back up after its last word
+            while not (yield dut.pads.csn):
+                yield
+            t_link = stream["rise"]
+            for _ in block:
+                stream["rx"].append((yield master.rxfifo.status))
+                yield master.rxfifo.we.eq(1)
+                yield
+                yield master.rxfifo.we.eq(0)
+                yield
+            stream["total"].append((stream["now"] - t_start) * sys_period)
+            stream["link"].append((t_link - t_start) * sys_period - stream["start"][-1])
+            for _ in rx:
+                while not (yield slave.status.fields.rxavail):
+                    yield
+                stream["slave"].append((yield slave.rxfifo.status))
+                yield slave.rxfifo.we.eq(1)
+                yield
+                yield slave.rxfifo.we.eq(0)
+                yield
+
+    run_simulation(dut, {"sys": [cpu(), monitor(), clock(), streamer()]},
+        clocks={"sys": sys_period, "spi": spi_period, "spislave": spislave_clock},
+        vcd_name=args.vcd)
+
+    ok = results["rx"] == replies and results["slave"] == words
+    print("{} single-word transactions, sysclk 100MHz, SCLK {:.1f}MHz".format(args.count, 1e3 / sclk_period))
+    print("  go to csn low:         " + stats(results["start"], "ns"))
+    print("  csn low to csn high:   " + stats(results["end"], "ns") + " (16 SCLK periods: {}ns)".format(16 * sclk_period))
+    print("  go to done:            " + stats(results["done"], "ns"))
+    print("  go to csn high & done: " + stats(results["total"], "ns"))
+    print("  overhead per word:     {:.1f}ns on top of {}ns of data".format(
+        sum(results["total"]) / len(results["total"]) - 16 * sclk_period, 16 * sclk_period))
+
+    stream_ok = stream["rx"] == sum(echoes, []) and stream["slave"] == sum(slave_rx, [])
+    words = sum(len(block) for block in blocks)
+    # a 32-bit SPI word carries two queued words, so the time on the wire is still 16 bits per queued word
+    word_time = (8 if bits == 8 else 16) * sclk_period
+    wire = [len(block) * word_time for block in blocks]
+    overhead = [(link - ideal) / len(block) for (link, ideal, block) in zip(stream["link"], wire, blocks)]
+    print("{} blocks of up to 16 words through the FIFOs, {}-bit words{}{}".format(args.blocks, bits,
+        ", burst" if args.burst else "", ", late MISO sampling" if args.late else ""))
+    print("  first word to csn low: " + stats(stream["start"], "ns"))
+    print("  overhead per word:     " + stats(overhead, "ns") + " on top of {}ns of data".format(word_time))
+    print("  throughput:            {:.0f} words/s ({:.2f}Mbps), including CSR accesses".format(
+        words / (sum(stream["total"]) * 1e-9), words * word_time / sclk_period / (sum(stream["total"]) * 1e-3)))
+    print("  link throughput:       {:.0f} words/s ({:.2f}Mbps), csn low to csn high".format(
+        words / (sum(stream["link"]) * 1e-9), words * word_time / sclk_period / (sum(stream["link"]) * 1e-3)))
+    ok &= stream_ok
+    print("PASS" if ok else "FAIL: data mismatch")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SPIMaster/SPISlaveBurst link in simulation")
+    parser.add_argument("--count", type=int, default=20, help="number of transactions to run")
+    parser.add_argument("--blocks", type=int, default=20, help="number of blocks to stream")
+    parser.add_argument("--spi-clk-freq", type=float, default=20e6, help="SPI clock frequency")
+    parser.add_argument("--div", type=int, default=0, help="SCLK divider (config.div)")
+    parser.add_argument("--burst", action="store_true", help="hold csn low across words")
+    parser.add_argument("--late", action="store_true", help="sample MISO late")
+    parser.add_argument("--width", type=int, choices=[8, 16, 32], default=16, help="bits per word on the wire")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--vcd", default=None, help="dump a VCD trace to this file")
+    args = parser.parse_args()
+    if args.width == 8:
+        args.burst = True  # keep csn low across the byte pairs that make up a slave word
+    args.burst, args.late = int(args.burst), int(args.late)
+    random.seed(args.seed)
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
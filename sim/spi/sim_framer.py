@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Migen simulation of SPIFramer against a model of the EC, over the SPIMaster/SPISlaveBurst link.
+#
+# The EC model is a sys-domain process that works SPISlaveBurst through its CSRs, the way the EC
+# firmware would: it hunts for request frames in the words it receives, checks their CRC, and queues
+# a reply frame carrying the request payload with every word inverted. Replies can be corrupted on
+# purpose (--corrupt) to exercise the retry logic. Before the requests, a send with txlen above
+# max_words must be refused without anything going out.
+
+import sys
+sys.path.append("../")    # FIXME
+sys.path.append("../../") # FIXME
+
+import lxbuildenv
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import argparse
+import random
+
+from migen import *
+from migen.sim import passive
+
+from gateware import spi
+
+
+class Pads:
+    def __init__(self):
+        self.miso = Signal()
+        self.mosi = Signal()
+        self.sclk = Signal()
+        self.csn  = Signal(reset=1)
+
+
+class Loopback(Module):
+    def __init__(self):
+        self.pads = Pads()
+        self.submodules.master = spi.SPIMaster(self.pads, sim=True)
+        self.submodules.framer = spi.SPIFramer(self.master)
+        self.submodules.slave  = spi.SPISlaveBurst(self.pads, sim=True)
+
+
+def crc(words, crc32):
+    """Reference CRC: CRC-16/CCITT-FALSE or CRC-32/MPEG-2 over 16-bit words, MSB first"""
+    (width, poly) = (32, 0x04c11db7) if crc32 else (16, 0x1021)
+    mask = (1 << width) - 1
+    reg = mask
+    for word in words:
+        for i in reversed(range(16)):
+            fb = ((reg >> (width - 1)) ^ (word >> i)) & 1
+            reg = (reg << 1) & mask
+            if fb:
+                reg ^= poly
+    return [reg >> 16, reg & 0xffff] if crc32 else [reg]
+
+
+def frame(payload, seq, crc32):
+    words = [len(payload), seq] + payload
+    return words + crc(words, crc32)
+
+
+def run(args):
+    dut = Loopback()
+    master, framer, slave = dut.master, dut.framer, dut.slave
+    messages = [[random.getrandbits(16) for _ in range(random.randint(1, args.max_len))] for _ in range(args.count)]
+    log = {"requests": [], "replies": [], "results": []}
+    corrupt = [args.corrupt]
+
+    @passive
+    def ec():
+        # receive side: hunt for a length word, then collect the rest of the frame
+        crc_words = 2 if args.crc32 else 1
+        rx = []
+        while True:
+            if (yield slave.status.fields.rxavail):
+                word = yield slave.rxfifo.status
+                yield slave.rxfifo.we.eq(1)
+                yield
+                yield slave.rxfifo.we.eq(0)
+                if rx or word != 0:
+                    rx.append(word)
+                if rx and len(rx) == rx[0] + 2 + crc_words:
+                    (length, seq, payload) = (rx[0], rx[1], rx[2:2 + rx[0]])
+                    if rx[2 + length:] != crc(rx[:2 + length], args.crc32):
+                        print("EC: request {} failed its CRC check".format(seq))
+                    else:
+                        log["requests"].append((seq, payload))
+                        reply = frame([w ^ 0xffff for w in payload], seq, args.crc32)
+                        if corrupt[0]:
+                            corrupt[0] -= 1
+                            reply[-1] ^= 1
+                        for word in reply:
+                            while (yield slave.status.fields.txfull):
+                                yield
+                            yield from slave.txfifo.write(word)
+                            yield  # txfull only reflects the word just written a cycle later
+                    rx = []
+            yield
+
+    def cpu():
+        yield framer.control.fields.crc32.eq(args.crc32)
+        yield framer.control.fields.retry.eq(args.retry)
+        yield master.control.fields.burst.eq(args.burst)
+        # a request longer than the TX buffer is refused outright
+        yield from framer.txlen.write(257)
+        yield from framer.control.write(1)
+        error = busy = 0
+        for i in range(100):
+            error |= yield framer.ev.error.trigger
+            busy  |= yield framer.status.fields.busy
+            yield
+        log["lenerr"] = (error, busy, (yield framer.status.fields.lenerr), (yield framer.txseq.status))
+        for message in messages:
+            for i in range(0, len(message), 2):
+                word = message[i] | ((message[i + 1] << 16) if i + 1 < len(message) else 0)
+                yield from framer.bus.write(i // 2, word)
+            yield from framer.txlen.write(len(message))
+            seq = yield framer.txseq.status
+            yield from framer.control.write(1 | (args.crc32 << 1) | (args.retry << 2))  # send
+            cycles = 0
+            while not (yield framer.ev.rx_frame.trigger) and not (yield framer.ev.error.trigger):
+                cycles += 1
+                yield
+            yield
+            while (yield framer.status.fields.busy):
+                yield
+            reply = []
+            if (yield framer.status.fields.rxvalid):
+                rxlen = yield framer.rxlen.status
+                for i in range((rxlen + 1) // 2):
+                    word = yield from framer.bus.read(128 + i)
+                    reply += [word & 0xffff, word >> 16]
+                reply = reply[:rxlen]
+                log["replies"].append(((yield framer.rxseq.status), reply))
+            else:
+                log["replies"].append((None, None))
+            log["results"].append((seq, cycles, (yield framer.status.fields.crcerr), (yield framer.status.fields.timeout)))
+        log["crcerrs"] = yield framer.crcerrs.status
+
+    run_simulation(dut, {"sys": [cpu(), ec()]},
+        clocks={"sys": 10, "spi": 50, "spislave": (50, 25)},
+        vcd_name=args.vcd)
+
+    (error, busy, lenerr, seq) = log["lenerr"]
+    print("oversized request: error {}, busy {}, lenerr {}, txseq {}".format(error, busy, lenerr, seq))
+    ok = (error, busy, lenerr, seq) == (1, 0, 1, 0)
+    for (message, (seq, cycles, crcerr, timeout), (rxseq, reply)) in zip(messages, log["results"], log["replies"]):
+        expected = [w ^ 0xffff for w in message]
+        good = rxseq == seq and reply == expected
+        print("request {}: {} words, {} cycles to reply{}{}{}".format(seq, len(message), cycles,
+            ", crc error" if crcerr else "", ", timeout" if timeout else "", "" if good else ", BAD REPLY"))
+        ok &= good
+    print("{} requests seen by the EC, {} CRC errors seen by the framer".format(len(log["requests"]), log["crcerrs"]))
+    ok &= log["crcerrs"] == args.corrupt
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate SPIFramer against a model of the EC")
+    parser.add_argument("--count", type=int, default=4, help="number of requests to send")
+    parser.add_argument("--max-len", type=int, default=24, help="maximum request length, in words")
+    parser.add_argument("--crc32", action="store_true", help="use CRC-32 instead of CRC-16")
+    parser.add_argument("--burst", action="store_true", help="hold csn low across words")
+    parser.add_argument("--retry", action="store_true", help="resend requests whose reply fails its CRC check")
+    parser.add_argument("--corrupt", type=int, default=0, help="number of replies to corrupt")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--vcd", default=None, help="dump a VCD trace to this file")
+    args = parser.parse_args()
+    args.crc32, args.retry, args.burst = int(args.crc32), int(args.retry), int(args.burst)
+    random.seed(args.seed)
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
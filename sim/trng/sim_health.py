@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Migen simulation of the TrngRingOsc health tests. No CPU, BIOS or Vivado required.
+#
+# The ring oscillators are LUT instances, which the simulator can't run, so they are taken out of the
+# design together with the MultiRegs that bring them into sysclk, and the test drives the synchronized
+# strobe and sample bits of each pair instead. Both pairs are fed random bits for a first window, then
+# one of them is forced stuck at 1, which the Repetition Count Test has to catch on the 41st bit, and
+# then biased to four ones out of five, which the Adaptive Proportion Test has to catch on the bit that
+# brings the first bit of the window to 793. The other pair keeps getting random bits throughout.
+
+import sys
+sys.path.append("../")    # FIXME
+sys.path.append("../../") # FIXME
+
+import lxbuildenv
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import argparse
+import random
+
+from migen import *
+from migen.fhdl.structure import _Slice
+from migen.genlib.cdc import MultiReg
+from litex.build.xilinx import XilinxPlatform
+
+from gateware.trng import TrngRingOsc
+
+
+PAIRS = 2
+
+
+class Platform(XilinxPlatform):
+    def __init__(self):
+        XilinxPlatform.__init__(self, "xc7s50-csga324-1IL", [])
+
+
+class Bench(Module):
+    def __init__(self):
+        self.submodules.trng = TrngRingOsc(Platform(), pairs=PAIRS)
+        self.strobe = Signal(PAIRS)  # the slow oscillators, as they come out of their MultiRegs
+        self.sample = Signal(PAIRS)  # the raw bits, likewise
+
+
+def fragment(bench):
+    """Takes the ring oscillators out, and drives their synchronized outputs from the bench instead"""
+    f = bench.get_fragment()
+    trng = bench.trng
+    for special in list(f.specials):
+        if isinstance(special, Instance):
+            f.specials.remove(special)
+        elif isinstance(special, MultiReg) and isinstance(special.o, _Slice):
+            pair = special.o.start
+            if special.i.value is trng.trng_raw:
+                f.comb.append(special.o.eq(bench.sample[pair]))
+            else:
+                f.comb.append(special.o.eq(bench.strobe[pair]))
+            f.specials.remove(special)
+    return f
+
+
+def run(args):
+    bench = Bench()
+    trng = bench.trng
+    rng = random.Random(args.seed)
+    errors = []
+
+    def check(cond, msg):
+        if not cond:
+            errors.append(msg)
+            print("FAIL: " + msg)
+
+    def feed(bit):
+        # one bit on each pair: `bit` on pair 0, random on the others
+        yield bench.sample.eq(bit | (rng.getrandbits(PAIRS - 1) << 1))
+        yield bench.strobe.eq(2**PAIRS - 1)
+        for i in range(args.hold):
+            yield
+        yield bench.strobe.eq(0)
+        for i in range(args.hold):
+            yield
+
+    def first_failure(stream, field):
+        # feed the stream until `field` of health gets set; returns the number of bits it took
+        for (n, bit) in enumerate(stream, 1):
+            yield from feed(bit)
+            if (yield getattr(trng.health.fields, field)):
+                return n
+        return None
+
+    def apt_cutoff_bit(stream, cutoff):
+        # model: the bit on which the first bit of the window shows up `cutoff` times
+        count = 0
+        for (n, bit) in enumerate(stream, 1):
+            count += bit == stream[0]
+            if count == cutoff:
+                return n
+        return None
+
+    def cpu():
+        yield from trng.ctl.write(1)
+
+        # a first window of random bits on every pair: no failure, and ready
+        for i in range(1024):
+            yield from feed(rng.getrandbits(1))
+        check((yield trng.health.fields.ready) == 1, "the tests should be ready after a full window")
+        check((yield trng.health.fields.rct) == 0 and (yield trng.health.fields.apt) == 0,
+            "random bits should pass the tests")
+
+        # stuck at 1: the RCT fails on the 41st bit, and only for the stuck pair
+        n = yield from first_failure([1]*64, "rct")
+        check(n == 41, "the RCT failed after {} stuck bits, expected 41".format(n))
+        check((yield trng.health_pairs.status) == 0b01, "health_pairs is {:#b}, expected 0b1".format((yield trng.health_pairs.status)))
+        check((yield trng.rct_failures.status) == 1, "rct_failures is {}, expected 1".format((yield trng.rct_failures.status)))
+        check((yield trng.health.fields.apt) == 0, "the APT should not have failed yet")
+
+        # biased, four ones out of five: no run is long enough for the RCT, the APT fails on the 793rd one
+        yield from trng.health_ctl.write(1)  # also restarts the window
+        yield
+        check((yield trng.health.fields.rct) == 0 and (yield trng.health_pairs.status) == 0, "clear should reset the flags")
+        stream = [1, 1, 1, 1, 0]*205
+        want = apt_cutoff_bit(stream, 793)
+        n = yield from first_failure(stream, "apt")
+        check(n == want, "the APT failed after {} biased bits, expected {}".format(n, want))
+        check((yield trng.health_pairs.status) == 0b01, "health_pairs is {:#b}, expected 0b1".format((yield trng.health_pairs.status)))
+        check((yield trng.apt_failures.status) == 1, "apt_failures is {}, expected 1".format((yield trng.apt_failures.status)))
+        check((yield trng.health.fields.rct) == 0, "the RCT should not fail on runs of 4")
+
+    run_simulation(fragment(bench), cpu(), vcd_name=args.vcd)
+
+    print("PASS" if not errors else "FAIL: {} errors".format(len(errors)))
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the TrngRingOsc health tests on forced bitstreams")
+    parser.add_argument("--hold", type=int, default=3, help="sysclk cycles each half of a slow oscillator period lasts")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random bits")
+    parser.add_argument("--vcd", default=None, help="dump a VCD trace to this file")
+    args = parser.parse_args()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()